@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Round trips and wall time for pushing events one at a time versus in batches, against an in-process fake of the 
+# Calendar API with a configurable rate of transient failures.
+#
+# 	python bench_calendar_push.py --events 500 --failure-rate 0.05
+
+# Core python modules
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from fake_calendar import FakeCalendarService
+from session import GoogleCalAPI
+
+
+def sample_events(n): 
+
+	return [{
+		'summary': 'Seminar {}'.format(i), 
+		'description': 'Talk {}\nhttp://example.com/{:06d}.html'.format(i, i), 
+		'start': {'dateTime': '2018-03-01T16:00:00', 'timeZone': 'America/New_York'}, 
+		'end': {'dateTime': '2018-03-01T17:00:00', 'timeZone': 'America/New_York'}, 
+		'message': 'not sent to the calendar', 
+		'event_id': i
+	} for i in range(n)]
+
+
+def main(): 
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--events', type=int, default=500)
+	parser.add_argument('--failure-rate', type=float, default=0.05)
+	args = parser.parse_args()
+
+	ids_path = os.path.join(tempfile.mkdtemp(), 'calendar_ids.json')
+	events = sample_events(args.events)
+
+	# One insert per event
+	service = FakeCalendarService(failure_rate=0.0)
+	api = GoogleCalAPI(service=service, calendar_ids_path=ids_path)
+	start = time.perf_counter()
+	for metadata in events: 
+		api.create_event('TALKS-bench', metadata)
+	serial = time.perf_counter() - start
+	print('serial:  {} events, {} round trips, {:.3f}s'.format(len(service.stored_events), service.round_trips, serial))
+
+	# Batched, with transient failures retried
+	service = FakeCalendarService(failure_rate=args.failure_rate)
+	api = GoogleCalAPI(service=service, calendar_ids_path=ids_path, retry_delay=0.01)
+	start = time.perf_counter()
+	results = api.create_events('TALKS-bench', events)
+	batched = time.perf_counter() - start
+
+	created = sum(result is not None for result in results)
+	assert created == len(service.stored_events), 'every reported event exists exactly once'
+	assert all('message' not in event for event in service.stored_events.values())
+	print('batched: {} events, {} round trips in {} batches, {:.3f}s (failure rate {})'.format(created, service.round_trips, service.batches, batched, args.failure_rate))
+
+	# The calendar id is cached on disk, so a fresh client never lists calendars
+	service = FakeCalendarService()
+	GoogleCalAPI(service=service, calendar_ids_path=ids_path).get_calendar_ID('TALKS-bench')
+	print('cached calendar id lookup: {} round trips'.format(service.round_trips))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# API round trips of a full calendar resync, against an in-process fake of the Calendar API. After the first sync
+# the mirror is kept current with sync tokens, so a resync costs round trips for the changed events only.
+#
+# 	python bench_calendar_sync.py --events 2000 --changes 10
+
+# Core python modules
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from fake_calendar import FakeCalendarService
+from bench_calendar_push import sample_events
+from session import GoogleCalAPI
+from manifest import ManifestStore
+from calendar_sync import CalendarSync
+
+
+def main(): 
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--events', type=int, default=2000)
+	parser.add_argument('--changes', type=int, default=10)
+	args = parser.parse_args()
+
+	local_dir = tempfile.mkdtemp()
+	os.makedirs(os.path.join(local_dir, 'bench'))
+
+	manifest = ManifestStore(os.path.join(local_dir, 'bench', 'manifest.db'))
+	with manifest.transaction(): 
+		for metadata in sample_events(args.events): 
+			manifest.append(dict(metadata, is_talk=True, is_correction=False))
+
+	service = FakeCalendarService()
+	api = GoogleCalAPI(service=service, calendar_ids_path=os.path.join(local_dir, 'calendar_ids.json'))
+	sync = CalendarSync('bench', 'TALKS-bench', manifest, api=api, local_listing_dir=local_dir)
+
+	def resync(label): 
+		round_trips, start = service.round_trips, time.perf_counter()
+		counts = sync.reconcile()
+		print('{}: {}, {} round trips, {:.3f}s'.format(label, counts, service.round_trips - round_trips, time.perf_counter() - start))
+
+	resync('initial push')
+	resync('resync, nothing changed')
+
+	# Corrections of some events, and one event that turned out not to be a talk
+	rows = list(manifest.items())
+	with manifest.transaction(): 
+		for row_id, metadata in rows[:args.changes]: 
+			manifest.update(row_id, dict(metadata, summary=metadata['summary'] + ' (moved)', is_correction=True))
+		row_id, metadata = rows[-1]
+		manifest.update(row_id, dict(metadata, is_talk=False))
+	resync('resync, {} corrections and 1 removal'.format(args.changes))
+
+	# A new client with an empty mirror has to list the whole calendar once
+	empty_dir = tempfile.mkdtemp()
+	os.makedirs(os.path.join(empty_dir, 'bench'))
+	sync = CalendarSync('bench', 'TALKS-bench', manifest, api=api, local_listing_dir=empty_dir)
+	resync('resync from an empty mirror')
+
+	manifest.close()
+
+
+if __name__ == "__main__":
+	main()
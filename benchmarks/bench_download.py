@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Compares serial and concurrent ListServe downloads against a local stand-in mailman server.
+#
+# 	python bench_download.py --messages 400 --latency 0.02 --workers 1 8 16
+
+# Core python modules
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from fake_mailman import FakeMailman
+from download_listings import ListServe
+
+
+def run(host, list_id, workers): 
+
+	root = tempfile.mkdtemp()
+	try: 
+		# Session expects credentials relative to the working directory, as when run from `src/`
+		os.makedirs(os.path.join(root, 'credentials'))
+		os.makedirs(os.path.join(root, 'src'))
+		with open(os.path.join(root, 'credentials', 'MIT_login.json'), 'w') as f: 
+			json.dump({'username': 'bench', 'password': 'bench'}, f)
+
+		cwd = os.getcwd()
+		os.chdir(os.path.join(root, 'src'))
+		try: 
+			start = time.perf_counter()
+			l = ListServe(list_id, host, local_listing_dir=os.path.join(root, 'listings'), workers=workers)
+			l.update_local_dir()
+			elapsed = time.perf_counter() - start
+
+			# A second run with nothing new should stop at the conditional requests
+			start = time.perf_counter()
+			changed = ListServe(list_id, host, local_listing_dir=os.path.join(root, 'listings'), workers=workers).has_changes()
+			noop = time.perf_counter() - start
+		finally: 
+			os.chdir(cwd)
+
+		return elapsed, noop, changed, len(l.local_urls)
+	finally: 
+		shutil.rmtree(root)
+
+
+def main(): 
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--messages', type=int, default=400)
+	parser.add_argument('--per-month', type=int, default=50)
+	parser.add_argument('--latency', type=float, default=0.02, help='Seconds of simulated server latency per request')
+	parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 16])
+	args = parser.parse_args()
+
+	fake = FakeMailman(n_messages=args.messages, per_month=args.per_month, latency=args.latency)
+	host = fake.serve()
+
+	try: 
+		results = []
+		for workers in args.workers: 
+			fake.requests = 0
+			elapsed, noop, changed, n = run(host, fake.list_id, workers)
+			results.append({'workers': workers, 'seconds': round(elapsed, 3), 'listings': n, 'requests': fake.requests, 
+							'noop_seconds': round(noop, 4), 'noop_changed': changed})
+
+		for result in results: 
+			print('workers={workers:<3} listings={listings:<6} requests={requests:<6} {seconds:.3f}s   no-op check {noop_seconds:.4f}s (changed: {noop_changed})'.format(**result))
+	finally: 
+		fake.shutdown()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Parse time and peak memory per listing: the targeted `extract_fields` scan against a full BeautifulSoup parse, on 
+# synthetic mailman message pages. Also checks that both return the same fields.
+#
+# 	python bench_extract.py --pages 500 --body-lines 80
+
+# Core python modules
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bs4 import BeautifulSoup
+from fake_mailman import message_page
+from listing import extract_fields
+
+
+def beautifulsoup_fields(text): 
+	# What Listing did before: a complete tree, then three lookups
+	html = BeautifulSoup(text, 'html.parser')
+	return html.title.text, html.pre.text, html.i.text
+
+
+def sample_pages(n, body_lines): 
+
+	random.seed(0)
+	pages = []
+	for i in range(n): 
+		lines = ['Speaker {} &amp; guests will talk about &lt;models&gt; on March {} at {}pm in 32-{}.'.format(i, 1 + i % 28, 1 + i % 6, 100 + i)
+				 for _ in range(body_lines)]
+		lines.insert(3, '<A HREF="http://example.com/{}">http://example.com/{}</A>'.format(i, i))
+		pages.append(message_page('bench', i, 'Seminar: talk {} &quot;quoted&quot;'.format(i), 'Thu Mar  1 10:{:02d}:00 EST 2018'.format(i % 60), '\n'.join(lines)))
+	return pages
+
+
+def measure(fn, pages): 
+
+	start = time.perf_counter()
+	for page in pages: 
+		fn(page)
+	elapsed = (time.perf_counter() - start) / len(pages)
+
+	peak = 0
+	for page in pages[:50]: 
+		tracemalloc.start()
+		fn(page)
+		peak = max(peak, tracemalloc.get_traced_memory()[1])
+		tracemalloc.stop()
+
+	return elapsed, peak
+
+
+def main(): 
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--pages', type=int, default=500)
+	parser.add_argument('--body-lines', type=int, default=80)
+	args = parser.parse_args()
+
+	pages = sample_pages(args.pages, args.body_lines)
+
+	mismatches = sum(extract_fields(page) != beautifulsoup_fields(page) for page in pages)
+
+	for name, fn in [('beautifulsoup', beautifulsoup_fields), ('extract_fields', extract_fields)]: 
+		elapsed, peak = measure(fn, pages)
+		print('{:<15} {:>9.1f} us/listing  {:>9.1f} KiB peak'.format(name, elapsed * 1e6, peak / 1024))
+
+	print('field mismatches: {} of {}'.format(mismatches, len(pages)))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# Measures how long `import listing, events, update_calendar` takes in a fresh interpreter, from a working directory 
+# outside of `src/`, and checks that no JVM was started by the import.
+#
+# 	python bench_import.py --repeat 5
+
+# Core python modules
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+SNIPPET = """
+import sys, time, json
+start = time.perf_counter()
+import listing, events, update_calendar
+elapsed = time.perf_counter() - start
+jvm = 'jpype' in sys.modules and sys.modules['jpype'].isJVMStarted()
+print(json.dumps({'seconds': elapsed, 'jvm_started': bool(jvm)}))
+"""
+
+
+def main(): 
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--budget', type=float, default=1.0, help='Seconds allowed for the import')
+	args = parser.parse_args()
+
+	env = dict(os.environ, PYTHONPATH=os.path.abspath(SRC_DIR))
+
+	results = []
+	for _ in range(args.repeat): 
+		output = subprocess.run([sys.executable, '-c', SNIPPET], cwd=tempfile.gettempdir(), env=env, 
+								check=True, capture_output=True, text=True).stdout
+		results.append(json.loads(output.strip().split('\n')[-1]))
+
+	best = min(result['seconds'] for result in results)
+	jvm_started = any(result['jvm_started'] for result in results)
+
+	print('import listing, events, update_calendar: best {:.3f}s over {} runs, JVM started: {}'.format(best, args.repeat, jvm_started))
+
+	if best > args.budget or jvm_started: 
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
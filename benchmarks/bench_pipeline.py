@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# Stage by stage timings of the whole pipeline on synthetic mailman archives of increasing size: listing discovery,
+# download, Listing.__init__, SUTime annotation, get_location, get_datetime_predictions, Events.get_listing_metadata
+# and manifest persistence. Results are written as JSON; pass an earlier results file with --compare to see which
+# stages got slower.
+#
+# 	python bench_pipeline.py --sizes 100 1000 10000 --output results.json
+# 	python bench_pipeline.py --sizes 100 1000 10000 --compare results.json
+#
+# SUTime is replaced by `sutime_stub.StubSUTime` when the JVM cannot be started (or always, with --sutime stub).
+
+# Core python modules
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import numpy as np
+import listing
+from corpus import synthetic_messages, rooms_csv
+from sutime_stub import StubSUTime
+from fake_mailman import FakeMailman
+from download_listings import ListServe
+from events import Events
+from listing import Listing, annotate_listings
+
+
+class StageTimer(): 
+	# Accumulated wall time and item count per stage, in the order stages were first seen
+
+	def __init__(self): 
+
+		self.stages = OrderedDict()
+
+
+	@contextlib.contextmanager
+	def __call__(self, name, items=1): 
+
+		start = time.perf_counter()
+		try: 
+			yield
+		finally: 
+			stage = self.stages.setdefault(name, {'seconds': 0., 'items': 0})
+			stage['seconds'] += time.perf_counter() - start
+			stage['items']   += items
+
+
+	def report(self): 
+
+		return OrderedDict((name, {'seconds': round(stage['seconds'], 4), 'items': stage['items'],
+								   'us_per_item': round(stage['seconds'] / max(stage['items'], 1) * 1e6, 1)})
+						   for name, stage in self.stages.items())
+
+
+def load_sutime(mode, latency): 
+	# Use the real annotator when asked for or when it can be started, the stub otherwise
+	if mode in ['jvm', 'auto']: 
+		try: 
+			listing.get_sutime()
+			return 'jvm'
+		except Exception: 
+			if mode == 'jvm': raise
+
+	listing._resources['sutime'] = StubSUTime(latency=latency)
+	return 'stub'
+
+
+def run(size, args): 
+
+	messages = synthetic_messages(size, per_month=args.per_month, seed=args.seed)
+	fake = FakeMailman(list_id='benchlist', per_month=args.per_month, messages=messages)
+	host = fake.serve()
+
+	root = tempfile.mkdtemp()
+	cwd = os.getcwd()
+	timer = StageTimer()
+	try: 
+		# Everything expects to run from `src/`, next to `credentials/` and `listings/`
+		for directory in ['credentials', 'src', 'listings']: 
+			os.makedirs(os.path.join(root, directory))
+		with open(os.path.join(root, 'credentials', 'MIT_login.json'), 'w') as f: 
+			json.dump({'username': 'bench', 'password': 'bench'}, f)
+		rooms_csv(os.path.join(root, 'listings', 'mit_rooms.csv'), seed=args.seed)
+		listing.configure(rooms_path=os.path.join(root, 'listings', 'mit_rooms.csv'), cache_dir=os.path.join(root, 'listings', '.cache'))
+		os.chdir(os.path.join(root, 'src'))
+
+		l = ListServe(fake.list_id, host, workers=args.workers)
+		with timer('ListServe.get_new_listings'): 
+			urls = l.get_new_listings()
+
+		with timer('ListServe.save_listing', len(urls)), contextlib.redirect_stdout(io.StringIO()): 
+			if args.workers > 1: 
+				saved = l._save_listings_concurrently(urls)
+			else: 
+				saved = urls
+				for url in urls: l.save_listing(url)
+			l.commit_update(saved)
+
+		events = Events(list_id=fake.list_id, calendar_name='bench')
+
+		with timer('Listing.__init__', len(events.new_urls)): 
+			listings = [Listing(fake.list_id, url.split('/')[-1]) for url in events.new_urls]
+		listings = sorted([x for x in listings if hasattr(x, 'posted_time')], key=lambda x: x.posted_time)
+
+		calls = getattr(listing.get_sutime(), 'calls', None)
+		with timer('annotate_listings', len(listings)): 
+			fast = annotate_listings(listings)
+
+		with timer('Listing.get_location', len(listings)): 
+			for x in listings: x.get_location()
+
+		# Score from the annotated SUTime results rather than the predictions stored by `annotate_listings`
+		for x in listings: x.datetime_predictions = None
+		with timer('Listing.get_datetime_predictions', len(listings)): 
+			for x in listings: x.get_datetime_predictions()
+
+		for x in listings: 
+			with timer('Events.get_listing_metadata'): 
+				metadata = events.get_listing_metadata(None, x)
+			with timer('ManifestStore.append'): 
+				events.manifest.append(metadata)
+
+		counts = {
+			'messages': size,
+			'listings': len(listings),
+			'talks': sum(x.is_talk for x in listings),
+			'fast_path_listings': fast,
+			'events': events.manifest.max_event_id() + 1,
+			'requests': fake.requests
+		}
+		if calls is not None: 
+			counts['sutime_calls'] = listing.get_sutime().calls - calls
+
+		return {'messages': size, 'counts': counts, 'stages': timer.report()}
+	finally: 
+		os.chdir(cwd)
+		fake.shutdown()
+		shutil.rmtree(root)
+
+
+def environment(sutime_mode): 
+
+	try: 
+		commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+								cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+	except OSError: 
+		commit = None
+
+	return {
+		'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'commit': commit,
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'platform': platform.platform(),
+		'sutime': sutime_mode,
+		'fast_path': listing.USE_FAST_PATH
+	}
+
+
+def compare(results, baseline, threshold): 
+	# Print the change of every stage against a previous results file and return the stages that regressed
+	previous = { run['messages']: run['stages'] for run in baseline['runs'] }
+
+	regressions = []
+	for run in results['runs']: 
+		if run['messages'] not in previous: continue
+		for name, stage in run['stages'].items(): 
+			before = previous[run['messages']].get(name)
+			if before is None or before['us_per_item'] == 0: continue
+			ratio = stage['us_per_item'] / before['us_per_item']
+			flag = '  REGRESSION' if ratio > threshold else ''
+			print('{:>7} {:<34} {:>10.1f} -> {:>10.1f} us/item  x{:.2f}{}'.format(run['messages'], name, before['us_per_item'], stage['us_per_item'], ratio, flag))
+			if flag: regressions.append((run['messages'], name, ratio))
+
+	return regressions
+
+
+def main(): 
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Corpus sizes, up to 100000 messages')
+	parser.add_argument('--per-month', type=int, default=500)
+	parser.add_argument('--workers', type=int, default=8)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--sutime', choices=['auto', 'jvm', 'stub'], default='auto')
+	parser.add_argument('--sutime-latency', type=float, default=0.0, help='Seconds added to each stub SUTime call')
+	parser.add_argument('--no-fast-path', action='store_true', help='Send every text to SUTime')
+	parser.add_argument('--output', default='bench_pipeline.json')
+	parser.add_argument('--compare', help='Earlier results file to compare against')
+	parser.add_argument('--threshold', type=float, default=1.2, help='Slowdown ratio reported as a regression')
+	args = parser.parse_args()
+
+	# Per-listing log lines would dominate the timings of the small stages
+	logging.disable(logging.INFO)
+
+	sutime_mode = load_sutime(args.sutime, args.sutime_latency)
+	listing.USE_FAST_PATH = not args.no_fast_path
+	results = {'environment': environment(sutime_mode), 'runs': []}
+
+	for size in args.sizes: 
+		result = run(size, args)
+		results['runs'].append(result)
+
+		print('{} messages ({})'.format(size, ', '.join('{}={}'.format(k, v) for k, v in result['counts'].items())))
+		for name, stage in result['stages'].items(): 
+			print('  {:<34} {:>9.3f}s {:>12.1f} us/item'.format(name, stage['seconds'], stage['us_per_item']))
+
+	with open(args.output, 'w') as f: 
+		json.dump(results, f, indent=2)
+	print('Results written to {}'.format(args.output))
+
+	if args.compare: 
+		with open(args.compare) as f: 
+			regressions = compare(results, json.load(f), args.threshold)
+		if regressions: 
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
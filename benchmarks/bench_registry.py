@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Per-listing cost of URL lookups as the archive grows: the shared URLRegistry against the previous list scans 
+# (`url not in local_urls` and re-reading `urls.txt` for every Listing).
+#
+# 	python bench_registry.py --sizes 1000 10000 100000
+
+# Core python modules
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from url_registry import URLRegistry
+
+
+def legacy_get_url(path, index): 
+	# Previous Listing._get_url
+	with open(path, 'r') as f: 
+		urls = [line.rstrip() for line in f.readlines()]
+	for url in urls: 
+		if index in url: return url
+
+
+def per_listing(fn, samples): 
+
+	start = time.perf_counter()
+	for sample in samples: 
+		fn(sample)
+	return (time.perf_counter() - start) / len(samples)
+
+
+def main(): 
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+	parser.add_argument('--samples', type=int, default=200)
+	parser.add_argument('--legacy', action='store_true', help='Also time the previous list scans (slow at large sizes)')
+	args = parser.parse_args()
+
+	root = tempfile.mkdtemp()
+	try: 
+		print('{:>8} {:>10} {:>14} {:>14} {:>16} {:>16}'.format('size', 'load (s)', 'contains (us)', 'url_for (us)', 'legacy in (us)', 'legacy url (us)'))
+		for size in args.sizes: 
+			path = os.path.join(root, 'urls.{}.txt'.format(size))
+			urls = ['http://mailman.mit.edu/mailman/private/list/{}-{}/{:06d}.html'.format(2000 + i // 12000, i // 1000 % 12, i) for i in range(size)]
+			with open(path, 'w') as f: 
+				f.write('\n'.join(urls))
+
+			start = time.perf_counter()
+			URLRegistry.reset()
+			registry = URLRegistry.load(path)
+			load = time.perf_counter() - start
+
+			samples = random.sample(urls, min(args.samples, size))
+			contains = per_listing(lambda url: url in registry, samples)
+			url_for  = per_listing(lambda url: URLRegistry.load(path).url_for(os.path.basename(url)), samples)
+
+			legacy_in = legacy_url = float('nan')
+			if args.legacy: 
+				legacy_in  = per_listing(lambda url: url in urls, samples)
+				legacy_url = per_listing(lambda url: legacy_get_url(path, os.path.basename(url)), samples[:20])
+
+			print('{:>8} {:>10.4f} {:>14.3f} {:>14.3f} {:>16.3f} {:>16.3f}'.format(size, load, contains * 1e6, url_for * 1e6, legacy_in * 1e6, legacy_url * 1e6))
+	finally: 
+		shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Date/time evidence scoring per listing: the pandas model Listing used to run against `top_scoring` on tuples, on 
+# synthetic evidence. Also checks that both pick the same values.
+#
+# 	python bench_scoring.py --listings 5000
+
+# Core python modules
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import numpy as np
+import pandas as pd
+from listing import evidence_score, top_scoring
+
+
+def pandas_top_scoring(rows, column): 
+	# What `get_datetime_predictions` did before, on `(value, source, format)` rows. A stable sort makes ties go to
+	# the smallest value, as they did on the pinned pandas and numpy; newer numpy versions break ties arbitrarily.
+	df = pd.DataFrame(rows, columns=[column, 'source', 'format']).replace('', np.nan).dropna()
+	df['score'] = df['source'].apply(lambda x: 1.5 if x == 'title' else 1) * \
+					df['format'].apply(lambda x: 1.5 if x == 'dict' else 1)
+	if column == 'time': 
+		df['score'] = df['score'] * df['time'].apply(lambda x: 1 if x[-2:] in ['00', '15', '30', '45'] else 0.5)
+
+	if len(df) == 0: 
+		return "NA"
+	return df[[column, 'score']].groupby(column).sum().sort_values('score', ascending=False, kind='mergesort').index[0]
+
+
+def sample_evidence(n): 
+
+	random.seed(0)
+	listings = []
+	for _ in range(n): 
+		rows = []
+		for _ in range(random.randint(0, 8)): 
+			date = random.choice(['', '2018-03-0{}'.format(random.randint(1, 4))])
+			time = '{:02d}:{}'.format(random.randint(9, 18), random.choice(['00', '30', '10']))
+			rows.append((date, time, random.choice(['title', 'message']), random.choice(['date', 'time', 'datetime', 'dict'])))
+		listings.append(rows)
+	return listings
+
+
+def main(): 
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--listings', type=int, default=5000)
+	args = parser.parse_args()
+
+	listings = sample_evidence(args.listings)
+
+	date_rows = [[(date, source, fmt) for date, _, source, fmt in rows] for rows in listings]
+	time_rows = [[(time, source, fmt) for _, time, source, fmt in rows] for rows in listings]
+
+	def scored(rows, is_time): 
+		return [(value, evidence_score(source, fmt, value if is_time else None)) for value, source, fmt in rows if value != '']
+
+	results = {}
+
+	start = time.perf_counter()
+	results['pandas'] = [(pandas_top_scoring(d, 'date'), pandas_top_scoring(t, 'time')) for d, t in zip(date_rows, time_rows)]
+	timings = [('pandas', time.perf_counter() - start)]
+
+	start = time.perf_counter()
+	results['tuples'] = [(top_scoring(scored(d, False)), top_scoring(scored(t, True))) for d, t in zip(date_rows, time_rows)]
+	timings.append(('tuples', time.perf_counter() - start))
+
+	for name, elapsed in timings: 
+		print('{:<8} {:>9.1f} us/listing'.format(name, elapsed / len(listings) * 1e6))
+
+	mismatches = sum(a != b for a, b in zip(results['pandas'], results['tuples']))
+	print('tuples mismatches against pandas: {} of {}'.format(mismatches, len(listings)))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# Synthetic mailman corpus for benchmarks. Messages follow the mix seen on the MIT lists: talk announcements with
+# dates, times and rooms written in several ways, reminders that repeat an earlier announcement, corrections to
+# an earlier announcement, and messages that are not talks at all.
+
+# Core python modules
+import re
+import random
+from datetime import datetime, timedelta
+
+
+BUILDINGS = ['32', '34', '36', '46', '56', 'E14', 'E25', 'E51', 'E62', 'NE30']
+
+KINDS = ['Seminar', 'Talk', 'Thesis Defense', 'BATS', 'Colloquium']
+TOPICS = ['graph neural networks', 'causal inference', 'robust optimization', 'protein folding', 'sparse recovery',
+		  'reinforcement learning', 'program synthesis', 'quantum error correction', 'climate models', 'privacy']
+FILLER = ['Abstract: We study', 'In this talk I will present', 'Joint work with collaborators on',
+		  'Refreshments will be served before the talk.', 'Bio: The speaker received a PhD in',
+		  'This talk is part of the weekly series on']
+
+# Abstracts are made of pseudo-words, so unrelated announcements share about as much text as real ones do
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vi', 'so', 'pe', 'de', 'ar', 'in', 'ex', 'or', 'ul', 'gra', 'sti', 'pho']
+
+# Ways a talk time is written in announcements. `{h}` is a 12 hour clock hour.
+TIME_FORMATS = ['{h}pm', '{h}:00pm', '{h}:30 PM', '{h}:00-{e}:00pm', '{h}pm - {e}pm']
+
+
+def rooms(n=400, seed=0): 
+	# Room names in the format of the MIT rooms CSV
+	rng = random.Random(seed)
+	return sorted({'{}-{}'.format(rng.choice(BUILDINGS), rng.randint(100, 999)) for _ in range(n)})
+
+
+def rooms_csv(path, n=400, seed=0): 
+
+	with open(path, 'w') as f: 
+		for room in rooms(n, seed): 
+			f.write('{} Room\n'.format(room))
+
+
+def posted_string(posted): 
+	# Pipermail's posted date, e.g. `Thu Mar  1 10:00:00 EST 2018`
+	return posted.strftime('%a %b ') + '{:>2}'.format(posted.day) + posted.strftime(' %H:%M:%S EST %Y')
+
+
+def sentence(rng, start): 
+
+	words = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(6, 16))]
+	return start + ' ' + ' '.join(words) + '.'
+
+
+def announcement(rng, kind, topic, when, room, hour): 
+
+	time_text = rng.choice(TIME_FORMATS).format(h=hour, e=hour + 1)
+	date_text = rng.choice([when.strftime('%A, %B %d'), when.strftime('%B %d, %Y'), when.strftime('%m/%d'), when.strftime('%A')])
+
+	lines = [
+		'{}: {}'.format(kind, topic.title()),
+		'Speaker: Dr. {}'.format(rng.choice(['A. Smith', 'B. Chen', 'C. Okafor', 'D. Novak', 'E. Garcia'])),
+		'Date: {}'.format(date_text),
+		'Time: {}'.format(time_text),
+		'Location: {}'.format(room),
+		''
+	]
+	lines += [sentence(rng, rng.choice(FILLER)) for _ in range(rng.randint(5, 25))]
+
+	return '\n'.join(lines)
+
+
+def synthetic_messages(n, per_month=50, seed=0, reminder_rate=0.2, correction_rate=0.05, other_rate=0.15): 
+	# `n` (subject, posted, body) tuples in posted order. Posted dates follow the monthly batches of `FakeMailman`
+	# when it is given the same `per_month`.
+	rng = random.Random(seed)
+	room_names = rooms(seed=seed)
+
+	messages, talks = [], []
+	for i in range(n): 
+		month_index = i // per_month
+		start = datetime(2018 + month_index // 12, 1 + month_index % 12, 1)
+		posted = start + timedelta(days=min(27, (i % per_month) * 28 // per_month), hours=rng.randint(8, 18), minutes=rng.randint(0, 59))
+
+		roll = rng.random()
+		if talks and roll < reminder_rate: 
+			# Reminder: the same announcement posted again
+			subject, body = rng.choice(talks[-20:])
+			messages.append(('Reminder: ' + subject, posted_string(posted), body))
+			continue
+
+		if talks and roll < reminder_rate + correction_rate: 
+			# Correction: an earlier announcement moved to another room
+			subject, body = rng.choice(talks[-20:])
+			room = rng.choice(room_names)
+			body = re.sub(r'Location: (\S+)', lambda m: 'Location: {} (changed from {})'.format(room, m.group(1)), body, count=1)
+			messages.append(('CORRECTION: ' + subject, posted_string(posted), body))
+			continue
+
+		if roll < reminder_rate + correction_rate + other_rate: 
+			subject = rng.choice(['Job opening', 'Lost umbrella', 'Reading group notes', 'Survey request'])
+			body = '\n'.join(sentence(rng, rng.choice(TOPICS).capitalize()) for _ in range(rng.randint(3, 10)))
+			messages.append((subject, posted_string(posted), body))
+			continue
+
+		kind, topic = rng.choice(KINDS), rng.choice(TOPICS)
+		when = posted + timedelta(days=rng.randint(1, 10))
+		subject = '{}: {} ({})'.format(kind, topic.title(), i)
+		body = announcement(rng, kind, topic, when, rng.choice(room_names), rng.randint(1, 5))
+
+		talks.append((subject, body))
+		messages.append((subject, posted_string(posted), body))
+
+	return messages
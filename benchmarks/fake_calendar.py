@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import random
+import itertools
+
+
+class FakeHttpError(Exception): 
+	# Mirrors the `resp.status` attribute of googleapiclient.errors.HttpError
+
+	class Response(): 
+		def __init__(self, status): 
+			self.status = status
+
+	def __init__(self, status): 
+		super().__init__('HTTP {}'.format(status))
+		self.resp = self.Response(status)
+
+
+class FakeRequest(): 
+
+	def __init__(self, calendar, method, **kwargs): 
+		self.calendar = calendar
+		self.method   = method
+		self.kwargs   = kwargs
+
+	def execute(self): 
+		self.calendar.round_trips += 1
+		return self.calendar._handle(self.method, **self.kwargs)
+
+
+class FakeBatch(): 
+
+	def __init__(self, calendar, callback): 
+		self.calendar = calendar
+		self.callback = callback
+		self.requests = []
+
+	def add(self, request, callback=None, request_id=None): 
+		self.requests.append((request, callback or self.callback, request_id))
+
+	def execute(self): 
+		# A whole batch is a single HTTP round trip
+		self.calendar.round_trips += 1
+		self.calendar.batches += 1
+		for request, callback, request_id in self.requests: 
+			try: 
+				response = self.calendar._handle(request.method, **request.kwargs)
+				callback(request_id, response, None)
+			except FakeHttpError as e: 
+				callback(request_id, None, e)
+
+
+class FakeCalendarService(): 
+	# In-process stand-in for the Google Calendar v3 service object, covering the calls used by GoogleCalAPI. 
+	# `failure_rate` of event writes fail with a retryable 503. Sync tokens are sequence numbers of event changes; 
+	# tokens older than `min_sync_token` are rejected with a 410, as expired tokens are.
+
+	def __init__(self, failure_rate=0.0, seed=0): 
+
+		self.failure_rate = failure_rate
+		self.random = random.Random(seed)
+
+		self.round_trips = 0
+		self.batches     = 0
+
+		self.stored_calendars = {}
+		self.stored_events    = {}
+		self._ids = itertools.count()
+
+		# Deleted events are kept as `cancelled` so incremental listings can report them
+		self.deleted_events = {}
+		self.sequence       = 0
+		self.min_sync_token = 0
+
+
+	# Resource accessors, as on the discovery-based service
+	def calendarList(self): return _Resource(self, 'calendarList')
+	def calendars(self): return _Resource(self, 'calendars')
+	def events(self): return _Resource(self, 'events')
+
+	def new_batch_http_request(self, callback=None): 
+		return FakeBatch(self, callback)
+
+
+	def _handle(self, method, **kwargs): 
+
+		if method == 'calendarList.list': 
+			return { 'items': [ {'id': cid, 'summary': cal['summary']} for cid, cal in self.stored_calendars.items() ] }
+
+		if method == 'calendars.insert': 
+			cid = 'cal{}'.format(next(self._ids))
+			self.stored_calendars[cid] = kwargs['body']
+			return { 'id': cid }
+
+		if method == 'events.list': 
+			return self._list(**kwargs)
+
+		if self.random.random() < self.failure_rate: 
+			raise FakeHttpError(503)
+
+		if method == 'events.insert': 
+			eid = 'evt{}'.format(next(self._ids))
+			self.stored_events[eid] = dict(kwargs['body'], calendarId=kwargs['calendarId'], status='confirmed', id=eid)
+			self._touch(eid)
+			return self._public(self.stored_events[eid])
+
+		if method == 'events.patch': 
+			if kwargs['eventId'] not in self.stored_events: raise FakeHttpError(404)
+			self.stored_events[kwargs['eventId']].update(kwargs['body'])
+			self._touch(kwargs['eventId'])
+			return self._public(self.stored_events[kwargs['eventId']])
+
+		if method == 'events.delete': 
+			if kwargs['eventId'] not in self.stored_events: raise FakeHttpError(410)
+			event = self.stored_events.pop(kwargs['eventId'])
+			self.deleted_events[kwargs['eventId']] = { 'id': event['id'], 'calendarId': event['calendarId'], 'status': 'cancelled' }
+			self._touch(kwargs['eventId'])
+			return ''
+
+		raise NotImplementedError(method)
+
+
+	def _touch(self, eid): 
+
+		self.sequence += 1
+		event = self.stored_events.get(eid) or self.deleted_events[eid]
+		event['_sequence'] = self.sequence
+
+
+	def _public(self, event): 
+
+		return { key: value for key, value in event.items() if key not in ['_sequence', 'calendarId'] }
+
+
+	def _list(self, calendarId, maxResults=250, syncToken=None, pageToken=None): 
+
+		if syncToken is not None: 
+			if int(syncToken) < self.min_sync_token: raise FakeHttpError(410)
+			events = [ e for e in list(self.stored_events.values()) + list(self.deleted_events.values()) if e['_sequence'] > int(syncToken) ]
+		else: 
+			events = list(self.stored_events.values())
+		events = sorted((e for e in events if e['calendarId'] == calendarId), key=lambda e: e['_sequence'])
+
+		start = int(pageToken or 0)
+		response = { 'items': [ self._public(e) for e in events[start:start + maxResults] ] }
+		if start + maxResults < len(events): 
+			response['nextPageToken'] = str(start + maxResults)
+		else: 
+			response['nextSyncToken'] = str(self.sequence)
+
+		return response
+
+
+class _Resource(): 
+
+	def __init__(self, calendar, name): 
+		self.calendar = calendar
+		self.name = name
+
+	def __getattr__(self, method): 
+		return lambda **kwargs: FakeRequest(self.calendar, '{}.{}'.format(self.name, method), **kwargs)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import gzip
+import time
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+
+
+def message_page(list_id, index, subject, posted, body): 
+	# Mimics the layout of a pipermail message page: <title>, <i> posted date and a <pre> body
+	return """<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2//EN">
+<HTML>
+ <HEAD>
+   <TITLE> [{list_id}] {subject}
+   </TITLE>
+ </HEAD>
+ <BODY BGCOLOR="#ffffff">
+   <H1>[{list_id}] {subject}</H1>
+    <B>Organizer</B> 
+    <A HREF="mailto:{list_id}%40mit.edu" TITLE="[{list_id}] {subject}">organizer at mit.edu</A><BR>
+    <I>{posted}</I>
+    <P><UL>
+        <LI>Previous message: <A HREF="{prev:06d}.html">previous</A></li>
+    </ul>
+<!--beginarticle-->
+<PRE>{body}
+</PRE>
+<!--endarticle-->
+</body></html>
+""".format(list_id=list_id, subject=subject, posted=posted, body=body, prev=max(index-1, 0))
+
+
+def mbox_message(list_id, index, subject, posted, body): 
+	# Message as pipermail writes it to the monthly text archive, with `From ` lines in the body escaped
+	body = '\n'.join('>' + line if line.startswith('From ') else line for line in body.split('\n'))
+	return 'From organizer at mit.edu  {}\nFrom: organizer at mit.edu (Organizer)\nSubject: [{}] {}\nMessage-ID: <{}@{}.mit.edu>\n\n{}\n\n'.format(
+		posted.replace(' EST', ''), list_id, subject, index, list_id, body)
+
+
+class FakeMailman(): 
+	# In-memory mailman archive served over HTTP. Messages are grouped into monthly batches. `messages` is an optional
+	# list of (subject, posted, body) tuples, e.g. from `corpus.py`, served instead of the default seminar messages.
+
+	def __init__(self, list_id='fakelist', n_messages=200, per_month=50, latency=0.0, messages=None): 
+
+		self.list_id = list_id
+		self.latency = latency
+
+		self.requests = 0
+		self._lock = threading.Lock()
+
+		self.pages = {}
+		self._build(len(messages) if messages is not None else n_messages, per_month, messages)
+
+
+	def _build(self, n_messages, per_month, messages=None): 
+
+		months = []
+		for start in range(0, n_messages, per_month): 
+			month_index = start // per_month
+			year, month = 2018 + month_index // 12, MONTHS[month_index % 12]
+			batch = '{}-{}'.format(year, month)
+			indices = list(range(start, min(start + per_month, n_messages)))
+			months.append(batch)
+
+			items = ''.join('<LI><A HREF="{:06d}.html">Talk {}</A>\n'.format(i, i) for i in indices)
+			self.pages['/{}/{}/date.html'.format(self.list_id, batch)] = \
+				'<html><body><ul><li>Sorted by date</li></ul><ul>{}</ul></body></html>'.format(items)
+
+			mbox = ''
+			for i in indices: 
+				if messages is not None: 
+					subject, posted, body = messages[i]
+				else: 
+					subject = 'Seminar talk {}'.format(i)
+					posted = 'Mon {} {} 10:00:00 EST {}'.format(month[:3], 1 + i % 28, year)
+					body = 'Seminar {} will be held on {} {} at 4pm in room 32-123.\n'.format(i, month, 1 + i % 28) * 20
+				self.pages['/{}/{}/{:06d}.html'.format(self.list_id, batch, i)] = \
+					message_page(self.list_id, i, subject, posted, body)
+				mbox += mbox_message(self.list_id, i, subject, posted, body)
+
+			# Monthly text archives, gzipped except for the current month
+			self.pages['/{}/{}.txt'.format(self.list_id, batch)] = mbox.encode()
+			if start + per_month < n_messages: 
+				self.pages['/{}/{}.txt.gz'.format(self.list_id, batch)] = gzip.compress(mbox.encode())
+
+		# Newest batches are listed first, as on the mailman archive home page
+		rows = ''.join('<tr><td><a href="{}/date.html">[ Date ]</a></td></tr>'.format(m) for m in months[::-1])
+		self.pages['/{}'.format(self.list_id)] = '<html><body><table>{}</table></body></html>'.format(rows)
+
+
+	def serve(self): 
+		# Start the server on a free local port and return its host URL
+		fake = self
+
+		class Handler(BaseHTTPRequestHandler): 
+
+			protocol_version = 'HTTP/1.1'
+
+			def _respond(self): 
+				with fake._lock: 
+					fake.requests += 1
+				if fake.latency: time.sleep(fake.latency)
+
+				length = int(self.headers.get('Content-Length') or 0)
+				if length: self.rfile.read(length)
+
+				page = fake.pages.get(self.path.rstrip('/'))
+				body = page if isinstance(page, bytes) else (page or 'not found').encode()
+				etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+
+				if page and self.command == 'GET' and self.headers.get('If-None-Match') == etag: 
+					self.send_response(304)
+					self.send_header('ETag', etag)
+					self.send_header('Content-Length', '0')
+					self.end_headers()
+					return
+
+				self.send_response(200 if page else 404)
+				self.send_header('Content-Type', 'application/octet-stream' if isinstance(page, bytes) else 'text/html')
+				self.send_header('Content-Length', str(len(body)))
+				if page: self.send_header('ETag', etag)
+				self.end_headers()
+				self.wfile.write(body)
+
+			do_GET = _respond
+			do_POST = _respond
+
+			def log_message(self, *args): 
+				pass
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.server.daemon_threads = True
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+		return 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+
+	def shutdown(self): 
+		self.server.shutdown()
+		self.server.server_close()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Stand-in for the SUTime annotator when the JVM or the CoreNLP jars are not available. It recognizes the date and
+# time forms written by `corpus.py` with regular expressions and returns results in SUTime's format, so the rest of
+# the pipeline runs unchanged. Timings that include it measure the pipeline, not the annotator.
+
+# Core python modules
+import re
+import time
+from datetime import datetime, timedelta
+
+
+MONTHS   = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+RANGE_RE   = re.compile(r'\b(\d{1,2})(?::(\d\d))?\s*(?:[ap]m)?\s*-\s*(\d{1,2})(?::(\d\d))?\s*([ap]m)\b', re.IGNORECASE)
+TIME_RE    = re.compile(r'\b(\d{1,2})(?::(\d\d))?\s*([ap]m)\b', re.IGNORECASE)
+DATE_RE    = re.compile(r'\b({})\s+(\d{{1,2}})(?:,\s*(\d{{4}}))?\b'.format('|'.join(MONTHS)))
+WEEKDAY_RE = re.compile(r'\b({})\b'.format('|'.join(WEEKDAYS)))
+
+
+def clock(hour, minute, meridiem): 
+
+	hour = int(hour) % 12 + (12 if meridiem.lower() == 'pm' else 0)
+	return 'T{:02d}:{}'.format(hour, minute or '00')
+
+
+class StubSUTime(): 
+
+	def __init__(self, latency=0.0): 
+
+		# Seconds added to each call, to mimic the cost of a JVM round trip
+		self.latency = latency
+		self.calls = 0
+
+
+	def parse(self, text, reference_date=''): 
+
+		self.calls += 1
+		if self.latency: time.sleep(self.latency)
+
+		reference = datetime.strptime(reference_date, '%Y-%m-%d') if reference_date else datetime(2018, 1, 1)
+		day = reference.strftime('%Y-%m-%d')
+
+		results, taken = [], []
+
+		def add(match, result_type, value): 
+			if any(start < match.end() and match.start() < end for start, end in taken): return
+			taken.append((match.start(), match.end()))
+			results.append({'start': match.start(), 'end': match.end(), 'text': match.group(0), 'type': result_type, 'value': value})
+
+		for m in RANGE_RE.finditer(text): 
+			add(m, 'DURATION', {'begin': clock(m.group(1), m.group(2), m.group(5)), 'end': clock(m.group(3), m.group(4), m.group(5))})
+
+		for m in TIME_RE.finditer(text): 
+			add(m, 'TIME', day + clock(m.group(1), m.group(2), m.group(3)))
+
+		for m in DATE_RE.finditer(text): 
+			year = int(m.group(3) or reference.year)
+			try: add(m, 'DATE', format(datetime(year, MONTHS.index(m.group(1)) + 1, int(m.group(2))), '%Y-%m-%d'))
+			except ValueError: pass
+
+		for m in WEEKDAY_RE.finditer(text): 
+			# Like SUTime, a bare weekday resolves to that day in the week of the reference date
+			weekday = reference + timedelta(days=WEEKDAYS.index(m.group(1)) - reference.weekday())
+			add(m, 'DATE', format(weekday, '%Y-%m-%d'))
+
+		return sorted(results, key=lambda result: result['start'])
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import os
+import re
+import gzip
+import mmap
+import queue
+import threading
+
+# zstd is optional, gzip is used when it is not installed
+try: 
+	import zstandard
+except ImportError: 
+	zstandard = None
+
+
+def compress(data, codec): 
+
+	if codec == 'zstd': return zstandard.ZstdCompressor(level=10).compress(data)
+	if codec == 'gzip': return gzip.compress(data, compresslevel=6)
+	raise ValueError("Unknown codec: {}".format(codec))
+
+
+def decompress(data, codec): 
+
+	if codec == 'zstd': return zstandard.ZstdDecompressor().decompress(data)
+	if codec == 'gzip': return gzip.decompress(data)
+	raise ValueError("Unknown codec: {}".format(codec))
+
+
+def decode_html(data): 
+	# Decode raw page bytes using the charset declared in the page, falling back to UTF-8
+	match = re.search(rb'charset=["\']?([\w-]+)', data[:2048], re.IGNORECASE)
+	if match: 
+		try: return data.decode(match.group(1).decode('ascii'))
+		except (LookupError, UnicodeDecodeError): pass
+
+	return data.decode('utf-8', errors='replace')
+
+
+class ListingArchive(): 
+	# Append-only archive of raw listing pages. Each page is compressed on its own and appended to the current
+	# segment file. `index.tsv` maps listing index -> (segment, offset, length, codec) and is appended only after
+	# the page itself is on disk, so an interrupted write leaves at most some unreferenced bytes in a segment.
+
+	_archives = {}
+
+	def __init__(self, directory, segment_size=64 * 2**20, codec=None): 
+
+		self.directory   = directory
+		self.index_path  = os.path.join(self.directory, 'index.tsv')
+		self.segment_size = segment_size
+		self.codec = codec or ('zstd' if zstandard is not None else 'gzip')
+
+		os.makedirs(self.directory, exist_ok=True)
+
+		self._lock = threading.Lock()
+		self._entries = self._read_index()
+		self._segment = max([entry[0] for entry in self._entries.values()] + [0])
+
+
+	@classmethod
+	def open(cls, directory): 
+		# Archive shared by every user of `directory` within a process
+		key = os.path.abspath(directory)
+		if key not in cls._archives: 
+			cls._archives[key] = cls(directory)
+
+		return cls._archives[key]
+
+
+	################################
+	#####     READ / WRITE     #####
+	################################
+
+	def append(self, index, data): 
+		# Store the raw bytes of listing `index`. A later append for the same index replaces it.
+		block = compress(data, self.codec)
+
+		with self._lock: 
+			path = self._segment_path(self._segment)
+			if os.path.exists(path) and os.path.getsize(path) + len(block) > self.segment_size: 
+				self._segment += 1
+				path = self._segment_path(self._segment)
+
+			with open(path, 'ab') as f: 
+				offset = f.tell()
+				f.write(block)
+				f.flush()
+				os.fsync(f.fileno())
+
+			with open(self.index_path, 'a') as f: 
+				f.write('{}\t{}\t{}\t{}\t{}\n'.format(index, self._segment, offset, len(block), self.codec))
+				f.flush()
+				os.fsync(f.fileno())
+
+			self._entries[index] = (self._segment, offset, len(block), self.codec)
+
+
+	def get(self, index): 
+		# Raw bytes of listing `index`, or None if it is not in the archive
+		entry = self._entries.get(index)
+		if entry is None: return None
+
+		segment, offset, length, codec = entry
+		with open(self._segment_path(segment), 'rb') as f: 
+			f.seek(offset)
+			return decompress(f.read(length), codec)
+
+
+	def iter_records(self, indices=None): 
+		# Stream every listing, or those of `indices`, as (index, raw bytes) in the order they are stored, reading 
+		# each segment sequentially through a memory map
+		by_segment = {}
+		for index, (segment, offset, length, codec) in self._entries.items(): 
+			if indices is not None and index not in indices: continue
+			by_segment.setdefault(segment, []).append((offset, length, codec, index))
+
+		for segment in sorted(by_segment): 
+			with open(self._segment_path(segment), 'rb') as f: 
+				with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m: 
+					for offset, length, codec, index in sorted(by_segment[segment]): 
+						yield index, decompress(m[offset:offset+length], codec)
+
+
+	def __contains__(self, index): 
+		return index in self._entries
+
+	def __len__(self): 
+		return len(self._entries)
+
+	def indices(self): 
+		return list(self._entries)
+
+
+	####################################
+	#####     HELPER FUNCTIONS     #####
+	####################################
+
+	def _segment_path(self, segment): 
+
+		return os.path.join(self.directory, 'segment-{:06d}.dat'.format(segment))
+
+
+	def _read_index(self): 
+
+		entries = {}
+		if not os.path.isfile(self.index_path): 
+			return entries
+
+		with open(self.index_path, 'rb') as f: 
+			data = f.read()
+
+		# A line cut short by a crash is dropped, so the next append starts on a fresh line. Its page is simply 
+		# missing from the archive and will be downloaded again.
+		if not data.endswith(b'\n'): 
+			data = data[:data.rfind(b'\n') + 1]
+			with open(self.index_path, 'r+b') as f: 
+				f.truncate(len(data))
+
+		for line in data.decode('utf-8').splitlines(): 
+			fields = line.split('\t')
+			if len(fields) != 5: continue
+			index, segment, offset, length, codec = fields
+			entries[index] = (int(segment), int(offset), int(length), codec)
+
+		return entries
+
+
+class WriteBehind(): 
+	# Appends pages to a ListingArchive on a background thread, so a download can be handed on without waiting for
+	# the disk. `close` waits for every queued page and returns the indices that were written.
+
+	def __init__(self, archive, max_pending=256): 
+
+		self.archive = archive
+		self.written = []
+		self.errors  = []
+
+		# Bounded, so a slow disk slows the download down instead of holding every page in memory
+		self._queue  = queue.Queue(maxsize=max_pending)
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+
+	def put(self, index, data): 
+
+		self._queue.put((index, data))
+
+
+	def close(self): 
+
+		self._queue.put(None)
+		self._thread.join()
+		return self.written
+
+
+	def _run(self): 
+
+		while True: 
+			item = self._queue.get()
+			if item is None: return
+
+			index, data = item
+			try: 
+				self.archive.append(index, data)
+				self.written.append(index)
+			except Exception as e: 
+				self.errors.append((index, e))
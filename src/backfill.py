@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import os
+import json
+import time
+import logging
+import argparse
+
+# External modules
+from events import Events, iter_saved_listings, parse_listing
+from listing import extract_posted_time
+from archive import decode_html
+from manifest import ManifestStore, row_url
+from update_calendar import LIST_SERVES
+from utils import atomic_write
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter('%(asctime)s - Backfill: %(levelname)s - %(message)s', "%I:%M:%S"))
+logger.addHandler(handler)
+
+
+# Listings parsed, added to the manifest and pushed between two checkpoints
+CHUNK_SIZE = 200
+
+
+class Backfill(): 
+	# Adds every locally stored listing that is missing from a list's manifest, in posted order and in chunks. The
+	# rows of a chunk are committed in one transaction, flagged `push_pending` if they are to be pushed, and the 
+	# checkpoint only advances after that. An interrupted run resumes with the first unfinished chunk and first 
+	# pushes the rows still flagged, so no listing is added twice and no push is lost.
+
+	def __init__(self, list_id, calendar_name, local_listing_dir='../listings/', chunk_size=CHUNK_SIZE, parse_workers=1, dry_run=False): 
+
+		self.list_id  = list_id
+		self.cal_name = calendar_name
+
+		self.local_dir       = os.path.join(local_listing_dir, list_id)
+		self.checkpoint_path = os.path.join(self.local_dir, 'backfill.json')
+
+		self.chunk_size    = chunk_size
+		self.parse_workers = parse_workers
+		self.dry_run       = dry_run
+
+		self.checkpoint = self._read_checkpoint()
+		self.events = None
+
+
+	def run(self): 
+
+		self.events = Events(list_id=self.list_id, calendar_name=self.cal_name, dry_run=self.dry_run)
+
+		if self.checkpoint is None or 'order' not in self.checkpoint: 
+			self.checkpoint = dict(self.checkpoint or {}, order=self.posted_order(self.events.new_urls), done=0,
+								   started=time.strftime('%Y-%m-%dT%H:%M:%S'))
+			self._save_checkpoint()
+		else: 
+			logger.info("Resuming after {} of {} listings".format(self.checkpoint['done'], len(self.checkpoint['order'])))
+
+		# Pushes of the chunk that was interrupted
+		self.push(self.events.manifest.pending())
+
+		order = self.checkpoint['order']
+		started, processed = time.perf_counter(), 0
+		while self.checkpoint['done'] < len(order): 
+			chunk_started = time.perf_counter()
+			chunk = order[self.checkpoint['done']:self.checkpoint['done'] + self.chunk_size]
+
+			with metrics.timer('stage_seconds', stage='backfill_chunk', list=self.list_id): 
+				added, to_push = self.add_chunk(chunk)
+
+			self.checkpoint['done'] += len(chunk)
+			self._save_checkpoint()
+			self.push(to_push)
+
+			processed += added
+			metrics.count('backfill_listings_total', added, list=self.list_id)
+			logger.info("{} of {} listings, {:.1f} listings/s ({:.1f} listings/s overall)".format(
+				self.checkpoint['done'], len(order), added / (time.perf_counter() - chunk_started),
+				processed / (time.perf_counter() - started)))
+
+		self.events.manifest.close()
+		os.remove(self.checkpoint_path)
+		logger.info("Backfill of {} done: {} listings in {:.0f}s".format(self.list_id, processed, time.perf_counter() - started))
+
+		return processed
+
+
+	def posted_order(self, urls): 
+		# Listings are added in posted order, as they would have been by regular updates. Only the posted date is 
+		# read from each page, so listings are parsed once, when their chunk is added. Pages laid out unexpectedly 
+		# and listings saved as individual files are parsed in full.
+		positions = { url: position for position, url in enumerate(urls) }
+
+		posted = []
+		for url, raw in iter_saved_listings(self.list_id, urls): 
+			posted_time = extract_posted_time(decode_html(raw)) if raw is not None else None
+			if posted_time is None: 
+				l = parse_listing(url)
+				if l is None: continue
+				posted_time = l.posted_time
+			posted.append((posted_time, positions[url], url))
+
+		logger.info("{} listings to add to the {} manifest".format(len(posted), self.list_id))
+
+		return [url for _, _, url in sorted(posted)]
+
+
+	def add_chunk(self, urls): 
+		# Listings already in the manifest were added before an interruption. Returns the number of listings added 
+		# and the rows to push.
+		known = self.events.manifest.urls()
+		urls = [url for url in urls if url not in known]
+
+		if self.parse_workers > 1: 
+			listings = self.events.parse_in_processes(urls, self.parse_workers)
+		else: 
+			listings = [l for l in (parse_listing(url, raw) for url, raw in iter_saved_listings(self.list_id, urls)) if l is not None]
+
+		# Rows to push are stored flagged `push_pending`
+		with self.events.manifest.transaction(): 
+			to_push = self.events.add_to_manifest(listings)
+
+		return len(listings), to_push
+
+
+	def push(self, rows): 
+		# Rows that were pushed before the manifest was rebuilt keep their calendar event instead of getting a new 
+		# one. Their manifest events are reconciled too, since the rebuild may have grouped their rows differently: 
+		# the events of merged talks are deleted as duplicates and split talks get an event each. The flag is 
+		# cleared as rows are updated, so rows whose push failed stay flagged for the next run.
+		rows = [ (row_id, metadata) for row_id, metadata in rows if not metadata.get('pushed_to_cal') ]
+		for _, metadata in rows: 
+			metadata.pop('push_pending', None)
+
+		previous = self._previous_events([metadata for _, metadata in rows])
+		if previous: 
+			with self.events.manifest.transaction(): 
+				for row_id, metadata in rows: 
+					if row_url(metadata) not in previous: continue
+					metadata['pushed_to_cal'] = True
+					metadata['calendar_event_id'] = previous[row_url(metadata)]
+					self.events.manifest.update(row_id, metadata)
+
+		self.events.push_batch_to_google_calendar(rows)
+
+
+	def rebuild(self): 
+		# Copy the current manifest aside and empty it, so that every stored listing is added again. Calendar events 
+		# of the old manifest are carried over by `push`. The copy is recorded in the checkpoint before the manifest 
+		# is emptied, so the events are still carried over if the rebuild is interrupted.
+		if self.checkpoint is not None: 
+			raise RuntimeError("A backfill of {} is in progress, resume it first".format(self.list_id))
+
+		manifest = Events(list_id=self.list_id, calendar_name=self.cal_name, dry_run=True).manifest
+		previous_path = manifest.path + time.strftime('.%Y%m%d%H%M%S.bak')
+		manifest.backup(previous_path)
+
+		self.checkpoint = { 'previous_manifest': previous_path }
+		self._save_checkpoint()
+
+		manifest.clear()
+		manifest.close()
+		logger.info("Previous manifest copied to {}".format(previous_path))
+
+
+	################################
+	#####     READ / WRITE     #####
+	################################
+
+	def _previous_events(self, rows): 
+		# URL -> calendar event id in the manifest set aside by `rebuild`
+		path = self.checkpoint.get('previous_manifest')
+		if not path or not os.path.exists(path) or len(rows) == 0: return {}
+
+		previous = ManifestStore(path)
+		try: 
+			events = {}
+			for metadata in rows: 
+				row = previous.get_by_url(row_url(metadata))
+				if row is not None and row.get('pushed_to_cal'): 
+					events[row_url(metadata)] = row.get('calendar_event_id')
+			return events
+		finally: 
+			previous.close()
+
+
+	def _read_checkpoint(self): 
+
+		if os.path.isfile(self.checkpoint_path): 
+			with open(self.checkpoint_path, 'r') as f: 
+				return json.load(f)
+
+		return None
+
+
+	def _save_checkpoint(self): 
+
+		atomic_write(self.checkpoint_path, json.dumps(self.checkpoint))
+
+
+def parse_args(): 
+
+	parser = argparse.ArgumentParser(description='Add locally stored listings missing from a manifest, resuming from the last checkpoint.')
+	parser.add_argument('list_id', choices=[list_serve["list_id"] for list_serve in LIST_SERVES])
+	parser.add_argument('--rebuild', action='store_true', help='Set the current manifest aside and add every stored listing again')
+	parser.add_argument('--dry-run', action='store_true', help='Add listings to the manifest without pushing anything to Google Calendar')
+	parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Listings between two checkpoints')
+	parser.add_argument('--parse-workers', type=int, default=1, help='Parse listings on this many processes')
+	return parser.parse_args()
+
+
+
+
+if __name__ == "__main__":
+	args = parse_args()
+	list_serve = [list_serve for list_serve in LIST_SERVES if list_serve["list_id"] == args.list_id][0]
+
+	backfill = Backfill(args.list_id, list_serve["cal_name"], chunk_size=args.chunk_size, parse_workers=args.parse_workers, dry_run=args.dry_run)
+	if args.rebuild: 
+		backfill.rebuild()
+	backfill.run()
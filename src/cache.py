@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import Counter
+
+from metrics import metrics
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+	key         TEXT PRIMARY KEY,
+	value       TEXT NOT NULL,
+	last_access INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+"""
+
+
+# Cache hits whose access time is kept in memory before being written in one statement
+TOUCH_BATCH_SIZE = 500
+
+
+def normalize_text(text): 
+	# Normalization applied before hashing. It must not move any characters, since cached SUTime results carry offsets.
+	return unicodedata.normalize('NFC', str(text)).rstrip()
+
+
+def make_key(*parts): 
+	# Content address of a tuple of JSON-serializable parts
+	return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ResultCache(): 
+	# Persistent content-addressed cache of parse results. Entries are evicted least-recently-used first once the
+	# cache holds more than `max_entries`.
+
+	def __init__(self, path, max_entries=200000): 
+
+		self.path = path
+		self.max_entries = max_entries
+
+		self.hits   = Counter()
+		self.misses = Counter()
+
+		if os.path.dirname(self.path): 
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+		self._lock = threading.Lock()
+		self.conn = sqlite3.connect(self.path, check_same_thread=False)
+		self.conn.execute('PRAGMA journal_mode=WAL')
+		self.conn.executescript(SCHEMA)
+
+		# Logical clock for LRU ordering
+		self._clock = self.conn.execute('SELECT COALESCE(MAX(last_access), 0) FROM results').fetchone()[0]
+		self._size  = self.conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+		# Access times of cache hits not written yet, so lookups stay reads
+		self._touched = {}
+
+
+	def get(self, namespace, key): 
+		# Return the cached value, or None on a miss
+		with self._lock: 
+			row = self.conn.execute('SELECT value FROM results WHERE key = ?', (namespace + ':' + key,)).fetchone()
+			if row is None: 
+				self.misses[namespace] += 1
+				metrics.count('cache_misses_total', namespace=namespace)
+				return None
+
+			self._clock += 1
+			self._touched[namespace + ':' + key] = self._clock
+			if len(self._touched) >= TOUCH_BATCH_SIZE: 
+				self._write_touched()
+				self.conn.commit()
+			self.hits[namespace] += 1
+			metrics.count('cache_hits_total', namespace=namespace)
+
+		return json.loads(row[0])
+
+
+	def put(self, namespace, key, value): 
+
+		with self._lock: 
+			self._clock += 1
+			self.conn.execute('INSERT OR REPLACE INTO results (key, value, last_access) VALUES (?, ?, ?)',
+				(namespace + ':' + key, json.dumps(value, default=str), self._clock))
+			self._touched.pop(namespace + ':' + key, None)
+			self._size += 1
+			if self._size > self.max_entries: 
+				self._evict()
+			# Recent hits are written with the entry, since this is a write transaction anyway
+			self._write_touched()
+			self.conn.commit()
+
+
+	def stats(self): 
+
+		namespaces = set(self.hits) | set(self.misses)
+		stats = { 'entries': self._size }
+		for namespace in sorted(namespaces): 
+			total = self.hits[namespace] + self.misses[namespace]
+			stats[namespace] = {
+				'hits': self.hits[namespace],
+				'misses': self.misses[namespace],
+				'hit_rate': self.hits[namespace] / total if total else 0.
+			}
+		return stats
+
+
+	def flush(self): 
+		# Write the access times of recent hits
+		with self._lock: 
+			self._write_touched()
+			self.conn.commit()
+
+
+	def close(self): 
+
+		self.flush()
+		self.conn.close()
+
+
+	def _write_touched(self): 
+
+		if self._touched: 
+			self.conn.executemany('UPDATE results SET last_access = ? WHERE key = ?', [(clock, key) for key, clock in self._touched.items()])
+			self._touched.clear()
+
+
+	def _evict(self): 
+		# Drop the least recently used tenth of the cache in one statement, once recent hits are recorded
+		self._write_touched()
+		self._size = self.conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+		excess = self._size - int(self.max_entries * 0.9)
+		if excess > 0: 
+			self.conn.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_access LIMIT ?)', (excess,))
+			self._size -= excess
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import os
+import json
+import logging
+import argparse
+from functools import lru_cache
+from collections import OrderedDict
+
+# Processing modules
+from dateutil import parser, tz
+
+# External modules
+from manifest import ManifestStore, row_url, url_from_description
+from session import EVENT_FIELDS, SyncTokenExpired, calendar_body, get_calendar_api
+from utils import atomic_write
+from metrics import metrics, timed_stage
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter('%(asctime)s - CalendarSync: %(levelname)s - %(message)s', "%I:%M:%S"))
+logger.addHandler(handler)
+
+
+# Fields of a calendar event kept in the mirror
+MIRROR_FIELDS = [ 'id', 'status', 'extendedProperties' ] + EVENT_FIELDS
+
+
+class CalendarMirror(): 
+	# Local copy of the events of one calendar. After the first full listing, each sync only lists the events
+	# changed since the previous one, through the sync token the calendar hands out. Saved to `path` as JSON.
+
+	def __init__(self, calendar_name, path, api=None): 
+
+		self.cal_name = calendar_name
+		self.path = path
+		self._api = api
+
+		state = self._read()
+		self.calendar_id = state.get('calendar_id')
+		self.sync_token  = state.get('sync_token')
+		self.events      = state.get('events', {})
+
+
+	@property
+	def api(self): 
+		# The shared client is only created when the calendar is actually used
+		if self._api is None: 
+			self._api = get_calendar_api()
+		return self._api
+
+
+	def sync(self): 
+		# Returns the number of changed events listed
+		calendar_id = self.api.get_calendar_ID(self.cal_name)
+		if calendar_id != self.calendar_id: 
+			self.calendar_id, self.sync_token, self.events = calendar_id, None, {}
+
+		try: 
+			changes, sync_token = self.api.list_events(self.cal_name, sync_token=self.sync_token)
+		except SyncTokenExpired: 
+			logger.info("Sync token of {} expired, listing every event again".format(self.cal_name))
+			self.events = {}
+			changes, sync_token = self.api.list_events(self.cal_name)
+
+		for event in changes: 
+			self.apply(event)
+		self.sync_token = sync_token
+		self.save()
+
+		metrics.count('calendar_mirror_changes_total', len(changes), calendar=self.cal_name)
+
+		return len(changes)
+
+
+	def apply(self, event): 
+		# Record an event as listed, or as returned by an insert or a patch
+		if event.get('status') == 'cancelled': 
+			self.events.pop(event['id'], None)
+		else: 
+			self.events[event['id']] = { key: event[key] for key in MIRROR_FIELDS if key in event }
+
+
+	def remove(self, event_id): 
+
+		self.events.pop(event_id, None)
+
+
+	def by_listing(self, list_id): 
+		# Listing URL -> ids of the calendar events made from it, and the ids of the events tagged by list `list_id`.
+		# An event is keyed by the listing its tag names, or else by the listing URL ending its description, as for
+		# events pushed before events were tagged. Events tagged by other lists are left out.
+		by_listing, tagged = {}, set()
+		for event in self.events.values(): 
+			private = event.get('extendedProperties', {}).get('private', {})
+			if private.get('list_id', list_id) != list_id: continue
+
+			url = private.get('listing') or (event.get('description') and url_from_description(event['description']))
+			if not url: continue
+
+			by_listing.setdefault(url, []).append(event['id'])
+			if private: tagged.add(event['id'])
+
+		return by_listing, tagged
+
+
+	################################
+	#####     READ / WRITE     #####
+	################################
+
+	def save(self): 
+
+		atomic_write(self.path, json.dumps({ 'calendar_id': self.calendar_id, 'sync_token': self.sync_token, 'events': self.events }))
+
+
+	def _read(self): 
+
+		if os.path.isfile(self.path): 
+			with open(self.path, 'r') as f: 
+				return json.load(f)
+
+		return {}
+
+
+class CalendarSync(): 
+	# Reconciles a list's manifest with its calendar. Each manifest event is a single calendar event, described by
+	# the latest correction among its talk rows, or else by its first talk row. That state is compared with the
+	# mirror and only the difference is sent, in batches: inserts for events missing from the calendar, patches for
+	# events whose fields differ, and deletes for duplicates and for events that are no longer talks. Calendar
+	# events are matched to manifest events through the listing they were made from, never through event ids,
+	# which change when the manifest is rebuilt. Events that are neither tagged by this list nor made from one of
+	# its listings are left alone.
+
+	def __init__(self, list_id, calendar_name, manifest, api=None, local_listing_dir='../listings/'): 
+
+		self.list_id  = list_id
+		self.cal_name = calendar_name
+		self.manifest = manifest
+
+		self.mirror = CalendarMirror(calendar_name, os.path.join(local_listing_dir, list_id, 'calendar.json'), api=api)
+
+
+	@timed_stage('calendar_sync')
+	def reconcile(self, event_ids=None, dry_run=False): 
+		# Reconcile the given manifest events, or every event of the list. Returns the number of inserts, patches
+		# and deletes.
+		self.mirror.sync()
+
+		groups = self._groups(event_ids)
+		inserts, patches, deletes, linked = self.diff(groups, full=event_ids is None)
+
+		counts = { 'insert': len(inserts), 'patch': len(patches), 'delete': len(deletes) }
+		logger.info("{}: {} events checked, {} to insert, {} to patch, {} to delete".format(
+			self.cal_name, len(groups), counts['insert'], counts['patch'], counts['delete']))
+		if dry_run: return counts
+
+		inserted, patched, deleted = [], [], []
+		if inserts or patches or deletes: 
+			inserted, patched, deleted = self.mirror.api.apply_changes(self.cal_name, inserts=[body for _, body in inserts],
+																	   patches=patches, deletes=[calendar_event_id for _, calendar_event_id in deletes])
+
+		# Rows of events whose insert or delete failed are left as they are, so the next sync tries again
+		for (event_id, _), event in zip(inserts, inserted): 
+			if event is None: 
+				linked.pop(event_id)
+				continue
+			self.mirror.apply(event)
+			linked[event_id] = event['id']
+			metrics.count('events_pushed_total', list=self.list_id)
+
+		for event in patched: 
+			if event is not None: self.mirror.apply(event)
+
+		for (event_id, calendar_event_id), result in zip(deletes, deleted): 
+			if result is not None: 
+				self.mirror.remove(calendar_event_id)
+			elif linked.get(event_id, '') is None: 
+				linked.pop(event_id)
+
+		self.mirror.save()
+		self._update_rows(groups, linked)
+
+		for kind, results in [('insert', inserted), ('patch', patched), ('delete', deleted)]: 
+			metrics.count('calendar_changes_total', sum(result is not None for result in results), list=self.list_id, kind=kind)
+
+		return counts
+
+
+	def diff(self, groups, full=False): 
+		# Changes that bring the mirror in line with `groups`. Returns the inserts as `(event_id, body)`, the patches
+		# as `(calendar_event_id, body)`, the deletes as `(event_id, calendar_event_id)`, and the calendar event id
+		# each manifest event should point at afterwards, None if it should have none and not yet known if it is
+		# to be inserted. With `full`, tagged events made from listings no longer in any manifest event are deleted
+		# too.
+		by_listing, tagged = self.mirror.by_listing(self.list_id)
+
+		inserts, patches, deletes, linked = [], [], [], {}
+		for event_id, rows in groups.items(): 
+			# Calendar events of this manifest event: those made from one of its listings. A listing is a single
+			# row, so no calendar event is claimed by two manifest events.
+			candidates = [ c for _, metadata in rows for c in by_listing.get(row_url(metadata), []) ]
+			candidates = list(OrderedDict.fromkeys(candidates))
+
+			source = self._source_row(rows)
+			if source is None: 
+				deletes += [ (event_id, c) for c in candidates ]
+				linked[event_id] = None
+				continue
+
+			body = calendar_body(source, private={ 'list_id': self.list_id, 'listing': row_url(source) })
+
+			# Keep an event that is already up to date if there is one, so duplicates cost a delete and no patch
+			current = [ c for c in candidates if same_event(self.mirror.events[c], body) ]
+			keep = (current or candidates or [None])[0]
+			deletes += [ (event_id, c) for c in candidates if c != keep ]
+
+			if keep is None: 
+				inserts.append((event_id, body))
+			elif not current: 
+				patches.append((keep, patch_body(self.mirror.events[keep], body)))
+			linked[event_id] = keep
+
+		if full: 
+			urls = { row_url(metadata) for rows in groups.values() for _, metadata in rows }
+			deletes += [ (None, c) for url, ids in by_listing.items() if url not in urls for c in ids if c in tagged ]
+
+		return inserts, patches, deletes, linked
+
+
+	####################################
+	#####     HELPER FUNCTIONS     #####
+	####################################
+
+	def _groups(self, event_ids): 
+		# Manifest event id -> its `(row_id, metadata)` rows, oldest first
+		if event_ids is not None: 
+			return OrderedDict((int(event_id), list(self.manifest.items(event_id=event_id))) for event_id in sorted({ int(e) for e in event_ids }))
+
+		groups = OrderedDict()
+		for row_id, metadata in self.manifest.items(): 
+			if metadata.get('event_id') is None: continue
+			groups.setdefault(int(metadata['event_id']), []).append((row_id, metadata))
+
+		return groups
+
+
+	def _source_row(self, rows): 
+		# Row the calendar event is made from: the latest correction, or else the first announcement
+		talks = [ metadata for _, metadata in rows if metadata.get('is_talk') and 'start' in metadata ]
+		corrections = [ metadata for metadata in talks if metadata.get('is_correction') ]
+
+		if corrections: return corrections[-1]
+		return talks[0] if talks else None
+
+
+	def _update_rows(self, groups, linked): 
+		# Point every row of a reconciled manifest event at its calendar event, or flag it as not on the calendar.
+		# Only rows that change are written.
+		with self.manifest.transaction(): 
+			for event_id, calendar_event_id in linked.items(): 
+				for row_id, metadata in groups[event_id]: 
+					updated = dict(metadata, pushed_to_cal=calendar_event_id is not None, calendar_event_id=calendar_event_id)
+					updated.pop('push_pending', None)
+					if updated != metadata: 
+						self.manifest.update(row_id, updated)
+
+
+def same_event(event, body): 
+	# Whether a calendar event already shows `body`. Times are compared as instants, since the calendar returns
+	# them with a UTC offset where the manifest has a local time and a time zone.
+	for key in EVENT_FIELDS: 
+		if key in ['start', 'end']: 
+			if _instant(event.get(key)) != _instant(body.get(key)): return False
+		elif (event.get(key) or '') != (body.get(key) or ''): 
+			return False
+
+	return True
+
+
+def patch_body(event, body): 
+	# Fields missing from `body` but set on the event are cleared
+	cleared = { key: None for key in EVENT_FIELDS if key not in body and event.get(key) }
+
+	return dict(cleared, **body)
+
+
+def _instant(value): 
+
+	if not value: return None
+	if 'dateTime' not in value: return value.get('date')
+
+	return _parse_instant(value['dateTime'], value.get('timeZone') or 'America/New_York')
+
+
+@lru_cache(maxsize=65536)
+def _parse_instant(date_time, time_zone): 
+	# A full resync compares every event, most of them with unchanged times
+	instant = parser.parse(date_time)
+	if instant.tzinfo is None: 
+		instant = instant.replace(tzinfo=tz.gettz(time_zone))
+
+	return instant
+
+
+def parse_args(): 
+
+	parser = argparse.ArgumentParser(description='Bring a Google Calendar in line with its manifest, sending only the events that differ.')
+	parser.add_argument('list_id', choices=[list_serve["list_id"] for list_serve in LIST_SERVES])
+	parser.add_argument('--dry-run', action='store_true', help='Only report the inserts, patches and deletes that would be sent')
+	return parser.parse_args()
+
+
+
+
+if __name__ == "__main__":
+	# Imported here since update_calendar imports events, which imports this module
+	from update_calendar import LIST_SERVES
+	args = parse_args()
+	list_serve = [list_serve for list_serve in LIST_SERVES if list_serve["list_id"] == args.list_id][0]
+
+	local_dir = os.path.join('../listings/', args.list_id)
+	manifest = ManifestStore(os.path.join(local_dir, 'manifest.db'), legacy_path=os.path.join(local_dir, 'manifest.txt'))
+	try: 
+		CalendarSync(args.list_id, list_serve["cal_name"], manifest).reconcile(dry_run=args.dry_run)
+	finally: 
+		manifest.close()
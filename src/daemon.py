@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# External modules
+import listing
+from download_listings import ListServe
+from events import Events
+from update_calendar import LIST_SERVES, DOWNLOAD_WORKERS, update_list
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter('%(asctime)s - Daemon: %(levelname)s - %(message)s', "%I:%M:%S"))
+logger.addHandler(handler)
+
+
+# Bounds of the time between two polls of a list, in seconds
+MIN_INTERVAL = 5 * 60
+MAX_INTERVAL = 6 * 60 * 60
+
+# The schedule of a list aims for this many new listings per poll
+TARGET_LISTINGS_PER_POLL = 1.
+
+# Weight of the latest poll in a list's estimated posting rate
+RATE_SMOOTHING = 0.3
+
+# Consecutive failed polls after which a list is reported unhealthy
+ERROR_THRESHOLD = 3
+
+# Local port of the health and status endpoint
+STATUS_PORT = 8321
+
+
+class ListPoller(): 
+	# One list serve with its session, url registry and manifest kept open between polls, and its own schedule
+
+	def __init__(self, list_serve, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, download_workers=DOWNLOAD_WORKERS): 
+
+		self.list_serve = list_serve
+		self.list_id    = list_serve["list_id"]
+
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+		self.download_workers = download_workers
+
+		# Created on first poll
+		self.l      = None
+		self.events = None
+
+		# Estimated new listings per second. Lists start on the shortest interval until their rate is known.
+		self.rate      = TARGET_LISTINGS_PER_POLL / self.min_interval
+		self.interval  = self.min_interval
+		self.last_poll = None
+		self.next_poll = time.time()
+
+		self.polls        = 0
+		self.new_listings = 0
+		self.errors       = 0
+		self.last_error   = None
+
+
+	def poll(self, parse_workers=1, stream=False): 
+
+		started = time.time()
+		try: 
+			if self.l is None: 
+				self.l = ListServe(self.list_id, self.list_serve["host"], workers=self.download_workers)
+			self.l.forget_pages()
+
+			with metrics.timer('daemon_poll_seconds', list=self.list_id): 
+				n_new = update_list(self.l, self.get_events, parse_workers=parse_workers, stream=stream)
+		except Exception as e: 
+			logger.exception("{}: poll failed".format(self.list_id))
+			metrics.count('daemon_poll_errors_total', list=self.list_id)
+			self.errors += 1
+			self.last_error = repr(e)
+
+			# Back off from a host that keeps failing rather than retrying it at the same pace
+			self.interval = min(self.max_interval, self.interval * 2)
+		else: 
+			self.errors = 0
+			self.new_listings += n_new or 0
+			self._update_schedule(n_new or 0, started)
+			logger.info("{}: {} new listings, next poll in {:.0f}s".format(self.list_id, n_new or 0, self.interval))
+
+		metrics.count('daemon_polls_total', list=self.list_id)
+		self.polls += 1
+		self.last_poll = started
+		self.next_poll = time.time() + self.interval
+
+
+	def get_events(self): 
+		# The manifest stays open between polls; only the listings waiting to be added are looked up again
+		if self.events is None: 
+			self.events = Events(list_id=self.list_id, calendar_name=self.list_serve["cal_name"])
+		else: 
+			self.events.refresh()
+
+		return self.events
+
+
+	def close(self): 
+		# Write the url registry and close the manifest. Rows are committed as they are added, so nothing is lost
+		# if this never runs, but closing checkpoints the write-ahead log.
+		if self.l is not None: 
+			self.l.update_manifest()
+		if self.events is not None: 
+			self.events.manifest.close()
+			self.events = None
+
+
+	def status(self): 
+
+		return {
+			'polls': self.polls,
+			'new_listings': self.new_listings,
+			'listings_per_day': round(self.rate * 86400, 2),
+			'interval': round(self.interval, 1),
+			'last_poll': _timestamp(self.last_poll),
+			'next_poll': _timestamp(self.next_poll),
+			'pending': self.l.pending if self.l is not None else None,
+			'consecutive_errors': self.errors,
+			'last_error': self.last_error
+		}
+
+
+	def _update_schedule(self, n_new, started): 
+		# Exponentially weighted posting rate over the time since the previous poll. The first poll is skipped
+		# since it picks up everything posted while the daemon was not running.
+		if self.last_poll is not None: 
+			elapsed = max(started - self.last_poll, 1.)
+			self.rate = RATE_SMOOTHING * n_new / elapsed + (1 - RATE_SMOOTHING) * self.rate
+
+		if self.rate <= 0: 
+			self.interval = self.max_interval
+		else: 
+			self.interval = min(self.max_interval, max(self.min_interval, TARGET_LISTINGS_PER_POLL / self.rate))
+
+
+class Daemon(): 
+	# Long-running replacement for `cronjob.sh`: SUTime, the room matcher, sessions, the calendar client and
+	# manifests are loaded once and reused by every poll. Lists are polled one at a time, each when its own
+	# schedule is due. SIGTERM or SIGINT stops the daemon once the current poll has finished.
+
+	def __init__(self, list_serves, parse_workers=1, stream=False, status_port=STATUS_PORT, min_interval=MIN_INTERVAL,
+				 max_interval=MAX_INTERVAL, metrics_path=None, prometheus_path=None): 
+
+		self.pollers = [ ListPoller(list_serve, min_interval=min_interval, max_interval=max_interval) for list_serve in list_serves ]
+
+		self.parse_workers = parse_workers
+		self.stream        = stream
+
+		# None disables the status endpoint
+		self.status_port = status_port
+		self.server      = None
+
+		# Reports rewritten after every poll
+		self.metrics_path    = metrics_path
+		self.prometheus_path = prometheus_path
+
+		self.started = None
+		self.current = None
+		self._stop   = threading.Event()
+
+
+	def run(self): 
+
+		self.started = time.time()
+		for signum in [signal.SIGTERM, signal.SIGINT]: 
+			signal.signal(signum, self.stop)
+
+		metrics.enable()
+		listing.warm_up()
+		if self.status_port is not None: 
+			self.serve_status()
+
+		logger.info("Polling {} lists".format(len(self.pollers)))
+		try: 
+			while not self._stop.is_set(): 
+				poller = min(self.pollers, key=lambda p: p.next_poll)
+				wait = poller.next_poll - time.time()
+				if wait > 0: 
+					self._stop.wait(wait)
+					continue
+
+				self.current = poller.list_id
+				poller.poll(parse_workers=self.parse_workers, stream=self.stream)
+				self.current = None
+				self._write_metrics()
+		finally: 
+			self.shutdown()
+
+
+	def stop(self, *args): 
+		# Signal handler. Polls are not interrupted, so manifests and url registries stay consistent.
+		if not self._stop.is_set(): 
+			logger.info("Stopping{}".format(" after the current poll of " + self.current if self.current else ""))
+		self._stop.set()
+
+
+	def shutdown(self): 
+
+		if self.server is not None: 
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
+
+		for poller in self.pollers: 
+			try: 
+				poller.close()
+			except Exception: 
+				logger.exception("{}: failed to close".format(poller.list_id))
+
+		listing.close_resources()
+		self._write_metrics()
+		logger.info("Stopped.")
+
+
+	def healthy(self): 
+
+		return not self._stop.is_set() and all(poller.errors < ERROR_THRESHOLD for poller in self.pollers)
+
+
+	def status(self): 
+
+		return {
+			'healthy': self.healthy(),
+			'started': _timestamp(self.started),
+			'uptime': round(time.time() - self.started, 1) if self.started else 0.,
+			'polling': self.current,
+			'lists': { poller.list_id: poller.status() for poller in self.pollers }
+		}
+
+
+	###################################
+	#####     STATUS ENDPOINT     #####
+	###################################
+
+	def serve_status(self): 
+		# `/health` answers 200 or 503 for monitoring, `/status` describes every list and `/metrics` is the
+		# Prometheus export of this process. Bound to localhost only.
+		daemon = self
+
+		class Handler(BaseHTTPRequestHandler): 
+
+			def do_GET(self): 
+				path = self.path.rstrip('/')
+				if path == '/health': 
+					healthy = daemon.healthy()
+					self._respond(200 if healthy else 503, json.dumps({ 'healthy': healthy }), 'application/json')
+				elif path == '/status': 
+					self._respond(200, json.dumps(daemon.status(), indent=1), 'application/json')
+				elif path == '/metrics': 
+					self._respond(200, metrics.to_prometheus(), 'text/plain; version=0.0.4')
+				else: 
+					self._respond(404, 'not found', 'text/plain')
+
+			def _respond(self, status, body, content_type): 
+				body = body.encode()
+				self.send_response(status)
+				self.send_header('Content-Type', content_type)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, *args): 
+				pass
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', self.status_port), Handler)
+		self.server.daemon_threads = True
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+		logger.info("Status at http://127.0.0.1:{}/status".format(self.server.server_address[1]))
+
+
+	def _write_metrics(self): 
+
+		if self.metrics_path: metrics.write_report(self.metrics_path)
+		if self.prometheus_path: metrics.write_prometheus(self.prometheus_path)
+
+
+####################################
+#####     HELPER FUNCTIONS     #####
+####################################
+
+def _timestamp(seconds): 
+
+	if seconds is None: return None
+	return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(seconds))
+
+
+def parse_args(): 
+
+	parser = argparse.ArgumentParser(description='Keep polling the list serves and pushing new talks to Google Calendar.')
+	parser.add_argument('--stream', action='store_true', help='Parse listings from memory as they are downloaded')
+	parser.add_argument('--parse-workers', type=int, default=1, help='Parse new listings on this many processes')
+	parser.add_argument('--port', type=int, default=STATUS_PORT, help='Local port of the health and status endpoint, 0 to disable')
+	parser.add_argument('--min-interval', type=float, default=MIN_INTERVAL, help='Shortest time between two polls of a list, in seconds')
+	parser.add_argument('--max-interval', type=float, default=MAX_INTERVAL, help='Longest time between two polls of a list, in seconds')
+	parser.add_argument('--metrics', help='Keep a JSON report of stage timings and counters at this path')
+	parser.add_argument('--prometheus', help='Keep the same metrics in Prometheus text format at this path')
+	return parser.parse_args()
+
+
+
+
+if __name__ == "__main__":
+	args = parse_args()
+
+	Daemon(LIST_SERVES, parse_workers=args.parse_workers, stream=args.stream, status_port=args.port or None,
+		   min_interval=args.min_interval, max_interval=args.max_interval,
+		   metrics_path=args.metrics, prometheus_path=args.prometheus).run()
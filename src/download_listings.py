@@ -2,70 +2,326 @@
 
 # Core python modules
 import os
+import json
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 # Web scraping modules
+from bs4 import BeautifulSoup
 from session import Session
+from utils import atomic_write
+from url_registry import URLRegistry
+from archive import ListingArchive, WriteBehind
+from mbox import monthly_archive_url, read_monthly_archive, message_page
+from metrics import metrics, timed_stage
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter('%(asctime)s - ListServe: %(levelname)s - %(message)s', "%I:%M:%S"))
+logger.addHandler(handler)
+
+
+# A listing as downloaded: its URL and the page bytes exactly as received
+FetchedListing = namedtuple('FetchedListing', ['url', 'raw'])
 
 
 class ListServe(): 
 
-	def __init__(self, list_id, host, local_listing_dir='../listings/'): 
+	def __init__(self, list_id, host, local_listing_dir='../listings/', workers=1): 
 
 		self.list_id  = list_id
 		self.host     = host
 
+		# Number of concurrent downloads. 1 keeps the original serial behavior.
+		self.workers  = workers
+
 		self.local_dir	     = os.path.join(local_listing_dir, self.list_id)
 		self.local_urls_path = os.path.join(self.local_dir, 'urls.txt')
 
-		self.local_urls = self.get_local_manifest()
+		self.registry   = self.get_local_manifest()
+		self.local_urls = self.registry.urls
+
+		# Raw listing pages are appended to a packed archive instead of one file per message
+		self.archive = ListingArchive.open(os.path.join(self.local_dir, 'archive'))
 
-		self.s = Session(self.list_id, self.host)
+		# Change detection state: HTTP validators of the pages checked by `has_changes`, whether downloaded 
+		# listings are still waiting to be parsed, and listings that failed to download and are retried
+		self.state_path = os.path.join(self.local_dir, 'state.json')
+		self.state      = self._read_state()
+
+		# Pages fetched during change detection, reused instead of being requested again
+		self._pages      = {}
+		self._validators = {}
+
+		# Listing indices of every date page read by `get_new_listings`
+		self._batch_indices = {}
+
+		self.s = Session(self.list_id, self.host, pool_size=max(10, self.workers))
 
 
 	####################################
 	#####     UPDATE FUNCTIONS     #####
 	####################################
 
-	def update_local_dir(self): 
-		# Find new listings and save them locally
+	@timed_stage('update_local_dir')
+	def update_local_dir(self, monthly=False): 
+		# Find new listings and save them locally. With `monthly`, listings are taken from the monthly archive 
+		# files, one request per month instead of one per listing.
 		urls = self.get_new_listings()
 
-		for url in urls: 
-			self.save_listing(url) 
-			self.local_urls.append(url)
+		if monthly: 
+			saved = self._save_from_monthly_archives(urls)
+		elif self.workers > 1: 
+			saved = self._save_listings_concurrently(urls)
+		else: 
+			saved = []
+			for url in urls: 
+				try: 
+					self.save_listing(url)
+					saved.append(url)
+				except Exception as e: 
+					logger.warning("Failed to download {}: {}".format(url, e))
+
+		saved_urls = set(saved)
+		self.commit_update(saved, failed=[url for url in urls if url not in saved_urls])
+		print("{} new listings added.".format(len(saved)))
+
+		return len(saved)
+
+
+	def stream_listings(self): 
+		# Yield each new listing as soon as it is downloaded, so it can be parsed straight from memory. Pages are 
+		# saved to the archive behind the consumer's back; the url manifest and change detection state are only 
+		# updated once the stream ends and the pages are on disk. Listings that were not saved, because they failed 
+		# or the stream was closed early, are retried by the next update.
+		urls = self.get_new_listings()
+
+		writer = WriteBehind(self.archive)
+		try: 
+			for url, raw in self._fetch_listings(urls): 
+				writer.put(os.path.basename(url), raw)
+				yield FetchedListing(url, raw)
+		finally: 
+			written = set(writer.close())
+			for index, e in writer.errors: 
+				logger.warning("Failed to save {}: {}".format(index, e))
+
+			saved = [url for url in urls if os.path.basename(url) in written]
+			metrics.count('listings_downloaded_total', len(saved), list=self.list_id)
+			self.commit_update(saved, failed=[url for url in urls if os.path.basename(url) not in written])
+			print("{} new listings added.".format(len(saved)))
+
+
+	def _fetch_listings(self, urls): 
+		# (url, raw bytes) in discovery order. Listings that fail to download are skipped. In concurrent mode at 
+		# most two windows of downloads are in flight, so pages are not held until the consumer catches up.
+		def fetch(url): 
+			try: 
+				return self.s.get_raw(url)
+			except Exception as e: 
+				logger.warning("Failed to download {}: {}".format(url, e))
+
+		if self.workers <= 1: 
+			results = ((url, fetch(url)) for url in urls)
+		else: 
+			results = self._fetch_windows(urls, fetch)
+
+		for url, raw in results: 
+			if raw is not None: yield url, raw
+
+
+	def _fetch_windows(self, urls, fetch): 
+
+		window = self.workers * 2
+		with ThreadPoolExecutor(max_workers=self.workers) as pool: 
+			futures = [ pool.submit(fetch, url) for url in urls[:window] ]
+			for i, url in enumerate(urls): 
+				if i + window < len(urls): 
+					futures.append(pool.submit(fetch, urls[i + window]))
+				yield url, futures[i].result()
+				futures[i] = None
+
+
+	def commit_update(self, saved, failed=()): 
+		# Record saved listings in the url manifest. Listings that `failed` to download are kept in the state, since 
+		# `get_new_listings` stops at the first registered listing and would not find them again.
+		for url in saved: 
+			self.registry.add(url)
 
 		# Update url manifest
 		self.update_manifest()
-		print("{} new listings added.".format(len(urls)))
+
+		self.state['failed'] = [url for url in failed if url not in self.registry]
+		if self.state['failed']: 
+			logger.warning("{} listings failed to download and will be retried".format(len(self.state['failed'])))
+		else: 
+			# Pages are only marked as seen once every listing they lead to is saved
+			self.state['validators'].update(self._validators)
+		self.state['pending'] = self.state['pending'] or len(saved) > 0
+		self._save_state()
+
+
+	@timed_stage('has_changes')
+	def has_changes(self): 
+		# Cheap check for new listings: conditional requests for the archive home page and the most recent date page. 
+		# Returns False only if neither has changed since the last completed update.
+		home_url   = os.path.join(self.host, self.list_id)
+		latest_url = self.state.get('latest_batch_url')
+		if latest_url is None or self.state['failed']: return True
+
+		for url in [home_url, latest_url]: 
+			text, validator = self.s.get_conditional(url, self.state['validators'].get(url))
+			self._validators[url] = validator
+			if text is not None: 
+				self._pages[url] = text
+				return True
+
+		return False
+
+
+	def forget_pages(self): 
+		# Drop pages and validators kept from an earlier change check, so a long-lived instance starts each update 
+		# from fresh requests
+		self._pages.clear()
+		self._validators.clear()
+		self._batch_indices.clear()
+
+
+	@property
+	def pending(self): 
+		# True if listings were downloaded that have not been marked as processed
+		return self.state['pending']
+
+
+	def mark_processed(self): 
+
+		self.state['pending'] = False
+		self._save_state()
 
 	
+	@timed_stage('get_new_listings')
 	def get_new_listings(self): 
 
 		# Request home
 		home_url = os.path.join(self.host, self.list_id)
-		home_html = self.s.get_html(home_url)
+		home_html = self._get_tracked_page(home_url)
 
 		# Get batch URLs (by date)
 		batch_urls = [os.path.join(home_url, subpage.get('href')) for subpage in home_html.body.table.find_all(href=True) if 'date' in subpage.get('href')]
 
-		# Get all listing URLs
-		urls = []
-		for batch_url in batch_urls: 
+		# The most recent batch is tracked for change detection
+		if len(batch_urls) > 0: 
+			self._get_tracked_page(batch_urls[0])
+			self.state['latest_batch_url'] = batch_urls[0]
+
+		# Get all listing URLs, starting with those that failed to download last time
+		urls = [url for url in self.state['failed'] if url not in self.registry]
+		for batch_url, batch_html in self._get_batch_htmls(batch_urls): 
 			# For each batch, obtain listing indices
-			batch_html = self.s.get_html(batch_url) 
 			indices = [subpage.get('href') for subpage in batch_html.body.find_all('ul')[1].find_all(href=True)]
+			self._batch_indices[batch_url] = indices
 
 			# For each listing index, record full URL
 			for index in indices[::-1]: 
 				url = os.path.join(os.path.dirname(batch_url), index)
-				if url not in self.local_urls: 
-					urls.append(url)
-				else: 
+				if url in self.registry: 
 					return urls
+				if url not in urls: 
+					urls.append(url)
 
 		return urls
 
 
+	def _get_batch_htmls(self, batch_urls): 
+		# Yield batch pages in order. In concurrent mode, pages are requested a window at a time so that an
+		# up-to-date list stops after the first window rather than downloading the whole archive index.
+		if self.workers <= 1: 
+			for batch_url in batch_urls: 
+				yield batch_url, self._get_page(batch_url)
+			return
+
+		with ThreadPoolExecutor(max_workers=self.workers) as pool: 
+			for i in range(0, len(batch_urls), self.workers): 
+				window = batch_urls[i:i+self.workers]
+				for batch_url, batch_html in zip(window, pool.map(self._get_page, window)): 
+					yield batch_url, batch_html
+
+
+	def _get_page(self, url): 
+		# Page fetched during change detection if available, otherwise a fresh request
+		if url in self._pages: 
+			return BeautifulSoup(self._pages.pop(url), 'html.parser')
+		return self.s.get_html(url)
+
+
+	def _get_tracked_page(self, url): 
+		# Fetch a page whose validator is recorded for change detection. The text is kept for `_get_page`.
+		if url not in self._pages: 
+			self._pages[url], self._validators[url] = self.s.get_conditional(url)
+		return BeautifulSoup(self._pages[url], 'html.parser')
+
+
+	def _save_listings_concurrently(self, urls): 
+		# Download listings on a bounded thread pool. Only listings that were written successfully are returned,
+		# so the url manifest never refers to a file that does not exist.
+		saved = set()
+		with ThreadPoolExecutor(max_workers=self.workers) as pool: 
+			futures = { pool.submit(self.save_listing, url): url for url in urls }
+			for future, url in futures.items(): 
+				try: 
+					future.result()
+					saved.add(url)
+				except Exception as e: 
+					logger.warning("Failed to download {}: {}".format(url, e))
+
+		# Preserve the order in which listings were discovered
+		return [url for url in urls if url in saved]
+
+
+	def _save_from_monthly_archives(self, urls): 
+		# Messages of a monthly archive are in the order they were archived, which is the order of their indices. 
+		# A month whose archive does not hold exactly the listings of its date page is downloaded page by page, as 
+		# are listings retried from a month whose date page was not read.
+		months = { os.path.dirname(batch_url) for batch_url in self._batch_indices }
+		saved, fallback = [], [url for url in urls if os.path.dirname(url) not in months]
+		for batch_url, indices in self._batch_indices.items(): 
+			month_dir = os.path.dirname(batch_url)
+			month_urls = [url for url in urls if os.path.dirname(url) == month_dir]
+			if len(month_urls) == 0: continue
+
+			# The current month is only published uncompressed
+			data = self.s.get_file(monthly_archive_url(batch_url))
+			if data is None: data = self.s.get_file(monthly_archive_url(batch_url)[:-len('.gz')])
+			messages = read_monthly_archive(data) if data is not None else []
+			if len(messages) != len(indices): 
+				logger.warning("{}: {} messages in the monthly archive for {} listings, downloading them one by one".format(
+					os.path.basename(month_dir), len(messages), len(indices)))
+				fallback += month_urls
+				continue
+
+			by_index = dict(zip(sorted(indices), messages))
+			for url in month_urls: 
+				self.archive.append(os.path.basename(url), message_page(by_index[os.path.basename(url)]))
+				saved.append(url)
+			metrics.count('listings_downloaded_total', len(month_urls), list=self.list_id)
+			metrics.count('monthly_archives_total', list=self.list_id)
+
+		for url in fallback: 
+			try: 
+				self.save_listing(url)
+				saved.append(url)
+			except Exception as e: 
+				logger.warning("Failed to download {}: {}".format(url, e))
+
+		# Preserve the order in which listings were discovered
+		saved = set(saved)
+		return [url for url in urls if url in saved]
+
+
 	################################
 	#####     READ / WRITE     #####
 	################################
@@ -73,29 +329,38 @@ class ListServe():
 	def get_local_manifest(self): 
 
 		# Check if local directory exists, create if not.
-		if os.path.isdir(self.local_dir): 
-			if os.path.isfile(self.local_urls_path): 
-				with open(self.local_urls_path, 'r') as f: 
-					return [x.rstrip() for x in f.readlines()]
-		else: 
+		if not os.path.isdir(self.local_dir): 
 			os.makedirs(self.local_dir)
 
-		return []
+		return URLRegistry.load(self.local_urls_path)
+
+	def _read_state(self): 
+
+		state = { 'validators': {}, 'latest_batch_url': None, 'pending': False, 'failed': [] }
+		if os.path.isfile(self.state_path): 
+			with open(self.state_path, 'r') as f: 
+				state.update(json.load(f))
+
+		return state
+
+
+	def _save_state(self): 
+
+		atomic_write(self.state_path, json.dumps(self.state, indent=1))
+
 
 	def update_manifest(self): 
 
-		with open(self.local_urls_path, 'w') as f: 
-			f.write('\n'.join(self.local_urls))
+		self.registry.save()
 
 
 	def save_listing(self, url): 
 
 		index = os.path.basename(url)
-		local_path = os.path.join(self.local_dir, index)
 
-		with open(local_path, 'w') as f: 
-			f.write(str(self.s.get_html(url)))
-			print("New listing found and written to: "+local_path)
+		self.archive.append(index, self.s.get_raw(url))
+		metrics.count('listings_downloaded_total', list=self.list_id)
+		logger.info("New listing saved to the archive: {}".format(url))
 
 
 def main(): 
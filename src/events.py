@@ -2,16 +2,22 @@
 
 # Core python modules
 import os
+import copy
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 # Processing modules
-import pandas as pd
-import numpy as np
 from difflib import SequenceMatcher
 
 # External modules
-from listing import Listing
-from session import GoogleCalAPI
+import listing
+from listing import Listing, annotate_listings
+from archive import ListingArchive
+from manifest import ManifestStore
+from url_registry import URLRegistry
+from calendar_sync import CalendarSync
+from metrics import metrics, timed_stage
 
 
 logger = logging.getLogger(__name__)
@@ -22,14 +28,91 @@ handler.setFormatter(logging.Formatter('%(asctime)s - Events: %(levelname)s - %(
 logger.addHandler(handler)
 
 
+def parse_listing(url, raw=None): 
+	# Listing for a locally saved URL, or for the `raw` page bytes of a URL that was just downloaded. None if the 
+	# listing has no usable content.
+
+	list_id = url.split('/')[-3]
+	index = url.split('/')[-1]
+
+	with metrics.timer('listing_parse_seconds', list=list_id): 
+		l = Listing(list_id, index, raw=raw, url=url if raw is not None else None)
+
+	try: 
+		l.posted_time
+	except AttributeError: 
+		logger.warning("Attribute Error -- listing excluded from manifest.")
+		metrics.count('listings_excluded_total', list=list_id)
+		return None
+
+	return l
+
+
+def iter_saved_listings(list_id, urls, local_listing_dir='../listings/'): 
+	# `(url, raw)` of locally saved listings, for `parse_listing`. Pages in the archive are read segment by segment 
+	# in the order they are stored, instead of one seek per listing. Listings saved as individual files by earlier
+	# versions come last, with `raw` None so the listing reads its file.
+	local_dir = os.path.join(local_listing_dir, list_id)
+
+	by_index = { url.split('/')[-1]: url for url in urls }
+	legacy = [ url for index, url in by_index.items() if os.path.isfile(os.path.join(local_dir, index)) ]
+	for url in legacy: 
+		del by_index[url.split('/')[-1]]
+
+	for index, raw in ListingArchive.open(os.path.join(local_dir, 'archive')).iter_records(set(by_index)): 
+		yield by_index.pop(index), raw
+
+	# Listings missing from both are handed over too, and parsed as before
+	for url in legacy + list(by_index.values()): 
+		yield url, None
+
+
+# Listings handed to each worker process at a time. Each chunk is annotated with batched SUTime calls.
+PARSE_CHUNK_SIZE = 25
+
+
+class ParsedListing(): 
+	# Compact result of parsing a listing in a worker process: just what `Events.ingest` needs from a `Listing`
+
+	__slots__ = ['url', 'posted_time', 'metadata']
+
+	def __init__(self, url, posted_time, metadata): 
+
+		self.url = url
+		self.posted_time = posted_time
+		self.metadata = metadata
+
+
+	def get_parsed_metadata_dense(self): 
+
+		return copy.deepcopy(self.metadata)
+
+
+def _init_parse_worker(settings): 
+	# Runs once in each worker process, so every worker keeps its own warm SUTime and room matcher
+	listing.configure(**settings)
+	listing.warm_up()
+
+
+def parse_listing_records(urls): 
+	# Worker side of `Events.parse_in_processes`
+	listings = [l for l in (parse_listing(url) for url in urls) if l is not None]
+	annotate_listings(listings)
+
+	return [ParsedListing(l.url, l.posted_time, l.get_parsed_metadata_dense()) for l in listings]
+
+
 class Events(): 
 
-	def __init__(self, list_id, calendar_name): 
+	def __init__(self, list_id, calendar_name, dry_run=False): 
 
 		self.local_dir     = '../listings/'
-		self.manifest_path = os.path.join(self.local_dir, list_id, 'manifest.txt')
+		self.manifest_path = os.path.join(self.local_dir, list_id, 'manifest.db')
+		# Manifests written by earlier versions are migrated into `manifest_path` on first use
+		self.legacy_manifest_path = os.path.join(self.local_dir, list_id, 'manifest.txt')
 		self.urls_path     = os.path.join(self.local_dir, list_id, 'urls.txt')
 
+		self.list_id  = list_id
 		self.cal_name = calendar_name
 
 		self.manifest = self._read_manifest()
@@ -37,61 +120,123 @@ class Events():
 
 		self.new_urls = self._get_new_paths()
 
-		self.service = None
+		self.service  = None
+		self.calendar = None
+
+		# Leave Google Calendar alone: rows are added to the manifest but nothing is pushed
+		self.dry_run = dry_run
+
+
+	def refresh(self): 
+		# Look up listings waiting to be added again, e.g. when the same instance is reused for another update
+		self.new_urls = self._get_new_paths()
 
 
 	###################################
 	#####     UPDATE MANIFEST     #####
 	###################################
 
-	def update_manifest(self): 
+	def update_manifest(self, workers=1): 
+		# With more than one worker, listings are parsed in a process pool. Ingestion stays sequential either way.
+		if workers > 1: 
+			self.ingest(self.parse_in_processes(self.new_urls, workers))
+			return
 
-		# First sort new listings by posted date in chronological order
-		new_listings = []
-		for url in self.new_urls: 
-			
-			list_id = url.split('/')[-3]
-			index = url.split('/')[-1]
+		new_listings = [parse_listing(url) for url in self.new_urls]
+		self.ingest([l for l in new_listings if l is not None])
+
+
+	def ingest_stream(self, fetched): 
+		# Parse listings handed over by `ListServe.stream_listings` from memory, then ingest them together with 
+		# any listing that was saved by an earlier run but never added to the manifest
+		new_listings = [parse_listing(f.url, raw=f.raw) for f in fetched]
+		new_listings += [parse_listing(url) for url in self.new_urls]
+
+		self.ingest([l for l in new_listings if l is not None])
+
+
+	def parse_in_processes(self, urls, workers): 
+		# Parse listings on `workers` processes. Results come back in the order of `urls`, so the stable sort in 
+		# `ingest` assigns the same event ids as a serial run.
+		chunks = [urls[i:i+PARSE_CHUNK_SIZE] for i in range(0, len(urls), PARSE_CHUNK_SIZE)]
+		if len(chunks) == 0: return []
 
-			l = Listing(list_id, index)
+		# Workers are spawned rather than forked, since a JVM already running in this process does not survive a fork
+		context = multiprocessing.get_context('spawn')
+		with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context, 
+								 initializer=_init_parse_worker, initargs=(dict(listing.config),)) as pool: 
+			records = []
+			for chunk_records in pool.map(parse_listing_records, chunks): 
+				records += chunk_records
 
-			try: 
-				new_listings.append([l.posted_time, l])
-			except AttributeError: 
-				logger.warning("Attribute Error -- listing excluded from manifest.")
-				pass
+		return records
 
-		new_listings.sort(key=lambda x: x[0])
 
-		# Then loop through listings and add to manifest
-		for _, l in new_listings: 
-			# TODO: replace -30 with something better
-			metadata = self.get_listing_metadata(self.manifest[-30:], l)
+	@timed_stage('ingest')
+	def ingest(self, listings): 
+		# Add parsed listings to the manifest and push new talks. Event ids depend on earlier listings, so this step 
+		# is sequential. Rows whose push failed in an earlier run are still flagged and are pushed again.
+		to_push = self.add_to_manifest(listings)
+
+		new = { row_id for row_id, _ in to_push }
+		to_push += [ (row_id, metadata) for row_id, metadata in self.manifest.pending() if row_id not in new ]
+
+		self.push_batch_to_google_calendar(to_push)
+
+
+	def add_to_manifest(self, listings): 
+		# Append parsed listings to the manifest. Returns the `(row_id, metadata)` pairs to push to the calendar, 
+		# which are stored flagged `push_pending` until their calendar event is written.
+
+		# First sort new listings by posted date in chronological order
+		new_listings = sorted(listings, key=lambda l: l.posted_time)
+
+		# Annotate all new listings with SUTime together rather than one JVM call per text
+		with metrics.timer('stage_seconds', stage='annotate', list=self.list_id): 
+			n_fast = annotate_listings(new_listings)
+		if len(new_listings) > 0: 
+			logger.info("Dates and times of {} of {} listings found without SUTime.".format(n_fast, len(new_listings)))
+
+		# Then loop through listings and add to manifest. Calendar pushes are collected and sent as one batch.
+		to_push = []
+		for l in new_listings: 
+			with metrics.timer('listing_metadata_seconds', list=self.list_id): 
+				metadata = self.get_listing_metadata(None, l)
 
 			# If new listing is a talk and contains relevant metadata
+			push = False
 			if metadata['is_talk'] and 'start' in metadata:
 				# check if it's a new one OR a corrected listing
-				if (metadata['event_id'] not in self.manifest['event_id'].tolist()) or metadata['is_correction']: 
+				if (not self.manifest.has_event(metadata['event_id'])) or metadata['is_correction']: 
+					push = True
 
-					self.push_to_google_calendar(metadata)
-					metadata['pushed_to_cal'] = True
+			if push and not self.dry_run: 
+				metadata['push_pending'] = True
 
-			self.manifest = self.manifest.append(metadata, ignore_index=True)
-			self._save_manifest()
+			with metrics.timer('manifest_append_seconds', list=self.list_id): 
+				row_id = self.manifest.append(metadata)
+			if push: to_push.append((row_id, metadata))
+			metrics.count('listings_ingested_total', list=self.list_id)
 			logger.info("Added to manifest: " + l.url)
 
+		return to_push
+
 
 	def get_listing_metadata(self, previous_listing_rows, current_listing): 
 
 		# Get metadata for new listing
 		metadata = current_listing.get_parsed_metadata_dense()
 
+		# By default compare against near-duplicates from the whole manifest, found through its similarity index
+		if previous_listing_rows is None: 
+			previous_listing_rows = self.manifest.candidates(metadata['message'])
+
 		# Assign event_id based on similarity to event 
-		for _,prev_l in previous_listing_rows.iterrows(): 
+		for prev_l in previous_listing_rows: 
 
-			s = self.similarity(prev_l['message'], metadata['message'])
+			s = self.similarity(prev_l.get('message'), metadata['message'])
 
-			if s > 0.5 or (prev_l['is_correction'] and s > 0.3): 
+			if s > 0.5 or (prev_l.get('is_correction') and s > 0.3): 
 				metadata['event_id'] = prev_l['event_id']
 				return metadata
 
@@ -99,7 +244,7 @@ class Events():
 		if len(self.manifest) == 0: 
 			metadata['event_id'] = 0
 		else: 
-			metadata['event_id'] = max(self.manifest['event_id']) + 1
+			metadata['event_id'] = self.manifest.max_event_id() + 1
 
 		return metadata
 
@@ -117,35 +262,34 @@ class Events():
 
 	def _get_urls(self): 
 
-		with open(os.path.join(self.urls_path), 'r') as f: 
-			return [line.rstrip() for line in f.readlines()]
+		return URLRegistry.load(self.urls_path)
 
 
 	def _read_manifest(self): 
 
-		if os.path.exists(self.manifest_path): 
-			return pd.read_csv(self.manifest_path, sep='\t')
-		else: 
-			return pd.DataFrame([], columns=['description', 'message', 'event_id', 'is_correction', 'is_talk'])
+		return ManifestStore(self.manifest_path, legacy_path=self.legacy_manifest_path)
 
 
 	def _get_new_paths(self): 
 
-		old_urls = [text.split('\n')[-1] for text in self.manifest['description'].tolist()] # description = url
+		old_urls = self.manifest.urls() # description = url
 		new_urls = [url for url in self.urls if url not in old_urls]
 
 		return new_urls
 
 
-	def _save_manifest(self): 
-		
-		self.manifest.to_csv(self.manifest_path, sep='\t', index=False)
-
+	@timed_stage('calendar_push')
+	def push_batch_to_google_calendar(self, rows): 
+		# Reconcile the calendar events of the manifest events of `(row_id, metadata)` pairs: new talks are inserted
+		# and corrections patch the event already on the calendar. Rows are flagged as their events are written.
+		if len(rows) == 0: return
 
-	def push_to_google_calendar(self, metadata): 
+		if self.dry_run: 
+			logger.info("Dry run: {} events not pushed to {}".format(len(rows), self.cal_name))
+			return
 
-		if self.service == None: 
-			self.service = GoogleCalAPI()
+		if self.calendar is None: 
+			self.calendar = CalendarSync(self.list_id, self.cal_name, self.manifest, api=self.service, local_listing_dir=self.local_dir)
 
-		self.service.create_event(self.cal_name, metadata)
+		self.calendar.reconcile({ metadata['event_id'] for _, metadata in rows })
 
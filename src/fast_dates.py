@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import re
+from datetime import datetime, timedelta
+
+
+# Texts are handled without SUTime only if every date or time cue in them is covered by a match
+CONFIDENCE_THRESHOLD = 1.
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+_MONTH   = r'(?P<month>(?:{})|(?:Jan|Feb|Mar|Apr|Jun|Jul|Aug|Sept?|Oct|Nov|Dec)\.?)'.format('|'.join(MONTHS))
+_WEEKDAY = r'(?:Mon|Tue|Tues|Wed|Thu|Thur|Thurs|Fri|Sat|Sun)\.?|' + '|'.join(WEEKDAYS)
+_CLOCK   = r'(?P<{0}hour>\d{{1,2}})(?::(?P<{0}minute>[0-5]\d))?\s*(?P<{0}meridiem>[ap]\.?m\b\.?)?'
+
+# `Friday, March 1, 2018`, `March 1st` or `3/1/2018`
+DATE_RE = re.compile(r'\b(?:(?:{})[,.]?\s+)?{}\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(?P<year>\d{{4}})\b)?'.format(_WEEKDAY, _MONTH))
+NUMERIC_DATE_RE = re.compile(r'\b(?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<year>\d{4})\b')
+WEEKDAY_RE = re.compile(r'\b(?P<weekday>{})\b'.format('|'.join(WEEKDAYS)))
+
+# `2pm`, `4:00 PM`, `4:30` or `noon`
+TIME_RE = re.compile(r'\b(?:{}|(?P<noon>noon))'.format(_CLOCK.format('')), re.IGNORECASE)
+# `4-5pm`, `4:00 - 5:30 PM` or `11am to 1pm`. Either a meridiem or minutes are required so that room numbers and
+# page ranges do not match.
+RANGE_RE = re.compile(r'\b{}\s*(?:-|–|to|until)\s*{}'.format(_CLOCK.format('begin_'), _CLOCK.format('end_')), re.IGNORECASE)
+
+# What a date is joined to a time with when SUTime reads both as one time, e.g. `March 1 at 2pm`
+JOIN_RE = re.compile(r',?\s+at\s+|,?\s+@\s*|,\s*|\s+', re.IGNORECASE)
+
+# Anything that looks like a date or time. A cue that no match covers makes the text ambiguous.
+CUE_RE = re.compile(r'\b(?:{}|{})\b|\b\d{{1,2}}:\d\d|\b\d{{1,2}}\s*[ap]\.?m\b|\b\d{{1,2}}/\d{{1,2}}\b|'.format('|'.join(MONTHS), '|'.join(WEEKDAYS)) +
+					r'\b(?:today|tomorrow|tonight|yesterday|noon|midnight|weekend|(?:next|this|last)\s+(?:week|month|year|\w+day))\b',
+					re.IGNORECASE)
+# Cue words that are also common words only count when capitalized, e.g. the month in `May 3` but not `we may`
+CASE_SENSITIVE_CUES = { 'may', 'march' }
+
+
+def extract(text, reference_date): 
+	# SUTime-style results for `text` posted on `reference_date`, and the fraction of date and time cues they cover
+	reference = datetime.strptime(reference_date, '%Y-%m-%d')
+
+	results = []
+	taken = []
+
+	def add(start, end, result_type, value): 
+		if any(start < taken_end and taken_start < end for taken_start, taken_end in taken): return False
+		taken.append((start, end))
+		results.append({ 'start': start, 'end': end, 'text': text[start:end], 'type': result_type, 'value': value })
+		return True
+
+	for m in RANGE_RE.finditer(text): 
+		if not (m.group('begin_meridiem') or m.group('end_meridiem') or (m.group('begin_minute') and m.group('end_minute'))): continue
+		begin, end = _range_clocks(m)
+		if begin and end: 
+			add(m.start(), m.end(), 'DURATION', { 'begin': begin, 'end': end })
+
+	dates = []
+	for regex in [DATE_RE, NUMERIC_DATE_RE]: 
+		for m in regex.finditer(text): 
+			date = _date(m, reference)
+			if date is not None: dates.append((m.start(), m.end(), date))
+
+	times = []
+	for m in TIME_RE.finditer(text): 
+		clock = 'T12:00' if m.group('noon') else _clock(m.group('hour'), m.group('minute'), m.group('meridiem'))
+		# A bare number is only a time with a meridiem or minutes
+		if clock and (m.group('noon') or m.group('meridiem') or m.group('minute')): 
+			times.append((m.start(), m.end(), clock))
+
+	# A date directly followed by a time is a single time on that date
+	for date_start, date_end, date in sorted(dates): 
+		joined = [(time_end, clock) for time_start, time_end, clock in times if time_start >= date_end and JOIN_RE.fullmatch(text[date_end:time_start])]
+		if not (joined and add(date_start, joined[0][0], 'TIME', date + joined[0][1])): 
+			add(date_start, date_end, 'DATE', date)
+
+	for time_start, time_end, clock in times: 
+		add(time_start, time_end, 'TIME', reference_date + clock)
+
+	for m in WEEKDAY_RE.finditer(text): 
+		# A bare weekday is that day in the week of the reference date, as SUTime resolves it
+		weekday = _weekday_index(m.group('weekday'))
+		add(m.start(), m.end(), 'DATE', format(reference + timedelta(days=weekday - reference.weekday()), '%Y-%m-%d'))
+
+	results.sort(key=lambda result: result['start'])
+
+	return results, _confidence(text, taken)
+
+
+def fast_annotate(text, reference_date): 
+	# Results for `text` if the regular expressions are confident about it, otherwise None
+	if not reference_date: return None
+
+	results, confidence = extract(text, reference_date)
+	if confidence < CONFIDENCE_THRESHOLD: return None
+
+	return results
+
+
+####################################
+#####     HELPER FUNCTIONS     #####
+####################################
+
+def _confidence(text, spans): 
+
+	cues = [m for m in CUE_RE.finditer(text) if m.group(0).lower() not in CASE_SENSITIVE_CUES or m.group(0)[0].isupper()]
+	if len(cues) == 0: return 1.
+
+	covered = sum(any(start <= m.start() and m.end() <= end for start, end in spans) for m in cues)
+	return covered / len(cues)
+
+
+def _clock(hour, minute, meridiem): 
+
+	hour = int(hour)
+	if hour > 23 or (meridiem and not 1 <= hour <= 12): return None
+	if meridiem: 
+		hour = hour % 12 + (12 if meridiem.lower().startswith('p') else 0)
+
+	return 'T{:02d}:{}'.format(hour, minute or '00')
+
+
+def _range_clocks(m): 
+	# A meridiem written once applies to both ends, except for ranges across noon such as `11-1pm`
+	begin_meridiem = m.group('begin_meridiem')
+	end_meridiem   = m.group('end_meridiem')
+	if end_meridiem and not begin_meridiem: 
+		across_noon = end_meridiem.lower().startswith('p') and int(m.group('begin_hour')) % 12 > int(m.group('end_hour')) % 12
+		begin_meridiem = 'am' if across_noon else end_meridiem
+
+	return _clock(m.group('begin_hour'), m.group('begin_minute'), begin_meridiem), _clock(m.group('end_hour'), m.group('end_minute'), end_meridiem)
+
+
+def _date(m, reference): 
+
+	month = m.group('month')
+	if month.isdigit(): 
+		month = int(month)
+	else: 
+		month = [name[:3] for name in MONTHS].index(month[:3].title()) + 1
+
+	year = int(m.group('year') or reference.year)
+	try: 
+		return format(datetime(year, month, int(m.group('day'))), '%Y-%m-%d')
+	except ValueError: 
+		return None
+
+
+def _weekday_index(name): 
+
+	return [day[:3] for day in WEEKDAYS].index(name[:3].title())
@@ -5,27 +5,83 @@ import os
 
 # Peripheral python modules
 import re
-import pickle
-from collections import Counter
-
-import pandas as pd
-import numpy as np
+import copy
+import html as html_entities
+import hashlib
+import threading
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict, namedtuple
 
 # Web scraping modules
-import json
-import requests
 from bs4 import BeautifulSoup
-from session import Session
+from rooms import RoomMatcher
+from cache import ResultCache, make_key, normalize_text
+from url_registry import URLRegistry
+from archive import ListingArchive, decode_html
+from metrics import metrics
+from fast_dates import fast_annotate
 
 # Language processing modules
 from datetime import datetime, timedelta
 from dateutil import parser
-from sutime import SUTime
 
 
 # Helper functions
 flatten = lambda l: [item for sublist in l for item in sublist]
 
+# A listing only needs the first <title>, <pre> and <i> (the posted date) of a message page
+OPEN_RE    = re.compile(r'<(title|pre|i)(?:\s[^>]*)?>', re.IGNORECASE)
+CLOSE_RE   = { tag: re.compile(r'</{}\s*>'.format(tag), re.IGNORECASE) for tag in ['title', 'pre', 'i'] }
+NESTED_RE  = { tag: re.compile(r'<{}[\s>]'.format(tag), re.IGNORECASE) for tag in ['title', 'pre', 'i'] }
+TAG_RE     = re.compile(r'<[^>]*>')
+COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+
+def extract_fields(text): 
+	# Text of the first <title>, <pre> and <i> elements in one scan of the page, as BeautifulSoup's `.text` would 
+	# return them. Returns None if any of them is missing or looks malformed, so the caller can fall back on a full parse.
+	fields = {}
+	position = 0
+	while len(fields) < 3: 
+		opening = OPEN_RE.search(text, position)
+		if opening is None: return None
+		tag = opening.group(1).lower()
+
+		closing = CLOSE_RE[tag].search(text, opening.end())
+		if closing is None: return None
+		content = text[opening.end():closing.start()]
+		position = closing.end()
+
+		if tag in fields: continue
+		# A nested opening tag of the same name means the page is not laid out as expected
+		if NESTED_RE[tag].search(content): return None
+		if '<' in content: content = TAG_RE.sub('', COMMENT_RE.sub('', content))
+		fields[tag] = html_entities.unescape(content)
+
+	return fields['title'], fields['pre'], fields['i']
+
+
+def extract_posted_time(text): 
+	# Posted time of a message page from its first <i> element alone, as a parsed listing's `posted_time`, e.g. to 
+	# sort listings without parsing them. Returns None if it cannot be read that way.
+	opening = OPEN_RE.search(text)
+	while opening is not None and opening.group(1).lower() != 'i': 
+		closing = CLOSE_RE[opening.group(1).lower()].search(text, opening.end())
+		if closing is None: return None
+		opening = OPEN_RE.search(text, closing.end())
+	if opening is None: return None
+
+	closing = CLOSE_RE['i'].search(text, opening.end())
+	if closing is None: return None
+	content = text[opening.end():closing.start()]
+	if NESTED_RE['i'].search(content): return None
+	if '<' in content: content = TAG_RE.sub('', COMMENT_RE.sub('', content))
+
+	try: 
+		return parser.parse(html_entities.unescape(content), fuzzy=True).isoformat()
+	except (ValueError, OverflowError): 
+		return None
+
+
 def highlight_string(text, start, end): 
 	# Bolds and colors string indexed by start and end locations
 	return text[:start] + '\x1b[1;31m' + text[start:end] + '\x1b[0m' + text[end:]
@@ -53,20 +109,304 @@ def get_datetime_type(text):
 	return 'other'
 
 
-# Instantiate SUTime object
-jar_files = "../../packages/python-sutime/jars/"
-try: sutime = SUTime(jars=jar_files, mark_time_ranges=True, include_range=True)
-except OSError: sutime = SUTime(jars=jar_files, jvm_started=True, mark_time_ranges=True, include_range=True)
+# Resource locations. Defaults are resolved relative to the repository so the module can be imported from anywhere.
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+config = {
+	'sutime_jars' : os.environ.get('MIT_TALKS_SUTIME_JARS', os.path.join(ROOT_DIR, '..', 'packages', 'python-sutime', 'jars')), 
+	'rooms_path'  : os.environ.get('MIT_TALKS_ROOMS', os.path.join(ROOT_DIR, 'listings', 'mit_rooms.csv')), 
+	'cache_dir'   : os.environ.get('MIT_TALKS_CACHE', os.path.join(ROOT_DIR, 'listings', '.cache'))
+}
+
+# SUTime, the room matcher and the result cache are only created on first use. Importing this module does not 
+# start a JVM or read any files.
+_resources = {}
+
+# The SUTime annotator is shared, so calls into the JVM from different threads are serialized
+_sutime_lock = threading.RLock()
+
+
+def configure(**kwargs): 
+	# Override resource locations. Resources that were already loaded are reloaded on next use.
+	for key, value in kwargs.items(): 
+		if key not in config: raise KeyError("Unknown setting: {}".format(key))
+		config[key] = value
+
+	for resource in list(_resources): 
+		if resource != 'sutime': _resources.pop(resource)
+
+
+def get_sutime(): 
+
+	with _sutime_lock: 
+		if 'sutime' not in _resources: 
+			from sutime import SUTime
+			jar_files = config['sutime_jars']
+			try: _resources['sutime'] = SUTime(jars=jar_files, mark_time_ranges=True, include_range=True)
+			except OSError: _resources['sutime'] = SUTime(jars=jar_files, jvm_started=True, mark_time_ranges=True, include_range=True)
+
+	return _resources['sutime']
+
+
+def get_room_matcher(): 
+
+	if 'room_matcher' not in _resources: 
+		_resources['room_matcher'] = RoomMatcher.from_csv(config['rooms_path'], cache_path=os.path.join(config['cache_dir'], 'rooms.pkl'))
+
+	return _resources['room_matcher']
+
+
+def get_result_cache(): 
+
+	if 'result_cache' not in _resources: 
+		_resources['result_cache'] = ResultCache(os.path.join(config['cache_dir'], 'results.db'))
+
+	return _resources['result_cache']
+
+
+def get_rooms_fingerprint(): 
+	# Digest of the rooms file, an input of the room matching stage
+	if 'rooms_fingerprint' not in _resources: 
+		with open(config['rooms_path'], 'rb') as f: 
+			_resources['rooms_fingerprint'] = hashlib.sha1(f.read()).hexdigest()
+
+	return _resources['rooms_fingerprint']
+
+
+def warm_up(): 
+	# Load every resource up front, e.g. before the first listing of a long-running process
+	get_sutime()
+	get_room_matcher()
+	get_result_cache()
+
+
+def close_resources(): 
+	# Close resources holding files open, e.g. when a long-running process shuts down. They are reopened on next use.
+	result_cache = _resources.pop('result_cache', None)
+	if result_cache is not None: 
+		result_cache.close()
+
+
+def __getattr__(name): 
+	# Backwards compatible module attributes for code that used the eagerly loaded globals
+	if name == 'sutime': return get_sutime()
+	if name == 'room_matcher': return get_room_matcher()
+	if name == 'rooms': return get_room_matcher().rooms
+	if name == 'result_cache': return get_result_cache()
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+# Bump to recompute every stage of every listing
+PARSER_VERSION = 2
+
+# Version of each parse stage. Bump a stage when its rules change, e.g. the scoring weights in `evidence_score` or 
+# the keywords in `_is_talk`: that stage and the stages reading from it are recomputed, cached results of the 
+# others are reused. Event grouping is done by `Events` when listings are added to the manifest, from the message, 
+# the posted order and the correction flag only, so it is the only stage rebuilding the manifest.
+STAGE_VERSIONS = OrderedDict([
+	('extract',     1),	# title, message and posted date from the page
+	('corrections', 1),	# correction keywords in `_is_correction`
+	('normalize',   1),	# talk keywords, dates rewritten for SUTime
+	('sutime',      1),	# SUTime and fast path results
+	('rooms',       1),	# room matching
+	('scoring',     1),	# date time evidence scoring
+	('grouping',    1)	# event ids
+])
+
+# Stages each stage reads from
+STAGE_INPUTS = {
+	'extract': [],
+	'corrections': ['extract'],
+	'normalize': ['extract', 'corrections'],
+	'sutime': ['normalize'],
+	'rooms': ['normalize'],
+	'scoring': ['sutime'],
+	'grouping': ['extract', 'corrections']
+}
+
+# Listing attributes restored from the cache alongside its parsed metadata
+CACHED_ATTRIBUTES = ['title', 'message', 'is_talk', 'is_correction', 'posted_time', 'posted_date', 'title_mod', 'message_mod']
+
+
+def stage_keys(page_key, rooms_key): 
+	# Key of every stage from its version, the keys of the stages it reads from and its outside input: the page for 
+	# extraction and the rooms file for room matching. A stage's key changes whenever anything upstream of it does.
+	outside = { 'extract': page_key, 'rooms': rooms_key }
+
+	keys = OrderedDict()
+	for stage, version in STAGE_VERSIONS.items(): 
+		keys[stage] = make_key(stage, version, [keys[upstream] for upstream in STAGE_INPUTS[stage]], outside.get(stage))
+
+	return keys
+
+
+def stale_stages(recorded, current): 
+	# Stages whose key differs from the one recorded with a manifest row
+	return [stage for stage in current if recorded.get(stage) != current[stage]]
+
+# Documents sharing a reference date are joined with this separator and annotated in a single JVM call
+BATCH_SEPARATOR = '\n\n##########\n\n'
+# Upper bound on the length of a joined batch, in characters
+BATCH_MAX_CHARS = 200000
+
+# Texts whose dates and times the regular expressions in `fast_dates` are confident about are not sent to SUTime
+USE_FAST_PATH = True
+
+
+def annotate_batch(documents): 
+	# Annotate many `(text, reference_date)` pairs with as few SUTime calls as possible. Returns one list of SUTime 
+	# results per document, with `start` and `end` relative to that document. 
+	results = [[] for _ in documents]
+
+	groups = defaultdict(list)
+	for i, (text, reference_date) in enumerate(documents): 
+		groups[reference_date].append(i)
+
+	for reference_date, members in groups.items(): 
+		# Split each reference date group into chunks of bounded size
+		chunk, chunk_chars = [], 0
+		for i in members + [None]: 
+			if i is None or (chunk and chunk_chars + len(documents[i][0]) > BATCH_MAX_CHARS): 
+				_annotate_chunk(documents, chunk, reference_date, results)
+				chunk, chunk_chars = [], 0
+			if i is not None: 
+				chunk.append(i)
+				chunk_chars += len(documents[i][0]) + len(BATCH_SEPARATOR)
+
+	return results
+
+
+def sutime_cache_key(text, reference_date): 
+
+	return make_key('sutime', PARSER_VERSION, STAGE_VERSIONS['sutime'], normalize_text(text), reference_date)
+
+
+def annotate_fast(text, reference_date): 
+	# Results of the fast path, or None if the text has to go to SUTime
+
+	results = fast_annotate(text, reference_date) if USE_FAST_PATH else None
+	metrics.count('fast_path_documents_total', outcome='handled' if results is not None else 'fallback')
 
-# MIT rooms list
-with open('../listings/mit_rooms.csv', 'r') as f: 
-	rooms = [line.split(' ')[0] for line in f.readlines() if '-' in line.split(' ')[0] and len(line.split(' ')[0]) < 15]
-	rooms.sort(key = len, reverse=True)
+	return results
+
+
+def annotate_cached(documents, handled=None): 
+	# Same as `annotate_batch`, but documents handled by the fast path or already in the result cache are not sent 
+	# to SUTime. If given, `handled` is filled with whether the fast path handled each document.
+	results = [annotate_fast(text, reference_date) for text, reference_date in documents]
+	if handled is not None: 
+		handled[:] = [result is not None for result in results]
+
+	keys = {}
+	for i, (text, reference_date) in enumerate(documents): 
+		if results[i] is None: 
+			keys[i] = sutime_cache_key(text, reference_date)
+			results[i] = get_result_cache().get('sutime', keys[i])
+
+	missing = [i for i in keys if results[i] is None]
+	for i, result in zip(missing, annotate_batch([documents[i] for i in missing])): 
+		get_result_cache().put('sutime', keys[i], result)
+		results[i] = result
+
+	return results
+
+
+def _annotate_chunk(documents, members, reference_date, results): 
+
+	if len(members) == 0: return
+
+	texts = [documents[i][0] for i in members]
+
+	# Offset of each document within the joined text
+	offsets, position = [], 0
+	for text in texts: 
+		offsets.append(position)
+		position += len(text) + len(BATCH_SEPARATOR)
+
+	with _sutime_lock: 
+		with metrics.timer('sutime_call_seconds'): 
+			annotations = get_sutime().parse(BATCH_SEPARATOR.join(texts), reference_date)
+	metrics.count('sutime_calls_total')
+	metrics.count('sutime_documents_total', len(texts))
+
+	for result in annotations: 
+		k = bisect_right(offsets, result['start']) - 1
+		# Drop anything that spans a document boundary
+		if result['end'] > offsets[k] + len(texts[k]): continue
+		result['start'] -= offsets[k]
+		result['end']   -= offsets[k]
+		results[members[k]].append(result)
+
+
+def annotate_listings(listings): 
+	# Pre-compute SUTime results for all listings in batched calls. Each listing keeps its results so later 
+	# parsing steps do not cross into the JVM again. Returns how many listings the fast path handled entirely.
+	listings = [l for l in listings if hasattr(l, 'message_mod') and l.cached_metadata is None]
+
+	documents = []
+	for l in listings: 
+		documents += [(l.title_mod, l.posted_date), (l.message_mod, l.posted_date)]
+
+	handled = []
+	for i, result in enumerate(annotate_cached(documents, handled)): 
+		l = listings[i // 2]
+		l.sutime_results[documents[i][0]] = result
+
+	fast = { l: handled[2*i] and handled[2*i+1] for i, l in enumerate(listings) }
+
+	# Titles with more than one date time match are re-parsed as the concatenation of those matches
+	documents, owners = [], []
+	for l in listings: 
+		title_evidence = l.get_sutime_evidence(l.title_mod)
+		if len(title_evidence) > 1: 
+			documents.append((' '.join(e.text for e in title_evidence), l.posted_date))
+			owners.append(l)
+
+	for l, document, result, fast_title in zip(owners, documents, annotate_cached(documents, handled), handled): 
+		l.sutime_results[document[0]] = result
+		fast[l] = fast[l] and fast_title
+
+	# With all SUTime results at hand, score the date time evidence of every listing
+	for l in listings: 
+		l.datetime_predictions = l.get_datetime_predictions()
+
+	n_fast = sum(fast.values())
+	metrics.count('fast_path_listings_total', n_fast, outcome='handled')
+	metrics.count('fast_path_listings_total', len(listings) - n_fast, outcome='fallback')
+
+	return n_fast
+
+
+# SUTime match kept as date time evidence. `source` is either 'title' or 'message'.
+Evidence = namedtuple('Evidence', ['start', 'end', 'text', 'type', 'value', 'format', 'source'])
+
+DATETIME_FORMATS = ('datetime', 'date', 'time', 'dict')
+
+
+### MODEL
+def evidence_score(source, value_format, time=None): 
+	# Score of one piece of evidence -- model to be learned in the future
+	score = (1.5 if source == 'title' else 1) * (1.5 if value_format == 'dict' else 1)
+	if time is not None: 
+		score *= 1 if time[-2:] in ['00', '15', '30', '45'] else 0.5
+	return score
+
+
+def top_scoring(evidence): 
+	# Value with the highest total score over `(value, score)` pairs, or "NA". Ties go to the smallest value.
+	totals = defaultdict(float)
+	for value, score in evidence: 
+		totals[value] += score
+
+	if len(totals) == 0: 
+		return "NA"
+
+	return min(totals, key=lambda value: (-totals[value], value))
 
 
 class Listing(): 
 
-	def __init__(self, list_id, index, local_lising_dir='../listings/'): 
+	def __init__(self, list_id, index, local_lising_dir='../listings/', raw=None, url=None): 
+		# `raw` page bytes and `url` can be handed over straight from the download, before the page is saved
 
 		self.list_id = list_id
 		self.index   = index
@@ -76,18 +416,46 @@ class Listing():
 		self.local_path = os.path.join(self.local_dir, self.index)
 
 		# Extract content from listing
-		self.url  = self._get_url()
-		self.html = self._get_html()
-		# Sometimes the message body is empty so this return statement is required to avoid triggering errors
-		if self.html == None or self.html.pre == None: return 
-		self.title	 = self.html.title.text.strip()
-		self.message = self.html.pre.text.strip().split('-------------- next part --------------')[0]
+		self.url  = url or self._get_url()
+		# SUTime results keyed by input text, filled on demand or in bulk by `annotate_listings`
+		self.sutime_results = {}
+		self.datetime_predictions = None
+
+		# If this exact listing was parsed before, restore it from the cache without parsing the HTML
+		self.raw = decode_html(raw) if raw is not None else self._read_raw()
+		self.stages = stage_keys(make_key(PARSER_VERSION, self.list_id, self.index, self.url, self.raw), get_rooms_fingerprint())
+		self.cache_key = make_key('listing', self.stages['rooms'], self.stages['scoring'])
+		self.cached_metadata = None
+		self._html = None
+		if self.raw: 
+			cached = get_result_cache().get('listing', self.cache_key)
+			if cached is not None: 
+				self.__dict__.update(cached['attributes'])
+				self.cached_metadata = cached['metadata']
+				return
+
+			# Only a downstream stage changed, so extraction and normalization are reused
+			attributes = get_result_cache().get('normalize', self.stages['normalize'])
+			if attributes is not None: 
+				self.__dict__.update(attributes)
+				return
+
+		# Pull the three fields we need straight from the page, and only build a full tree for malformed pages
+		fields = extract_fields(self.raw) if self.raw else None
+		if fields is None: 
+			# Sometimes the message body is empty so this return statement is required to avoid triggering errors
+			if self.html == None or self.html.pre == None: return 
+			fields = (self.html.title.text, self.html.pre.text, self.html.i.text)
+		title_text, pre_text, posted_text = fields
+
+		self.title	 = title_text.strip()
+		self.message = pre_text.strip().split('-------------- next part --------------')[0]
 
 		# Initial processing of the listing
 		self.is_talk       = self._is_talk()
 		self.is_correction = self._is_correction()
 
-		self.posted_time = parser.parse(self.html.i.text, fuzzy=True).isoformat()
+		self.posted_time = parser.parse(posted_text, fuzzy=True).isoformat()
 		self.posted_date = self.posted_time.split("T")[0]
 
 		self.title_mod   = self._replace_month_date(self.title)
@@ -125,6 +493,9 @@ class Listing():
 
 	def get_parsed_metadata_dense(self): 
 
+		if self.cached_metadata is not None: 
+			return copy.deepcopy(self.cached_metadata)
+
 		event = self.get_parsed_metadata() 
 
 		event['message'] = self.message
@@ -132,72 +503,86 @@ class Listing():
 		event['is_correction'] = self.is_correction
 		event['posted_date'] = self.posted_date
 		event['index'] = self.index
+		event['stages'] = dict(self.stages)
+
+		attributes = { attribute: getattr(self, attribute) for attribute in CACHED_ATTRIBUTES }
+		get_result_cache().put('normalize', self.stages['normalize'], attributes)
+		get_result_cache().put('listing', self.cache_key, {'attributes': attributes, 'metadata': event})
 
 		return event
 
 
 	def get_location(self): 
 
-		matches = []
-		for room in rooms: 
-			for r in [ room, room.replace('-', '.') ]:
-				if r in self.message and r not in ' '.join([match[0] for match in matches]):
-					matches.append([r, self.message.find(r)]) 
-		matches.sort(key=lambda x: x[1]) 
+		# Earliest room mention, preferring the longest room at a given position
+		match = get_room_matcher().find_first(self.message)
 
-		if len(matches) == 0: 
+		if match is None: 
 			return "NA" 
 
-		return matches[0][0]
+		return match
 
 
 	def get_datetime_predictions(self): 
 
+		# Predictions scored by `annotate_listings`
+		if self.datetime_predictions is not None: 
+			return self.datetime_predictions
+
 		# Get date time fragments from title and message
-		self.datetime_df = self.get_datetime_dataframes()
-		# Sort snippets into date and time dataframes
-		dates_df, times_df = self.extract_datetime_features(self.datetime_df)
+		self.datetime_evidence = self.get_datetime_evidence()
+		# Sort snippets into scored date and time evidence
+		dates, times = self.extract_datetime_features(self.datetime_evidence)
 
-		### MODEL
-		# Score each piece of evidence -- model to be learned in the future
-		dates_df['score'] = dates_df['source'].apply(lambda x: 1.5 if x == 'title' else 1) * \
-								 dates_df['format'].apply(lambda x: 1.5 if x == 'dict' else 1)
+		# Pick top scoring date and times
+		predict_date  = top_scoring(dates)
+		predict_start = top_scoring(times)
 
-		times_df['score'] = times_df['source'].apply(lambda x: 1.5 if x == 'title' else 1) * \
-								 times_df['format'].apply(lambda x: 1.5 if x == 'dict' else 1) * \
-								 times_df['time'].apply(lambda x: 1 if x[-2:] in ['00', '15', '30', '45'] else 0.5)
+		return predict_date, predict_start, self.predict_end(predict_start)
 
-		# Pick top scoring date and times
-		if len(dates_df) == 0: 
-			predict_date = "NA"
-		else:
-			predict_date = dates_df.groupby(dates_df.columns[0]).sum().sort_values('score', ascending=False).index[0]
 
-		if len(times_df) == 0: 
-			predict_start = "NA"
-		else:
-			predict_start = times_df.groupby(times_df.columns[0]).sum().sort_values('score', ascending=False).index[0]
+	def predict_end(self, predict_start): 
 
 		if predict_start == "NA": 
-			predict_end = "NA"
-		else:
-			# Infer the end time from start time by setting each meeting to 1 hour default. 
-			predict_end = format(datetime.strptime(predict_start, '%H:%M') + timedelta(hours=1), '%H:%M')
-			# If `DURATION` exists, update end time prediction
-			for dic in self.datetime_df[self.datetime_df['format'] == 'dict']['value']: 
-				if self._convert_time_to_pm(dic['begin'].split('T')[1]) == predict_start: 
-					predict_end = self._convert_time_to_pm(dic['end'].split('T')[1])
+			return "NA" 
 
-		return predict_date, predict_start, predict_end
+		# Infer the end time from start time by setting each meeting to 1 hour default. 
+		predict_end = format(datetime.strptime(predict_start, '%H:%M') + timedelta(hours=1), '%H:%M')
+		# If `DURATION` exists, update end time prediction
+		for evidence in self.datetime_evidence: 
+			if evidence.format != 'dict': continue
+			if self._convert_time_to_pm(evidence.value['begin'].split('T')[1]) == predict_start: 
+				predict_end = self._convert_time_to_pm(evidence.value['end'].split('T')[1])
+
+		return predict_end
 
 
 	############################################
 	#####     DATETIME PARSING HELPERS     #####
 	############################################
 
-	def get_sutime_results_as_dataframe(self, text): 
+	def parse_sutime(self, text): 
+		# SUTime results for text posted with this listing. Copies are returned since callers modify results in place.
+		if text not in self.sutime_results: 
+			key = sutime_cache_key(text, self.posted_date)
+			results = annotate_fast(text, self.posted_date)
+			if results is None: 
+				results = get_result_cache().get('sutime', key)
+			if results is None: 
+				with _sutime_lock: 
+					with metrics.timer('sutime_call_seconds'): 
+						results = get_sutime().parse(text, self.posted_date)
+				metrics.count('sutime_calls_total')
+				metrics.count('sutime_documents_total')
+				get_result_cache().put('sutime', key, results)
+			self.sutime_results[text] = results
+
+		return copy.deepcopy(self.sutime_results[text])
 
-		results = sutime.parse(text, self.posted_date)
+
+	def get_sutime_evidence(self, text): 
+
+		results = self.parse_sutime(text)
 
 		
 		for result in results: 
@@ -215,57 +600,47 @@ class Listing():
 					result['value'] = 'XXX'
 			# Datetime could feasibly be messed up too, but we'll ignore that here
 
+		evidence = []
+		for result in results: 
+			value_format = get_datetime_type(result['value'])
+			if value_format in DATETIME_FORMATS: 
+				evidence.append(Evidence(result['start'], result['end'], result['text'], result['type'], result['value'], value_format, None))
 
-		if len(results) > 0:
-			results_df = pd.DataFrame(results)
-			results_df = results_df[['start', 'end', 'text', 'type', 'value']]
-			results_df['format'] = results_df['value'].apply(get_datetime_type)
-			datetime_df = results_df[results_df['format'].isin(['datetime', 'date', 'time', 'dict'])]
-
-			# Fix up times and dates
-
-			return datetime_df
-
-		return pd.DataFrame([], columns=['start', 'end', 'text', 'type', 'value', 'format'])
+		return evidence
 
 
-	def get_datetime_dataframes(self): 
+	def get_datetime_evidence(self): 
 
 		# Get information from title
-		title_df = self.get_sutime_results_as_dataframe(self.title_mod)
+		title_evidence = self.get_sutime_evidence(self.title_mod)
 		# If more than one date time instance, best to concatenate the two and rerun.
-		if len(title_df) > 1: 
-			title_df = self.get_sutime_results_as_dataframe(' '.join(title_df['text']))
-		title_df['source'] = 'title'
+		if len(title_evidence) > 1: 
+			title_evidence = self.get_sutime_evidence(' '.join(e.text for e in title_evidence))
 
 		# Get information from message
-		message_df = self.get_sutime_results_as_dataframe(self.message_mod)
-		message_df['source'] = 'message'
+		message_evidence = self.get_sutime_evidence(self.message_mod)
 
-		return pd.concat([title_df, message_df])
+		return [e._replace(source='title') for e in title_evidence] + [e._replace(source='message') for e in message_evidence]
 
 
-	def extract_datetime_features(self, datetime_df): 
+	def extract_datetime_features(self, datetime_evidence): 
 
-		# Sort evidence into date and times
+		# Sort evidence into scored dates and times
 		dates = []
 		times = []
-		for i, row in datetime_df.iterrows(): 
-			if row['format'] == 'date': dates.append([row['value'], row['source'], row['format']])
-			elif row['format'] == 'datetime' or row['format'] == 'time': 
-				date, time = row['value'].split('T')
-				dates.append([date, row['source'], row['format']])
-				times.append([self._convert_time_to_pm(time), row['source'], row['format']])
-			elif row['format'] == 'dict': 
-				date, time = row['value']['begin'].split('T')
-				dates.append([date, row['source'], row['format']])
-				times.append([self._convert_time_to_pm(time), row['source'], row['format']])
-			else: pass
+		for e in datetime_evidence: 
+			if e.format == 'date': date, time = e.value, None
+			elif e.format == 'datetime' or e.format == 'time': date, time = e.value.split('T')
+			elif e.format == 'dict': date, time = e.value['begin'].split('T')
+			else: continue
 
-		dates_df = pd.DataFrame(dates, columns=['date', 'source', 'format']).replace('', np.nan).dropna()
-		times_df = pd.DataFrame(times, columns=['time', 'source', 'format']).replace('', np.nan).dropna()
+			# Evidence without a date, e.g. a bare time, only counts towards the time
+			if date != '': dates.append((date, evidence_score(e.source, e.format)))
+			if time is not None: 
+				time = self._convert_time_to_pm(time)
+				times.append((time, evidence_score(e.source, e.format, time)))
 
-		return dates_df, times_df
+		return dates, times
 
 
 	###################################
@@ -274,7 +649,7 @@ class Listing():
 
 	def highlight_text(self, text): 
 
-		results = sutime.parse(text, self.posted_date)
+		results = self.parse_sutime(text)
 
 		for match in results[::-1]: 
 			text = highlight_string(text, match['start'], match['end'])
@@ -333,23 +708,37 @@ class Listing():
 
 	def _get_url(self): 
 
-		with open(os.path.join(self.local_dir, 'urls.txt'), 'r') as f: 
-			urls = [line.rstrip() for line in f.readlines()]
+		return URLRegistry.load(os.path.join(self.local_dir, 'urls.txt')).url_for(self.index)
 
-		for url in urls: 
-			if self.index in url: return url
 
+	def _read_raw(self): 
 
-	def _get_html(self): 
-
+		# Listings saved by earlier versions are individual files
 		if os.path.isfile(self.local_path): 
 			with open(self.local_path, 'r') as f: 
-				lines = f.readlines()
-				if len(lines) > 0: 
-					return BeautifulSoup(''.join(lines), 'html.parser')
-				else: 
-					self.is_talk = False
-					return None
+				return f.read()
+
+		data = ListingArchive.open(os.path.join(self.local_dir, 'archive')).get(self.index)
+		if data is not None: 
+			return decode_html(data)
+
+
+	@property
+	def html(self): 
+		# Full BeautifulSoup tree of the page, built on first access
+		if self._html is None: 
+			self._html = self._get_html()
+		return self._html
+
+
+	def _get_html(self): 
+
+		if self.raw is not None: 
+			if len(self.raw) > 0: 
+				return BeautifulSoup(self.raw, 'html.parser')
+			else: 
+				self.is_talk = False
+				return None
 
 
 	def _is_talk(self): 
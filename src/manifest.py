@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import os
+import ast
+import json
+import logging
+import sqlite3
+from contextlib import contextmanager
+
+from similarity import SimilarityIndex
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter('%(asctime)s - Manifest: %(levelname)s - %(message)s', "%I:%M:%S"))
+logger.addHandler(handler)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+	row_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+	event_id      INTEGER,
+	idx           TEXT,
+	url           TEXT,
+	is_talk       INTEGER,
+	is_correction INTEGER,
+	pushed_to_cal INTEGER,
+	metadata      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS listings_event_id ON listings (event_id);
+CREATE INDEX IF NOT EXISTS listings_idx      ON listings (idx);
+CREATE INDEX IF NOT EXISTS listings_url      ON listings (url);
+CREATE TABLE IF NOT EXISTS manifest_meta (
+	key   TEXT PRIMARY KEY,
+	value TEXT
+);
+"""
+
+
+def url_from_description(description): 
+	# The listing URL is stored as the last line of the event description
+	return str(description).split('\n')[-1]
+
+
+def row_url(metadata): 
+
+	return metadata.get('url') or url_from_description(metadata.get('description', ''))
+
+
+class ManifestStore(): 
+	# Manifest of parsed listings backed by SQLite. Every append is a single-row insert committed on its own
+	# (or as part of an explicit transaction), so ingest cost no longer grows with the size of the manifest.
+
+	def __init__(self, path, legacy_path=None): 
+
+		self.path = path
+		self.legacy_path = legacy_path
+
+		# Opened and used from different executor threads by the pipeline, but never concurrently
+		self.conn = sqlite3.connect(self.path, check_same_thread=False)
+		self.conn.row_factory = sqlite3.Row
+		self.conn.execute('PRAGMA journal_mode=WAL')
+		self.conn.execute('PRAGMA synchronous=FULL')
+		self.conn.executescript(SCHEMA)
+
+		self._in_transaction = False
+
+		# Near-duplicate index over messages, kept in the same database and updated with every append
+		self.similarity_index = SimilarityIndex(self.conn)
+
+		self._migrate_legacy()
+
+		self._index_missing_rows()
+
+
+	##########################################
+	#####     READ / WRITE FUNCTIONS     #####
+	##########################################
+
+	def append(self, metadata): 
+
+		cursor = self.conn.execute(
+			'INSERT INTO listings (event_id, idx, url, is_talk, is_correction, pushed_to_cal, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)',
+			self._to_row(metadata)
+		)
+		self.similarity_index.add(cursor.lastrowid, metadata.get('message', ''))
+		self._commit()
+
+		return cursor.lastrowid
+
+
+	def update(self, row_id, metadata): 
+		# Replace the stored metadata of an existing row, e.g. once it has been pushed to the calendar
+		self.conn.execute(
+			'UPDATE listings SET event_id = ?, idx = ?, url = ?, is_talk = ?, is_correction = ?, pushed_to_cal = ?, metadata = ? WHERE row_id = ?',
+			self._to_row(metadata) + (row_id,)
+		)
+		self._commit()
+
+
+	@contextmanager
+	def transaction(self): 
+		# Group several appends into one commit. Nothing is written if the block raises.
+		self._in_transaction = True
+		try: 
+			yield self
+			self.conn.commit()
+		except BaseException: 
+			self.conn.rollback()
+			raise
+		finally: 
+			self._in_transaction = False
+
+
+	def backup(self, path): 
+		# Consistent copy of the manifest at `path`, taken through SQLite so it is safe while the manifest is open
+		target = sqlite3.connect(path)
+		try: 
+			self.conn.backup(target)
+		finally: 
+			target.close()
+
+
+	def clear(self): 
+		# Remove every row, e.g. before the manifest is rebuilt
+		with self.transaction(): 
+			self.conn.execute('DELETE FROM listings')
+			self.similarity_index.clear()
+
+
+	def close(self): 
+
+		self.conn.close()
+
+
+	###########################
+	#####     LOOKUPS     #####
+	###########################
+
+	def __len__(self): 
+
+		return self.conn.execute('SELECT COUNT(*) FROM listings').fetchone()[0]
+
+
+	def __iter__(self): 
+
+		for row in self.conn.execute('SELECT metadata FROM listings ORDER BY row_id'): 
+			yield json.loads(row['metadata'])
+
+
+	def items(self, event_id=None): 
+		# (row_id, metadata) pairs, oldest first, optionally only those of one event
+		if event_id is None: 
+			rows = self.conn.execute('SELECT row_id, metadata FROM listings ORDER BY row_id')
+		else: 
+			rows = self.conn.execute('SELECT row_id, metadata FROM listings WHERE event_id = ? ORDER BY row_id', (int(event_id),)).fetchall()
+		for row in rows: 
+			yield row['row_id'], json.loads(row['metadata'])
+
+
+	def pending(self): 
+		# (row_id, metadata) pairs of the rows flagged `push_pending`, oldest first
+		rows = self.conn.execute("SELECT row_id, metadata FROM listings WHERE is_talk = 1 AND json_extract(metadata, '$.push_pending') ORDER BY row_id").fetchall()
+		return [(row['row_id'], json.loads(row['metadata'])) for row in rows]
+
+
+	def tail(self, n): 
+		# Last `n` rows, oldest first
+		rows = self.conn.execute('SELECT metadata FROM listings ORDER BY row_id DESC LIMIT ?', (n,)).fetchall()
+		return [json.loads(row['metadata']) for row in rows[::-1]]
+
+
+	def candidates(self, message, recent=0): 
+		# Rows that may describe the same event as `message`, oldest first: near-duplicates from the similarity 
+		# index, plus the `recent` most recent rows if asked for
+		row_ids = self.similarity_index.candidates(message)
+		if recent: 
+			row_ids.update(row[0] for row in self.conn.execute('SELECT row_id FROM listings ORDER BY row_id DESC LIMIT ?', (recent,)))
+
+		return self._get_rows(sorted(row_ids))
+
+
+	def max_event_id(self): 
+
+		return self.conn.execute('SELECT MAX(event_id) FROM listings').fetchone()[0]
+
+
+	def has_event(self, event_id): 
+
+		return self.conn.execute('SELECT 1 FROM listings WHERE event_id = ? LIMIT 1', (int(event_id),)).fetchone() is not None
+
+
+	def get_by_event(self, event_id): 
+
+		rows = self.conn.execute('SELECT metadata FROM listings WHERE event_id = ? ORDER BY row_id', (int(event_id),))
+		return [json.loads(row['metadata']) for row in rows]
+
+
+	def get_by_index(self, index): 
+
+		row = self.conn.execute('SELECT metadata FROM listings WHERE idx = ? ORDER BY row_id DESC LIMIT 1', (str(index),)).fetchone()
+		return json.loads(row['metadata']) if row else None
+
+
+	def get_by_url(self, url): 
+
+		row = self.conn.execute('SELECT metadata FROM listings WHERE url = ? ORDER BY row_id DESC LIMIT 1', (url,)).fetchone()
+		return json.loads(row['metadata']) if row else None
+
+
+	def urls(self): 
+
+		return { row['url'] for row in self.conn.execute('SELECT url FROM listings') }
+
+
+	def to_dataframe(self): 
+		# Convenience for notebooks
+		import pandas as pd
+		return pd.DataFrame(list(self))
+
+
+	####################################
+	#####     HELPER FUNCTIONS     #####
+	####################################
+
+	def _commit(self): 
+
+		if not self._in_transaction: 
+			self.conn.commit()
+
+
+	def _get_rows(self, row_ids, chunk_size=500): 
+
+		rows = []
+		for i in range(0, len(row_ids), chunk_size): 
+			chunk = row_ids[i:i+chunk_size]
+			query = 'SELECT metadata FROM listings WHERE row_id IN ({}) ORDER BY row_id'.format(','.join('?' * len(chunk)))
+			rows += [json.loads(row['metadata']) for row in self.conn.execute(query, chunk)]
+
+		return rows
+
+
+	def _index_missing_rows(self): 
+		# Manifests created before the similarity index existed are indexed once, on open
+		row_ids = self.similarity_index.unindexed()
+		if len(row_ids) == 0: return
+
+		with self.transaction(): 
+			for row_id in row_ids: 
+				metadata = json.loads(self.conn.execute('SELECT metadata FROM listings WHERE row_id = ?', (row_id,)).fetchone()['metadata'])
+				self.similarity_index.add(row_id, metadata.get('message', ''))
+
+		logger.info("Indexed {} manifest rows for similarity search".format(len(row_ids)))
+
+
+	def _to_row(self, metadata): 
+
+		url = row_url(metadata)
+		event_id = metadata.get('event_id')
+
+		return (
+			None if event_id is None else int(event_id),
+			None if metadata.get('index') is None else str(metadata.get('index')),
+			url,
+			bool(metadata.get('is_talk')),
+			bool(metadata.get('is_correction')),
+			bool(metadata.get('pushed_to_cal')),
+			json.dumps(metadata, default=str)
+		)
+
+
+	def _migrate_legacy(self): 
+		# The legacy manifest is imported into an empty manifest that has not been migrated yet. The marker is 
+		# written with the imported rows, so an interrupted migration is simply run again on next open, while a 
+		# manifest emptied later, e.g. by `clear`, is not filled from the legacy file again.
+		if self.conn.execute("SELECT 1 FROM manifest_meta WHERE key = 'legacy_migrated'").fetchone() is not None: return
+
+		if len(self) == 0 and self.legacy_path and os.path.exists(self.legacy_path): 
+			self._migrate_tsv(self.legacy_path)
+		else: 
+			with self.transaction(): 
+				self._mark_migrated()
+
+
+	def _mark_migrated(self): 
+
+		self.conn.execute("INSERT OR REPLACE INTO manifest_meta (key, value) VALUES ('legacy_migrated', '1')")
+
+
+	def _migrate_tsv(self, tsv_path): 
+		# Import a manifest written by earlier versions (one TSV rewritten on every append)
+		import pandas as pd
+
+		df = pd.read_csv(tsv_path, sep='\t')
+		df = df.astype(object).where(pd.notnull(df), None)
+
+		with self.transaction(): 
+			for record in df.to_dict('records'): 
+				metadata = {}
+				for key, value in record.items(): 
+					if value is None: continue
+					# Nested fields such as `start` and `end` were serialized as their Python repr
+					if isinstance(value, str) and value.startswith('{'): 
+						try: value = ast.literal_eval(value)
+						except (ValueError, SyntaxError): pass
+					if hasattr(value, 'item'): value = value.item()
+					metadata[key] = value
+				if 'event_id' in metadata: metadata['event_id'] = int(metadata['event_id'])
+				self.append(metadata)
+			self._mark_migrated()
+
+		logger.info("Migrated {} rows from {} to {}".format(len(df), tsv_path, self.path))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import os
+import io
+import re
+import gzip
+import html
+from collections import namedtuple
+
+# Email modules
+from email import message_from_bytes, policy
+from email.header import decode_header, make_header
+from email.utils import parsedate_to_datetime
+
+
+# A message of a monthly archive, with the fields a listing reads from a message page
+MboxMessage = namedtuple('MboxMessage', ['subject', 'posted', 'body'])
+
+# Separator line starting each message, e.g. `From jdoe at mit.edu  Thu Mar  1 10:00:00 2018`
+FROM_LINE_RE = re.compile(rb'^From \S.*\s(?P<date>\w{3} \w{3} +\d{1,2} \d\d:\d\d:\d\d \d{4})\s*$')
+
+
+def monthly_archive_url(batch_url): 
+	# Gzipped text archive of the month listed on date page `batch_url`, e.g. `.../2018-March.txt.gz`
+	return os.path.dirname(batch_url) + '.txt.gz'
+
+
+def decompress_archive(data): 
+	# Monthly archives are served either gzipped or, for the current month, as plain text. Some servers also undo
+	# the gzip on the fly, so the payload is checked rather than the URL.
+	if data[:2] == b'\x1f\x8b': 
+		return gzip.GzipFile(fileobj=io.BytesIO(data))
+	return io.BytesIO(data)
+
+
+def iter_mbox(stream): 
+	# Messages of an mbox stream, one at a time, as (From line date, raw message bytes)
+	date, lines = None, []
+	previous_blank = True
+	for line in stream: 
+		m = FROM_LINE_RE.match(line) if previous_blank else None
+		if m is not None: 
+			if lines: yield date, b''.join(lines)
+			date, lines = m.group('date').decode(), []
+		elif date is not None: 
+			lines.append(line[1:] if line.startswith(b'>From ') else line)
+		previous_blank = line.strip() == b''
+
+	if lines: yield date, b''.join(lines)
+
+
+def parse_message(from_date, raw): 
+
+	message = message_from_bytes(raw, policy=policy.compat32)
+
+	subject = str(make_header(decode_header(message.get('Subject', ''))))
+
+	# Pipermail shows the arrival time of the From line, as does `<i>` on its message pages. The Date header is
+	# only used if the From line has none.
+	posted = ' '.join(from_date.split()) if from_date else None
+	if posted is None and message.get('Date'): 
+		try: 
+			posted = parsedate_to_datetime(message['Date']).strftime('%a %b %d %H:%M:%S %Y')
+		except (TypeError, ValueError): 
+			pass
+
+	return MboxMessage(subject, posted or '', _text_body(message))
+
+
+def read_monthly_archive(data): 
+	# Messages of a downloaded monthly archive, in the order they were archived
+	return [parse_message(from_date, raw) for from_date, raw in iter_mbox(decompress_archive(data))]
+
+
+def message_page(message): 
+	# Minimal pipermail message page for `message`, so the listing parses it exactly as a downloaded page
+	return ('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2//EN">\n<HTML>\n <HEAD>\n   <TITLE> {subject}\n   </TITLE>\n </HEAD>\n'
+			' <BODY BGCOLOR="#ffffff">\n   <H1>{subject}</H1>\n    <I>{posted}</I>\n<!--beginarticle-->\n<PRE>{body}\n</PRE>\n'
+			'<!--endarticle-->\n</body></html>\n').format(subject=html.escape(message.subject, quote=False),
+														 posted=html.escape(message.posted, quote=False),
+														 body=html.escape(message.body, quote=False)).encode('utf-8')
+
+
+####################################
+#####     HELPER FUNCTIONS     #####
+####################################
+
+def _text_body(message): 
+	# Archived messages are scrubbed to plain text, but older archives can still hold multipart messages
+	for part in message.walk(): 
+		if part.get_content_maintype() == 'multipart': continue
+		if part.get_content_type() != 'text/plain': continue
+
+		payload = part.get_payload(decode=True) or b''
+		charset = part.get_content_charset() or 'utf-8'
+		try: 
+			return payload.decode(charset, errors='replace').rstrip('\n')
+		except LookupError: 
+			return payload.decode('utf-8', errors='replace').rstrip('\n')
+
+	return ''
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import json
+import time
+import bisect
+import functools
+import threading
+from collections import defaultdict
+from contextlib import nullcontext
+
+from utils import atomic_write
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = [ 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60. ]
+
+# Prefix of every metric in the Prometheus export
+PROMETHEUS_PREFIX = 'mit_talks_'
+
+_disabled_timer = nullcontext()
+
+
+class Timer(): 
+	# Times a `with` block into a histogram
+
+	def __init__(self, metrics, name, labels): 
+
+		self.metrics = metrics
+		self.name    = name
+		self.labels  = labels
+
+
+	def __enter__(self): 
+
+		self.start = time.perf_counter()
+		return self
+
+
+	def __exit__(self, *exc_info): 
+
+		self.seconds = time.perf_counter() - self.start
+		self.metrics.observe(self.name, self.seconds, **self.labels)
+
+
+class Metrics(): 
+	# Counters and latency histograms for one run, keyed by name and labels. Nothing is recorded until `enable` is
+	# called; while disabled every call returns after a single attribute check.
+
+	def __init__(self): 
+
+		self.enabled = False
+		self._lock = threading.Lock()
+		self.reset()
+
+
+	def enable(self): 
+
+		self.reset()
+		self.enabled = True
+
+
+	def disable(self): 
+
+		self.enabled = False
+
+
+	def reset(self): 
+
+		with self._lock: 
+			self.counters   = defaultdict(float)
+			# (name, labels) -> per-bucket counts, with one extra bucket for values above the last bound, and the sum
+			self.histograms = {}
+			self.started    = time.time()
+
+
+	###############################
+	#####     INSTRUMENTS     #####
+	###############################
+
+	def count(self, name, value=1, **labels): 
+
+		if not self.enabled: return
+
+		with self._lock: 
+			self.counters[(name, _label_key(labels))] += value
+
+
+	def observe(self, name, seconds, **labels): 
+
+		if not self.enabled: return
+
+		with self._lock: 
+			key = (name, _label_key(labels))
+			if key not in self.histograms: 
+				self.histograms[key] = [[0] * (len(BUCKETS) + 1), 0.]
+			counts, _ = self.histograms[key]
+			counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+			self.histograms[key][1] += seconds
+
+
+	def timer(self, name, **labels): 
+		# Context manager recording the duration of its block in histogram `name`
+		if not self.enabled: return _disabled_timer
+		return Timer(self, name, labels)
+
+
+	###########################
+	#####     REPORTS     #####
+	###########################
+
+	def report(self): 
+		# Structured summary of the run, e.g. to be written as JSON
+		with self._lock: 
+			counters   = dict(self.counters)
+			histograms = { key: (list(counts), total) for key, (counts, total) in self.histograms.items() }
+
+		report = { 'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+				   'seconds': round(time.time() - self.started, 3),
+				   'counters': {}, 'timers': {} }
+
+		for (name, labels), value in sorted(counters.items()): 
+			report['counters'].setdefault(name, {})[_label_string(labels)] = value
+
+		for (name, labels), (counts, total) in sorted(histograms.items()): 
+			n = sum(counts)
+			report['timers'].setdefault(name, {})[_label_string(labels)] = {
+				'count': n,
+				'seconds': round(total, 6),
+				'mean': round(total / n, 6) if n else 0.,
+				'buckets': { str(bound): count for bound, count in zip(BUCKETS + ['inf'], counts) if count }
+			}
+
+		# Hit rates of every counter pair named `<x>_hits_total` and `<x>_misses_total`
+		prefixes = { name.rsplit('_', 2)[0] for name in report['counters'] if name.endswith(('_hits_total', '_misses_total')) }
+		for prefix in prefixes: 
+			hits   = report['counters'].get(prefix + '_hits_total', {})
+			misses = report['counters'].get(prefix + '_misses_total', {})
+			report['counters'][prefix + '_hit_rate'] = { labels: round(hits.get(labels, 0) / (hits.get(labels, 0) + misses.get(labels, 0)), 4)
+														 for labels in set(hits) | set(misses) }
+
+		# Unlabeled metrics are reported as plain values
+		for section in ['counters', 'timers']: 
+			for name, values in report[section].items(): 
+				if list(values) == ['']: report[section][name] = values['']
+
+		return report
+
+
+	def to_prometheus(self): 
+		# Text exposition format, e.g. for the node exporter's textfile collector
+		with self._lock: 
+			counters   = dict(self.counters)
+			histograms = { key: (list(counts), total) for key, (counts, total) in self.histograms.items() }
+
+		lines, typed = [], set()
+		for (name, labels), value in sorted(counters.items()): 
+			name = PROMETHEUS_PREFIX + name
+			if name not in typed: 
+				lines.append('# TYPE {} counter'.format(name))
+				typed.add(name)
+			lines.append('{}{} {}'.format(name, _prometheus_labels(labels), _number(value)))
+
+		for (name, labels), (counts, total) in sorted(histograms.items()): 
+			name = PROMETHEUS_PREFIX + name
+			if name not in typed: 
+				lines.append('# TYPE {} histogram'.format(name))
+				typed.add(name)
+			cumulative = 0
+			for bound, count in zip(BUCKETS + ['+Inf'], counts): 
+				cumulative += count
+				lines.append('{}_bucket{} {}'.format(name, _prometheus_labels(labels + (('le', str(bound)),)), cumulative))
+			lines.append('{}_sum{} {}'.format(name, _prometheus_labels(labels), _number(total)))
+			lines.append('{}_count{} {}'.format(name, _prometheus_labels(labels), cumulative))
+
+		return '\n'.join(lines) + '\n'
+
+
+	def write_report(self, path): 
+
+		atomic_write(path, json.dumps(self.report(), indent=1, sort_keys=True))
+
+
+	def write_prometheus(self, path): 
+
+		atomic_write(path, self.to_prometheus())
+
+
+####################################
+#####     HELPER FUNCTIONS     #####
+####################################
+
+def _label_key(labels): 
+
+	return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _label_string(labels): 
+
+	return ','.join('{}={}'.format(key, value) for key, value in labels)
+
+
+def _prometheus_labels(labels): 
+
+	if len(labels) == 0: return ''
+	return '{' + ','.join('{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+
+def _number(value): 
+
+	return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Shared by every module of a process
+metrics = Metrics()
+
+
+def timed_stage(stage): 
+	# Method decorator recording each call in the `stage_seconds` histogram, labeled with the instance's list id
+	def decorator(method): 
+		@functools.wraps(method)
+		def wrapper(self, *args, **kwargs): 
+			if not metrics.enabled: return method(self, *args, **kwargs)
+			with metrics.timer('stage_seconds', stage=stage, list=getattr(self, 'list_id', '')): 
+				return method(self, *args, **kwargs)
+		return wrapper
+	return decorator
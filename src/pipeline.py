@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import asyncio
+import logging
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+# External modules
+from download_listings import ListServe
+from events import Events, parse_listing
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter('%(asctime)s - Pipeline: %(levelname)s - %(message)s', "%I:%M:%S"))
+logger.addHandler(handler)
+
+
+class Pipeline(): 
+	# Runs every list serve concurrently. Within a list, listings stream from download to parsing through bounded
+	# queues while the remaining downloads are still in flight. Blocking work (requests, BeautifulSoup, SUTime,
+	# manifest writes and calendar pushes) runs on executors so the event loop only coordinates.
+
+	def __init__(self, list_serves, host_concurrency=8, queue_size=64, download_workers=8, parse_workers=4): 
+
+		self.list_serves = list_serves
+
+		# Maximum simultaneous requests per host, shared by all lists on that host
+		self.host_concurrency = host_concurrency
+		self.queue_size       = queue_size
+		self.download_workers = download_workers
+		self.parse_workers    = parse_workers
+
+		self._host_semaphores = {}
+
+
+	def run(self): 
+
+		return asyncio.run(self._run())
+
+
+	async def _run(self): 
+
+		with ThreadPoolExecutor(max_workers=self.host_concurrency * 2) as io_executor, \
+			 ThreadPoolExecutor(max_workers=self.parse_workers) as cpu_executor: 
+
+			self._io_executor  = io_executor
+			self._cpu_executor = cpu_executor
+
+			results = await asyncio.gather(*[self.process_list(list_serve) for list_serve in self.list_serves], return_exceptions=True)
+
+		for list_serve, result in zip(self.list_serves, results): 
+			if isinstance(result, Exception): 
+				logger.error("{} failed: {!r}".format(list_serve["list_id"], result))
+			else: 
+				logger.info("{}: {} new listings.".format(list_serve["list_id"], result))
+
+		return results
+
+
+	###################################
+	#####     PIPELINE STAGES     #####
+	###################################
+
+	async def process_list(self, list_serve): 
+
+		list_id = list_serve["list_id"]
+		semaphore = self._host_semaphore(list_serve["host"])
+
+		l = await self._io(ListServe, list_id, list_serve["host"])
+
+		# Fast path: nothing changed upstream and nothing is waiting to be parsed
+		if not l.pending: 
+			async with semaphore: 
+				changed = await self._io(l.has_changes)
+			if not changed: return 0
+
+		events = await self._io(Events, list_id=list_id, calendar_name=list_serve["cal_name"])
+
+		async with semaphore: 
+			urls = await self._io(l.get_new_listings)
+
+		url_queue   = asyncio.Queue(maxsize=self.queue_size)
+		parse_queue = asyncio.Queue(maxsize=self.queue_size)
+
+		saved, failed, parsed, unparsed = [], [], [], []
+
+		async def produce(): 
+			for url in urls: 
+				await url_queue.put(url)
+			for _ in range(self.download_workers): 
+				await url_queue.put(None)
+
+		async def download(): 
+			while True: 
+				url = await url_queue.get()
+				if url is None: return
+				try: 
+					async with semaphore: 
+						await self._io(l.save_listing, url)
+				except Exception as e: 
+					logger.warning("Failed to download {}: {!r}".format(url, e))
+					failed.append(url)
+					continue
+				# Registered right away so the listing can resolve its URL; the url manifest is written at the end
+				l.registry.add(url)
+				saved.append(url)
+				await parse_queue.put(url)
+
+		async def parse(): 
+			while True: 
+				url = await parse_queue.get()
+				if url is None: return
+				# A listing that fails to parse must not stop the worker, or the downloads block on the full queue
+				try: 
+					listing = await self._cpu(parse_listing, url)
+				except Exception as e: 
+					logger.warning("Failed to parse {}: {!r}".format(url, e))
+					unparsed.append(url)
+					continue
+				if listing is not None: parsed.append(listing)
+
+		parsers = [asyncio.ensure_future(parse()) for _ in range(self.parse_workers)]
+
+		# Listings downloaded by an earlier run but never added to the manifest
+		for url in events.new_urls: 
+			await parse_queue.put(url)
+
+		await asyncio.gather(produce(), *[download() for _ in range(self.download_workers)])
+		for _ in parsers: 
+			await parse_queue.put(None)
+		await asyncio.gather(*parsers)
+
+		# Failed listings are kept by the list serve and retried on the next run
+		await self._io(l.commit_update, saved, failed)
+
+		# Event ids are assigned in posted order, so the manifest and calendar stage runs once all listings are parsed
+		await self._cpu(events.ingest, parsed)
+
+		# Listings that failed to parse stay saved but out of the manifest, and the list stays pending so the next 
+		# run parses them again
+		if not unparsed: 
+			await self._io(l.mark_processed)
+
+		return len(saved)
+
+
+	####################################
+	#####     HELPER FUNCTIONS     #####
+	####################################
+
+	def _host_semaphore(self, host): 
+
+		netloc = urlparse(host).netloc
+		if netloc not in self._host_semaphores: 
+			self._host_semaphores[netloc] = asyncio.Semaphore(self.host_concurrency)
+
+		return self._host_semaphores[netloc]
+
+
+	def _io(self, fn, *args, **kwargs): 
+
+		return asyncio.get_running_loop().run_in_executor(self._io_executor, lambda: fn(*args, **kwargs))
+
+
+	def _cpu(self, fn, *args, **kwargs): 
+
+		return asyncio.get_running_loop().run_in_executor(self._cpu_executor, lambda: fn(*args, **kwargs))
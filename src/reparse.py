@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import logging
+import argparse
+from collections import Counter
+
+# External modules
+from listing import STAGE_VERSIONS, annotate_listings, stale_stages
+from events import Events, iter_saved_listings, parse_listing
+from manifest import row_url
+from backfill import Backfill
+from session import EVENT_FIELDS
+from update_calendar import LIST_SERVES
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter('%(asctime)s - Reparse: %(levelname)s - %(message)s', "%I:%M:%S"))
+logger.addHandler(handler)
+
+
+# Manifest fields that are not parse results and are kept when a row is re-parsed
+KEPT_FIELDS = [ 'event_id', 'pushed_to_cal', 'calendar_event_id', 'push_pending' ]
+
+
+class Reparse(): 
+	# Brings a list's manifest up to date with the current parse stages. Rows whose recorded stage keys all match
+	# are left alone. Other rows are re-parsed in place, recomputing only the stale stages: extraction and
+	# normalization come from the cache unless they changed, and SUTime only sees texts it has not annotated before.
+	# Event grouping depends on every earlier row, so if it is stale the manifest is rebuilt with `Backfill`. Events
+	# whose calendar fields changed are then patched on the calendar.
+
+	def __init__(self, list_id, calendar_name, dry_run=False): 
+
+		self.list_id  = list_id
+		self.cal_name = calendar_name
+		self.dry_run  = dry_run
+
+
+	def run(self): 
+
+		events = Events(list_id=self.list_id, calendar_name=self.cal_name, dry_run=self.dry_run)
+
+		# Pages are read segment by segment from the archive, so rows are visited in the order their pages are stored
+		rows = { row_url(metadata): (row_id, metadata) for row_id, metadata in events.manifest.items() }
+
+		stale_rows, counts = [], Counter()
+		for url, raw in iter_saved_listings(self.list_id, list(rows)): 
+			row_id, metadata = rows[url]
+			l = parse_listing(url, raw)
+			if l is None: continue
+
+			# Rows written before stage keys were recorded keep their event grouping
+			recorded = metadata.get('stages') or { 'grouping': l.stages['grouping'] }
+			stale = stale_stages(recorded, l.stages)
+			if len(stale) == 0: continue
+
+			counts.update(stale)
+			stale_rows.append((row_id, metadata, l))
+
+		for stage, n in counts.items(): 
+			metrics.count('reparse_stale_total', n, list=self.list_id, stage=stage)
+		logger.info("{} of {} rows are stale ({})".format(len(stale_rows), len(events.manifest),
+			', '.join('{}: {}'.format(stage, counts[stage]) for stage in STAGE_VERSIONS if counts[stage]) or 'none'))
+
+		if counts['grouping']: 
+			events.manifest.close()
+			logger.info("Event grouping changed, rebuilding the manifest")
+			backfill = Backfill(self.list_id, self.cal_name, dry_run=self.dry_run)
+			backfill.rebuild()
+			return backfill.run()
+
+		# Listings restored from the cache are complete; the others are annotated together
+		annotate_listings([l for _, _, l in stale_rows])
+
+		changed = []
+		with events.manifest.transaction(): 
+			for row_id, metadata, l in stale_rows: 
+				new_metadata = l.get_parsed_metadata_dense()
+				for field in KEPT_FIELDS: 
+					if field in metadata: new_metadata[field] = metadata[field]
+
+				if any(new_metadata.get(field) != metadata.get(field) for field in EVENT_FIELDS + ['is_talk', 'is_correction']): 
+					changed.append((row_id, new_metadata))
+				events.manifest.update(row_id, new_metadata)
+
+		logger.info("{} rows re-parsed, {} with different calendar fields".format(len(stale_rows), len(changed)))
+
+		# Only the calendar events of changed rows are reconciled
+		events.push_batch_to_google_calendar(changed)
+		events.manifest.close()
+
+		return len(stale_rows)
+
+
+def parse_args(): 
+
+	parser = argparse.ArgumentParser(description='Re-parse the manifest rows whose parse stages changed.')
+	parser.add_argument('list_id', choices=[list_serve["list_id"] for list_serve in LIST_SERVES])
+	parser.add_argument('--dry-run', action='store_true', help='Re-parse rows without editing Google Calendar')
+	return parser.parse_args()
+
+
+
+
+if __name__ == "__main__":
+	args = parse_args()
+	list_serve = [list_serve for list_serve in LIST_SERVES if list_serve["list_id"] == args.list_id][0]
+
+	Reparse(args.list_id, list_serve["cal_name"], dry_run=args.dry_run).run()
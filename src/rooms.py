@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import os
+import pickle
+from collections import deque
+
+
+# Bump when the automaton layout changes so stale on-disk caches are rebuilt
+MATCHER_VERSION = 1
+
+
+def normalize_room(text): 
+	# Dotted and dashed room names are equivalent (`32-123` == `32.123`). Replacing one character with another
+	# keeps string offsets aligned with the original text.
+	return text.replace('.', '-')
+
+
+def read_rooms_csv(path): 
+	# Room names are the first space-separated field of each line. Only keep entries that look like room numbers.
+	with open(path, 'r') as f: 
+		rooms = [line.split(' ')[0].strip() for line in f.readlines()]
+	return [room for room in rooms if '-' in room and len(room) < 15]
+
+
+class RoomMatcher(): 
+	# Aho-Corasick automaton over all room names, so every room mention in a message is found in a single pass.
+
+	def __init__(self, rooms): 
+
+		self.rooms = sorted(set(normalize_room(room) for room in rooms), key=len, reverse=True)
+
+		self._build()
+
+
+	@classmethod
+	def from_csv(cls, path, cache_path=None): 
+		# Load a compiled matcher from `cache_path` if it was built from the same CSV, otherwise build and cache it
+		stat = os.stat(path)
+		signature = (MATCHER_VERSION, os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+		if cache_path is not None and os.path.isfile(cache_path): 
+			try: 
+				with open(cache_path, 'rb') as f: 
+					cached = pickle.load(f)
+				if cached['signature'] == signature: 
+					return cached['matcher']
+			except (OSError, EOFError, KeyError, pickle.UnpicklingError): 
+				pass
+
+		matcher = cls(read_rooms_csv(path))
+
+		if cache_path is not None: 
+			os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+			tmp_path = cache_path + '.tmp'
+			with open(tmp_path, 'wb') as f: 
+				pickle.dump({'signature': signature, 'matcher': matcher}, f)
+			os.replace(tmp_path, cache_path)
+
+		return matcher
+
+
+	#####################################
+	#####     MATCHER FUNCTIONS     #####
+	#####################################
+
+	def find_all(self, text): 
+		# Return (start, end) spans of every room mention in `text`
+		goto, fail, out = self._goto, self._fail, self._out
+
+		matches = []
+		state = 0
+		for i, ch in enumerate(normalize_room(text)): 
+			while state and ch not in goto[state]: 
+				state = fail[state]
+			state = goto[state].get(ch, 0)
+			for length in out[state]: 
+				matches.append((i - length + 1, i + 1))
+
+		return matches
+
+
+	def find_first(self, text): 
+		# Earliest room mention that is not part of a longer mention, as written in `text`. None if no room is found.
+		matches = self.find_all(text)
+		matches.sort(key=lambda span: (span[0], span[0] - span[1]))
+
+		for start, end in matches: 
+			contained = any(s <= start and end <= e and e - s > end - start for s, e in matches)
+			if not contained: 
+				return text[start:end]
+
+		return None
+
+
+	####################################
+	#####     HELPER FUNCTIONS     #####
+	####################################
+
+	def _build(self): 
+
+		# Trie of all room names. `out` holds the lengths of the rooms that end at each node.
+		self._goto = [{}]
+		self._out  = [[]]
+		for room in self.rooms: 
+			node = 0
+			for ch in room: 
+				if ch not in self._goto[node]: 
+					self._goto.append({})
+					self._out.append([])
+					self._goto[node][ch] = len(self._goto) - 1
+				node = self._goto[node][ch]
+			self._out[node].append(len(room))
+
+		# Failure links, computed breadth-first
+		self._fail = [0] * len(self._goto)
+		queue = deque(self._goto[0].values())
+		while queue: 
+			node = queue.popleft()
+			for ch, child in self._goto[node].items(): 
+				queue.append(child)
+				state = self._fail[node]
+				while state and ch not in self._goto[state]: 
+					state = self._fail[state]
+				self._fail[child] = self._goto[state].get(ch, 0)
+				self._out[child] = self._out[child] + self._out[self._fail[child]]
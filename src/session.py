@@ -5,17 +5,21 @@ import os
 import logging
 
 # Peripheral python modules
+import time
 import pickle
+import re
+import threading
+import hashlib
+from urllib.parse import urlparse
 
 # Web scraping modules
 import json
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 
-# Google API modules
-from googleapiclient.discovery import build
-from httplib2 import Http
-from oauth2client import file, client, tools
+from utils import atomic_write
+from metrics import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -26,76 +30,270 @@ handler.setFormatter(logging.Formatter('%(asctime)s - Session: %(levelname)s - %
 logger.addHandler(handler)
 
 
-class Session(): 
+# Private archive login form, served in place of the requested page when cookies are missing or have expired
+LOGIN_FORM_RE = re.compile(rb'<input[^>]+type="?password', re.IGNORECASE)
 
-	def __init__(self, list_id, host, login='../credentials/MIT_login.json'):
 
-		self.list_id = list_id
-		self.host    = host
+class LoginError(Exception): 
+	pass
+
+
+class SyncTokenExpired(Exception): 
+	# The calendar no longer accepts a sync token, so its events have to be listed in full again
+	pass
+
 
-		self.cookies_path = '../credentials/.cookies/cookies.{}.pkl'.format(self.list_id)
+class HostSession(): 
+	# One requests session per archive host, shared by every list on it: keep-alive connections, cookies and logins.
+	# Nothing is logged in up front. A list logs in the first time the host answers with its login form, and again
+	# whenever its cookies expire.
+
+	_sessions = {}
+	_sessions_lock = threading.Lock()
+
+	def __init__(self, host, login='../credentials/MIT_login.json', pool_size=10): 
+
+		self.host = host
+		self.netloc = urlparse(host).netloc
+
+		self.cookies_path = '../credentials/.cookies/cookies.{}.pkl'.format(self.netloc.replace(':', '_'))
 
 		# Import login data
 		self.login_data = json.load(open(login))
 
-		# Try reopenning session with cookies, otherwise open new session
+		# Serializes logins, so lists on the same host do not log in concurrently. Logins so far per list.
+		self._login_lock = threading.Lock()
+		self._logins = {}
+
+		self.session = requests.session()
+		# Archive pages are text and compress well
+		self.session.headers['Accept-Encoding'] = 'gzip, deflate'
 		try: 
-			self.session = self._load_session()
-		except: 
-			self.session = self._init_login()
-			self._save_session()
+			self._load_cookies()
+		except Exception: 
+			pass
+
+		self.pool_size = 0
+		self._mount_adapters(pool_size)
+
+
+	@classmethod
+	def for_host(cls, host, login='../credentials/MIT_login.json', pool_size=10): 
+		# Shared session for `host`, with at least `pool_size` keep-alive connections
+		key = urlparse(host).netloc
+		with cls._sessions_lock: 
+			if key not in cls._sessions: 
+				cls._sessions[key] = cls(host, login=login, pool_size=pool_size)
+			elif cls._sessions[key].pool_size < pool_size: 
+				cls._sessions[key]._mount_adapters(pool_size)
+
+		return cls._sessions[key]
+
+
+	@classmethod
+	def reset(cls): 
+		# Forget shared sessions, e.g. after credentials changed
+		with cls._sessions_lock: 
+			cls._sessions.clear()
+
+
+	def request(self, list_id, method, url, **kwargs): 
+		# Request `url` for list `list_id`, logging the list in first if the host asks for it
+		logins = self._logins.get(list_id, 0)
+		response = self.session.request(method, url, **kwargs)
+		if not self._is_login_form(response): 
+			return response
+
+		self.login(list_id, seen=logins)
+		response = self.session.request(method, url, **kwargs)
+		if self._is_login_form(response): 
+			raise LoginError("Login to {} failed for {}".format(self.netloc, list_id))
+
+		return response
+
+
+	def login(self, list_id, seen=None): 
+		# Log `list_id` in and save the cookies. Skipped if another thread logged the list in since the rejected 
+		# request was made, when `seen` logins had happened.
+		with self._login_lock: 
+			if seen is not None and self._logins.get(list_id, 0) != seen: return
 
-		
-	def _init_login(self): 
-		# First login to obtain cookies
-		session = requests.session()
-		session.post(os.path.join(self.host, self.list_id), self.login_data)
+			self.session.post(os.path.join(self.host, list_id), self.login_data)
+			self._logins[list_id] = self._logins.get(list_id, 0) + 1
+			metrics.count('http_logins_total', host=self.netloc, list=list_id)
+			logger.info("Logged in to {} for {}".format(self.netloc, list_id))
 
-		return session
+			self._save_cookies()
 
 
-	def _save_session(self): 
+	def _mount_adapters(self, pool_size): 
+		# Share one keep-alive connection pool for the host across all lists and threads
+		self.pool_size = pool_size
+		adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+
+
+	def _is_login_form(self, response): 
+
+		if response.status_code == 401: return True
+		if 'html' not in response.headers.get('Content-Type', 'text/html'): return False
+		return LOGIN_FORM_RE.search(response.content) is not None
+
+
+	def _save_cookies(self): 
 		# Check that cookies folder exists and create if not
 		if not os.path.isdir(os.path.dirname(self.cookies_path)): 
 			os.makedirs(os.path.dirname(self.cookies_path))
 
 		# Save session cookies
-		with open(self.cookies_path, 'wb') as f: 
-			pickle.dump(requests.utils.dict_from_cookiejar(self.session.cookies), f)
-
-			logger.info("Session cookies saved to: "+self.cookies_path)
+		atomic_write(self.cookies_path, pickle.dumps(requests.utils.dict_from_cookiejar(self.session.cookies)), mode='wb')
+		logger.info("Session cookies saved to: "+self.cookies_path)
 
 
-	def _load_session(self): 
+	def _load_cookies(self): 
 		# Load session from cookies
 		with open(self.cookies_path, 'rb') as f: 
-			session = requests.session()
-			session.cookies = requests.utils.cookiejar_from_dict(pickle.load(f))
+			self.session.cookies = requests.utils.cookiejar_from_dict(pickle.load(f))
 
-			logger.info("Session cookies loaded from: "+self.cookies_path)
+		logger.info("Session cookies loaded from: "+self.cookies_path)
 
-		return session
+
+class Session(): 
+	# Requests of one list, made through the session shared by every list on its host
+
+	def __init__(self, list_id, host, login='../credentials/MIT_login.json', pool_size=10):
+
+		self.list_id = list_id
+		self.host    = host
+
+		self.host_session = HostSession.for_host(self.host, login=login, pool_size=pool_size)
+		self.session = self.host_session.session
 
 
 	def get_html(self, url): 
 		# Return HRML for a given URL
-		response = self.session.post(url)
+		response = self._request('GET', url)
 		return BeautifulSoup(response.text, 'html.parser')
 
 
+	def get_raw(self, url): 
+		# Response body exactly as received
+		return self._request('GET', url).content
+
+
+	def get_file(self, url): 
+		# Body of a file download, or None if the server does not have it
+		response = self._request('GET', url)
+		if response.status_code == 404: return None
+		response.raise_for_status()
+
+		return response.content
+
+
+	def get_conditional(self, url, validator=None): 
+		# Conditional GET. Returns the page text, or None if the page is unchanged since `validator` was recorded 
+		# (either a 304 response or an identical body), together with the validator for the current version.
+		validator = validator or {}
+
+		headers = {}
+		if validator.get('etag'): headers['If-None-Match'] = validator['etag']
+		if validator.get('last_modified'): headers['If-Modified-Since'] = validator['last_modified']
+
+		response = self._request('GET', url, headers=headers)
+		if response.status_code == 304: 
+			return None, validator
+
+		new_validator = {
+			'etag' : response.headers.get('ETag'), 
+			'last_modified' : response.headers.get('Last-Modified'), 
+			'digest' : hashlib.sha1(response.content).hexdigest()
+		}
+		if validator.get('digest') == new_validator['digest']: 
+			return None, new_validator
+
+		return response.text, new_validator
+
+
+	def _request(self, method, url, **kwargs): 
+		# Every request of the session goes through here so that request counts, bytes and latency are recorded
+		with metrics.timer('http_request_seconds', list=self.list_id): 
+			response = self.host_session.request(self.list_id, method, url, **kwargs)
+
+		metrics.count('http_requests_total', list=self.list_id, method=method, status=response.status_code)
+		metrics.count('http_response_bytes_total', len(response.content), list=self.list_id)
+
+		return response
+
+
+
+
+# Fields of a manifest row that are sent to Google Calendar
+EVENT_FIELDS = [ 'summary', 'description', 'location', 'start', 'end' ]
+
+# HTTP statuses worth retrying: rate limits and transient server errors
+RETRY_STATUSES = [ 403, 429, 500, 502, 503, 504 ]
+
+# HTTP statuses of an event that no longer exists, which is what a delete is after
+GONE_STATUSES = [ 404, 410 ]
+
+# Events per page when listing a calendar, the most the API allows
+LIST_PAGE_SIZE = 2500
+
+
+def calendar_body(metadata, private=None): 
+	# `private` is stored with the event as private extended properties, e.g. to find the manifest rows of an event
+	body = { key: metadata[key] for key in EVENT_FIELDS if key in metadata }
+	if private: body['extendedProperties'] = { 'private': private }
+
+	return body
+
+
+_calendar_api = None
+_calendar_api_lock = threading.Lock()
+
+def get_calendar_api(): 
+	# One authenticated client per process, shared by every list
+	global _calendar_api
+	with _calendar_api_lock: 
+		if _calendar_api is None: 
+			_calendar_api = GoogleCalAPI()
+	return _calendar_api
 
 
 class GoogleCalAPI(): 
 
-	def __init__(self): 
+	def __init__(self, service=None, calendar_ids_path='../credentials/.calendar_ids.json', batch_size=50, max_retries=3, retry_delay=1.): 
+
+		self.service = service or self._get_service()
 
-		self.service = self._get_service()
+		# Calendar name -> ID, persisted so runs do not need to fetch the calendar list
+		self.calendar_ids_path = calendar_ids_path
+		self.calendar_ids = self._load_calendar_ids()
 
-		self.calendar_list = self.get_calendar_list()
+		# Requests per batch call and retry rounds for failed items
+		self.batch_size  = batch_size
+		self.max_retries = max_retries
+		self.retry_delay = retry_delay
+
+		self._calendar_list = None
+
+
+	@property
+	def calendar_list(self): 
+		# Fetched on first use only
+		if self._calendar_list is None: 
+			self._calendar_list = self.get_calendar_list()
+		return self._calendar_list
 
 
 	def _get_service(self): 
 
+		# Google API modules are slow to import, so only load them when the calendar is actually used
+		from googleapiclient.discovery import build
+		from httplib2 import Http
+		from oauth2client import file, client, tools
+
 		# Setup the Gmail API
 		SCOPES = 'https://www.googleapis.com/auth/calendar'
 
@@ -116,15 +314,24 @@ class GoogleCalAPI():
 
 	def get_calendar_list(self): 
 
+		metrics.count('calendar_requests_total')
 		return self.service.calendarList().list().execute().get('items')
 
 
 	def get_calendar_ID(self, calendar_name): 
 		# Get first instance of matching calendar name, or create new calendar if it does not exist
+		if calendar_name in self.calendar_ids: 
+			return self.calendar_ids[calendar_name]
+
 		results = [ cal['id'] for cal in self.calendar_list if cal.get('summary') == calendar_name ]
 
-		if len(results) > 0: return results[0]
-		else: return self.create_calendar(calendar_name)
+		if len(results) > 0: calendar_ID = results[0]
+		else: calendar_ID = self.create_calendar(calendar_name)
+
+		self.calendar_ids[calendar_name] = calendar_ID
+		self._save_calendar_ids()
+
+		return calendar_ID
 
 
 	def create_calendar(self, calendar_name): 
@@ -136,7 +343,8 @@ class GoogleCalAPI():
 
 		# Create new calendar and update calendar list
 		created_calendar = self.service.calendars().insert(body=calendar).execute()
-		self.calendar_list = self.get_calendar_list()
+		metrics.count('calendar_requests_total')
+		self._calendar_list = None
 
 		logger.info("{} calendar created: {}".format(calendar_name, created_calendar['id']))
 
@@ -152,19 +360,175 @@ class GoogleCalAPI():
 		calendar_ID = self.get_calendar_ID(calendar_name)
 
 		event = self.service.events().insert(calendarId=calendar_ID, body=metadata).execute()
+		metrics.count('calendar_requests_total')
 		logger.info('Event created: %s' % (event.get('htmlLink')))
 
 		return event
 
 
-	def edit_event(self): 
+	def create_events(self, calendar_name, metadatas): 
+		# Insert many events using batch requests. Returns one created event per metadata, or None for items that 
+		# still failed after `max_retries` rounds. Only failed items are retried.
+		inserted, _, _ = self.apply_changes(calendar_name, inserts=[calendar_body(metadata) for metadata in metadatas])
+
+		logger.info('{} of {} events created in {}'.format(sum(result is not None for result in inserted), len(inserted), calendar_name))
+
+		return inserted
+
+
+	def edit_event(self, calendar_name, event_id, body): 
+		# Patch the fields of `body` on an existing event; fields set to None are cleared
+		calendar_ID = self.get_calendar_ID(calendar_name)
+
+		event = self.service.events().patch(calendarId=calendar_ID, eventId=event_id, body=body).execute()
+		metrics.count('calendar_requests_total')
+		logger.info('Event edited: %s' % (event.get('htmlLink')))
+
+		return event
 
-		pass
 
+	def delete_event(self, calendar_name, event_id): 
+		# Returns False if the event was already gone
+		calendar_ID = self.get_calendar_ID(calendar_name)
 
-	def delete_event(self): 
+		try: 
+			self.service.events().delete(calendarId=calendar_ID, eventId=event_id).execute()
+		except Exception as e: 
+			if self._status(e) not in GONE_STATUSES: raise
+			return False
+		finally: 
+			metrics.count('calendar_requests_total')
+
+		logger.info('Event deleted: %s' % (event_id))
+
+		return True
+
+
+	def apply_changes(self, calendar_name, inserts=(), patches=(), deletes=()): 
+		# Inserts, patches and deletes sent together in batch requests. `inserts` are event bodies, `patches` are
+		# `(event_id, body)` pairs and `deletes` are event ids. Returns the results of each kind in order, None for
+		# items that failed. Deleting an event that is already gone succeeds.
+		calendar_ID = self.get_calendar_ID(calendar_name)
+		events = self.service.events
+
+		calls  = [ (lambda body=body: events().insert(calendarId=calendar_ID, body=body)) for body in inserts ]
+		calls += [ (lambda event_id=event_id, body=body: events().patch(calendarId=calendar_ID, eventId=event_id, body=body)) for event_id, body in patches ]
+		calls += [ (lambda event_id=event_id: events().delete(calendarId=calendar_ID, eventId=event_id)) for event_id in deletes ]
+
+		results = self.execute_batch(calls, gone_ok=range(len(inserts) + len(patches), len(calls)))
+
+		return results[:len(inserts)], results[len(inserts):len(inserts) + len(patches)], results[len(inserts) + len(patches):]
+
+
+	def list_events(self, calendar_name, sync_token=None): 
+		# Every event of a calendar, or only the events changed since `sync_token` including deleted ones (status 
+		# `cancelled`). Returns the events and the sync token for the next call. Raises `SyncTokenExpired` when the 
+		# calendar asks for a full listing again.
+		calendar_ID = self.get_calendar_ID(calendar_name)
 
-		pass
+		events, page_token = [], None
+		while True: 
+			kwargs = { 'calendarId': calendar_ID, 'maxResults': LIST_PAGE_SIZE }
+			if sync_token: kwargs['syncToken'] = sync_token
+			if page_token: kwargs['pageToken'] = page_token
+
+			try: 
+				response = self.service.events().list(**kwargs).execute()
+			except Exception as e: 
+				if sync_token and self._status(e) == 410: raise SyncTokenExpired(calendar_name)
+				raise
+			finally: 
+				metrics.count('calendar_requests_total')
+
+			events += response.get('items', [])
+			page_token = response.get('nextPageToken')
+			if not page_token: 
+				return events, response.get('nextSyncToken')
+
+
+	def execute_batch(self, calls, gone_ok=()): 
+		# `calls` are callables building API requests, so failed items can be rebuilt and retried. Requests at 
+		# positions in `gone_ok` succeed with an empty response if their event no longer exists.
+		results = [None] * len(calls)
+		pending = list(range(len(calls)))
+		gone_ok = set(gone_ok)
+
+		for attempt in range(self.max_retries + 1): 
+			failed = []
+
+			def callback(request_id, response, exception): 
+				position = int(request_id)
+				if exception is None: 
+					results[position] = response if response is not None else ''
+				elif position in gone_ok and self._status(exception) in GONE_STATUSES: 
+					results[position] = ''
+				elif self._is_retryable(exception): 
+					failed.append(position)
+				else: 
+					logger.warning('Calendar request {} failed: {}'.format(position, exception))
+
+			for i in range(0, len(pending), self.batch_size): 
+				chunk = pending[i:i+self.batch_size]
+				batch = self.service.new_batch_http_request(callback=callback)
+				for position in chunk: 
+					batch.add(calls[position](), request_id=str(position))
+				try: 
+					with metrics.timer('calendar_batch_seconds'): 
+						batch.execute()
+				except Exception as e: 
+					# The batch request itself failed, e.g. a reset connection or a 5xx or 429 from the batch endpoint.
+					# Items of the chunk without a result are retried like failed items, and other chunks go on.
+					logger.warning('Calendar batch of {} requests failed: {}'.format(len(chunk), e))
+					if self._is_retryable(e): 
+						failed += [ position for position in chunk if results[position] is None and position not in failed ]
+				metrics.count('calendar_batches_total')
+				metrics.count('calendar_requests_total', len(chunk))
+
+			pending = sorted(failed)
+			if len(pending) == 0: break
+
+			if attempt < self.max_retries: 
+				logger.info('Retrying {} failed calendar requests'.format(len(pending)))
+				metrics.count('calendar_retries_total', len(pending))
+				time.sleep(self.retry_delay * 2 ** attempt)
+
+		for position in pending: 
+			logger.warning('Calendar request {} failed after {} retries'.format(position, self.max_retries))
+		metrics.count('calendar_failures_total', sum(result is None for result in results))
+
+		return results
+
+
+	####################################
+	#####     HELPER FUNCTIONS     #####
+	####################################
+
+	def _status(self, exception): 
+
+		status = getattr(getattr(exception, 'resp', None), 'status', None)
+		return None if status is None else int(status)
+
+
+	def _is_retryable(self, exception): 
+
+		status = self._status(exception)
+		return status is None or status in RETRY_STATUSES
+
+
+	def _load_calendar_ids(self): 
+
+		if self.calendar_ids_path and os.path.isfile(self.calendar_ids_path): 
+			with open(self.calendar_ids_path, 'r') as f: 
+				return json.load(f)
+		return {}
+
+
+	def _save_calendar_ids(self): 
+
+		if self.calendar_ids_path: 
+			if os.path.dirname(self.calendar_ids_path): 
+				os.makedirs(os.path.dirname(self.calendar_ids_path), exist_ok=True)
+			atomic_write(self.calendar_ids_path, json.dumps(self.calendar_ids, indent=1))
 
 
 
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import re
+import zlib
+
+import numpy as np
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS similarity_buckets (
+	bucket INTEGER NOT NULL,
+	row_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS similarity_buckets_bucket ON similarity_buckets (bucket);
+CREATE TABLE IF NOT EXISTS similarity_indexed (
+	row_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS similarity_params (
+	params TEXT NOT NULL
+);
+"""
+
+# MinHash parameters. 16 bands of 4 rows put the threshold near a shingle Jaccard similarity of 0.5: messages at
+# 0.7 become candidates about 99% of the time, at 0.5 about 64% of the time and at 0.1 about 0.2% of the time, so
+# unrelated announcements rarely share a bucket however large the manifest gets.
+N_BANDS   = 16
+BAND_ROWS = 4
+SHINGLE   = 3
+PRIME     = (1 << 31) - 1
+
+# Candidates returned per lookup, most shared bands first. Each one costs an exact rescore.
+MAX_CANDIDATES = 20
+
+# Indexes built with other parameters are dropped and rebuilt
+PARAMS = '{}x{}x{}'.format(N_BANDS, BAND_ROWS, SHINGLE)
+
+_random = np.random.RandomState(20180301)
+_A = _random.randint(1, PRIME, size=N_BANDS * BAND_ROWS).astype(np.uint64)
+_B = _random.randint(0, PRIME, size=N_BANDS * BAND_ROWS).astype(np.uint64)
+
+
+def normalize_message(text): 
+	# Same normalization as `Events.similarity`, followed by lowercasing and word tokenization
+	text = str(text).replace('\n', '').replace('> ', '')
+	return re.findall(r'\w+', text.lower())
+
+
+def shingles(text): 
+
+	words = normalize_message(text)
+	if len(words) < SHINGLE: 
+		return { ' '.join(words) } if words else set()
+	return { ' '.join(words[i:i+SHINGLE]) for i in range(len(words) - SHINGLE + 1) }
+
+
+def band_buckets(text): 
+	# LSH bucket of each MinHash band of `text`. Bucket ids embed the band number so one column can hold all bands.
+	hashes = np.array([zlib.crc32(s.encode('utf-8')) for s in shingles(text)], dtype=np.uint64)
+	if len(hashes) == 0: 
+		return []
+
+	signature = ((np.outer(_A, hashes) + _B[:, None]) % PRIME).min(axis=1)
+
+	buckets = []
+	for band in range(N_BANDS): 
+		rows = signature[band * BAND_ROWS:(band + 1) * BAND_ROWS]
+		bucket = zlib.crc32(rows.tobytes())
+		buckets.append((band << 32) | bucket)
+
+	return buckets
+
+
+class SimilarityIndex(): 
+	# MinHash/LSH index over manifest messages, stored in the manifest's SQLite database. Lookups return the
+	# row ids of likely near-duplicates, which callers rescore exactly.
+
+	def __init__(self, conn): 
+
+		self.conn = conn
+		self.conn.executescript(SCHEMA)
+
+		row = self.conn.execute('SELECT params FROM similarity_params').fetchone()
+		if row is None or row[0] != PARAMS: 
+			with self.conn: 
+				self.clear()
+				self.conn.execute('DELETE FROM similarity_params')
+				self.conn.execute('INSERT INTO similarity_params (params) VALUES (?)', (PARAMS,))
+
+
+	def add(self, row_id, message): 
+		# Does not commit, so the caller can make the index update part of the same transaction as the row insert
+		self.conn.executemany('INSERT INTO similarity_buckets (bucket, row_id) VALUES (?, ?)',
+							  [(bucket, row_id) for bucket in band_buckets(message)])
+		self.conn.execute('INSERT OR IGNORE INTO similarity_indexed (row_id) VALUES (?)', (row_id,))
+
+
+	def clear(self): 
+		# Does not commit either
+		self.conn.execute('DELETE FROM similarity_buckets')
+		self.conn.execute('DELETE FROM similarity_indexed')
+
+
+	def candidates(self, message, limit=MAX_CANDIDATES): 
+		# The `limit` rows sharing the most bands with `message`. The share of bands in common estimates the
+		# Jaccard similarity, so only the likeliest near-duplicates are rescored.
+		buckets = band_buckets(message)
+		if len(buckets) == 0: 
+			return set()
+
+		placeholders = ','.join('?' * len(buckets))
+		rows = self.conn.execute('SELECT row_id, COUNT(*) AS hits FROM similarity_buckets WHERE bucket IN ({}) '
+								 'GROUP BY row_id ORDER BY hits DESC, row_id LIMIT ?'.format(placeholders), buckets + [limit])
+		return { row[0] for row in rows }
+
+
+	def unindexed(self, table='listings'): 
+		# Row ids in `table` that have not been added to the index yet, e.g. rows migrated from an older manifest
+		rows = self.conn.execute('SELECT row_id FROM {} WHERE row_id NOT IN (SELECT row_id FROM similarity_indexed)'.format(table))
+		return [row[0] for row in rows]
@@ -3,10 +3,13 @@
 # Core python modules
 import os
 import logging
+import argparse
 
 # External modules
 from download_listings import ListServe
 from events import Events
+from pipeline import Pipeline
+from metrics import metrics
 
 
 LIST_SERVES = [
@@ -32,20 +35,74 @@ LIST_SERVES = [
 	}
 ]
 
+# Number of listings downloaded concurrently per list
+DOWNLOAD_WORKERS = 8
 
-def main(): 
+
+def update_list(l, get_events, parse_workers=1, stream=False, monthly=False): 
+	# One update of list serve `l`. `get_events` returns the list's Events, so a long-running process can keep its 
+	# manifest open between updates. Returns the number of new listings, or None if nothing changed upstream.
+
+	# Fast path: nothing changed upstream and nothing is waiting to be parsed, so skip loading the manifest and SUTime
+	if not l.pending and not l.has_changes(): 
+		return None
+
+	n_known = len(l.registry)
+
+	# Parse listings as they are downloaded, while they are written to disk in the background
+	if stream: 
+		get_events().ingest_stream(l.stream_listings())
+		l.mark_processed()
+		return len(l.registry) - n_known
+
+	# Download any new listings
+	l.update_local_dir(monthly=monthly)
+
+	if l.pending: 
+		get_events().update_manifest(workers=parse_workers)
+		l.mark_processed()
+
+	return len(l.registry) - n_known
+
+
+def main(parse_workers=1, stream=False, monthly=False): 
 
 	for list_serve in LIST_SERVES: 
 
-		# Download any new listings
-		l = ListServe(list_serve["list_id"], list_serve["host"])
-		l.update_local_dir()
+		l = ListServe(list_serve["list_id"], list_serve["host"], workers=DOWNLOAD_WORKERS)
+		get_events = lambda: Events(list_id=list_serve["list_id"], calendar_name=list_serve["cal_name"])
+
+		if update_list(l, get_events, parse_workers=parse_workers, stream=stream, monthly=monthly) is None: 
+			print("{}: no changes.".format(list_serve["list_id"]))
+
+
 
-		e = Events(list_id=list_serve["list_id"], calendar_name=list_serve["cal_name"])
-		e.update_manifest()
+def main_async(): 
+	# All lists concurrently, with downloads streaming into parsing
+	Pipeline(LIST_SERVES, download_workers=DOWNLOAD_WORKERS).run()
+
+
+def parse_args(): 
+
+	parser = argparse.ArgumentParser(description='Download new listings and push talks to Google Calendar.')
+	parser.add_argument('--async', dest='use_async', action='store_true', help='Process all lists concurrently with the asyncio pipeline')
+	parser.add_argument('--stream', action='store_true', help='Parse listings from memory as they are downloaded')
+	parser.add_argument('--parse-workers', type=int, default=1, help='Parse new listings on this many processes')
+	parser.add_argument('--monthly', action='store_true', help='Download new listings from the monthly archive files, e.g. to backfill a list')
+	parser.add_argument('--metrics', help='Write a JSON report of stage timings and counters for this run to this path')
+	parser.add_argument('--prometheus', help='Write the same metrics in Prometheus text format to this path')
+	return parser.parse_args()
 
 
 
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	args = parse_args()
+	if args.metrics or args.prometheus: metrics.enable()
+
+	try: 
+		if args.use_async: main_async()
+		else: main(parse_workers=args.parse_workers, stream=args.stream, monthly=args.monthly)
+	finally: 
+		if args.metrics: metrics.write_report(args.metrics)
+		if args.prometheus: metrics.write_prometheus(args.prometheus)
\ No newline at end of file
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import os
+
+from utils import atomic_write
+
+
+class URLRegistry(): 
+	# In-memory view of a list's `urls.txt` with constant-time membership and index -> URL lookups. Registries are 
+	# shared per file within a process, so the file is read once per run however many listings consult it.
+
+	_registries = {}
+
+	def __init__(self, path): 
+
+		self.path = path
+
+		self.urls      = []
+		self._url_set  = set()
+		self._by_index = {}
+
+		if os.path.isfile(self.path): 
+			with open(self.path, 'r') as f: 
+				for line in f: 
+					self._add(line.rstrip())
+
+
+	@classmethod
+	def load(cls, path): 
+		# Shared registry for `path`
+		key = os.path.abspath(path)
+		if key not in cls._registries: 
+			cls._registries[key] = cls(path)
+
+		return cls._registries[key]
+
+
+	@classmethod
+	def reset(cls): 
+		# Forget shared registries, e.g. after files were changed by another process
+		cls._registries.clear()
+
+
+	def add(self, url): 
+		# Returns False if the URL was already registered
+		if url in self._url_set: return False
+		self._add(url)
+		return True
+
+
+	def url_for(self, index): 
+
+		return self._by_index.get(index)
+
+
+	def save(self): 
+
+		atomic_write(self.path, '\n'.join(self.urls))
+
+
+	def _add(self, url): 
+
+		if not url or url in self._url_set: return
+		self.urls.append(url)
+		self._url_set.add(url)
+		self._by_index.setdefault(os.path.basename(url), url)
+
+
+	def __contains__(self, url): 
+		return url in self._url_set
+
+	def __iter__(self): 
+		return iter(self.urls)
+
+	def __len__(self): 
+		return len(self.urls)
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+
+# Core python modules
+import os
+import tempfile
+
+
+def atomic_write(path, data, mode='w'): 
+	# Write to a temporary file in the same directory, then swap it into place so readers never see a partial file
+	directory = os.path.dirname(path) or '.'
+	fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.'+os.path.basename(path)+'.', suffix='.tmp')
+
+	try: 
+		with os.fdopen(fd, mode) as f: 
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp_path, path)
+	except BaseException: 
+		if os.path.exists(tmp_path): os.remove(tmp_path)
+		raise